@@ -3,18 +3,58 @@
 import asyncio
 from datetime import datetime
 
-from app.services.auto_sync import sync_all_users
+from app.dependencies import (
+    close_citytag_client,
+    close_device_catalog,
+    close_mongo_service,
+    close_token_manager,
+    get_settings,
+    init_citytag_client,
+    init_mongo_service,
+)
+from app.services.auto_sync import create_lease_manager, run_leased_sync
+from app.services.leases import worker_id
+from app.services.sync_checkpoint import TimeBudget
+
+
+async def run_once() -> None:
+    # Each invocation gets its own event loop, so the pooled clients must be
+    # opened and closed inside it rather than reused across warm starts.
+    settings = get_settings()
+    budget = None
+    if settings["sync_time_budget_seconds"] > 0:
+        budget = TimeBudget(settings["sync_time_budget_seconds"], reserve=settings["sync_budget_reserve_seconds"])
+    init_mongo_service()
+    init_citytag_client()
+    # Only shards no API worker holds, and that are due, are synced here
+    leases = create_lease_manager(owner=f"cron:{worker_id()}")
+    heartbeat = asyncio.create_task(leases.heartbeat())
+    try:
+        stats = await run_leased_sync(leases, budget=budget)
+        if stats is None:
+            print("No due shards available — already covered by running workers")
+        elif not stats.complete:
+            print(f"Time budget reached after {stats.users} users — next invocation resumes from the checkpoint")
+    finally:
+        heartbeat.cancel()
+        await leases.release_all()
+        await close_device_catalog()
+        await close_token_manager()
+        await close_citytag_client()
+        close_mongo_service()
+
 
 def handler(event, context):
     """
     Vercel serverless function – triggered by cron every 10 minutes.
-    Runs the full sync job once per call.
+    Syncs whichever shards are due and not leased by a running API worker,
+    stopping within SYNC_TIME_BUDGET_SECONDS and resuming on the next call.
     """
     start = datetime.utcnow()
     print(f"[{start.isoformat()}] Cron job triggered – starting sync")
 
     try:
-        asyncio.run(sync_all_users())
+        asyncio.run(run_once())
     except Exception as e:
         print(f"Sync failed: {e}")
         return {
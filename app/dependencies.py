@@ -1,4 +1,6 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
+import hmac
 import os
 from typing import Annotated
 
@@ -7,32 +9,252 @@ from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, Request, status
 
 from app.models.user import UserInDB, UserPublic
-from app.services.mongodb import MongoService
-from app.services.citytag import CityTagClient
+from app.services.mongodb import (
+    MongoService,
+    close_shared_mongo_service,
+    get_shared_mongo_service,
+    set_shared_mongo_service,
+)
+from app.services.citytag import (
+    CityTagClient,
+    CityTagUnavailableError,
+    build_http_client,
+    close_shared_citytag_client,
+    get_shared_citytag_client,
+    set_shared_citytag_client,
+)
+from app.services.device_catalog import (
+    DeviceCatalog,
+    close_shared_device_catalog,
+    get_shared_device_catalog,
+    set_shared_device_catalog,
+)
+from app.services.jobs import (
+    JobQueue,
+    close_shared_job_queue,
+    get_shared_job_queue,
+    set_shared_job_queue,
+)
 from app.services.location import LocationService
+from app.services.location_store import parse_tiers
+from app.services.point_filter import RecentPointFilter
+from app.services.resilience import CircuitBreaker, RateLimiter
+from app.services.token_manager import (
+    TokenManager,
+    close_shared_token_manager,
+    get_shared_token_manager,
+    set_shared_token_manager,
+)
 
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
 
 
+@lru_cache(maxsize=1)
 def get_settings():
+    # Read once per process; env changes need a restart
     return {
         "mongo_uri": os.getenv("MONGO_URI", "mongodb://localhost:27017/citytag_dashboard"),
         "citytag_base_url": os.getenv("CITYTAG_BASE_URL", "http://citytag.yuminstall.top"),
         "jwt_secret_key": os.getenv("JWT_SECRET_KEY", "change_this_secret_key"),
         "jwt_algorithm": os.getenv("JWT_ALGORITHM", "HS256"),
         "jwt_expire_minutes": int(os.getenv("JWT_EXPIRE_MINUTES", "1440")),
+        "admin_emails": {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()},
+        # Static bearer token for Prometheus scrapes of /metrics; empty leaves it open
+        "metrics_token": os.getenv("METRICS_TOKEN", ""),
+        "mongo_max_pool_size": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        "mongo_min_pool_size": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "mongo_max_idle_time_ms": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+        "mongo_wait_queue_timeout_ms": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000")),
+        "mongo_bulk_chunk_size": int(os.getenv("MONGO_BULK_CHUNK_SIZE", "500")),
+        "location_storage": os.getenv("LOCATION_STORAGE", "documents"),
+        # e.g. "30d:1m,365d:10m" — empty keeps every point forever
+        "retention_tiers": parse_tiers(os.getenv("RETENTION_TIERS", "")),
+        "retention_interval_seconds": float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600")),
+        "retention_budget_seconds": float(os.getenv("RETENTION_BUDGET_SECONDS", "300")),
+        "point_filter_window_seconds": float(os.getenv("POINT_FILTER_WINDOW_SECONDS", "1800")),
+        "point_filter_max_devices": int(os.getenv("POINT_FILTER_MAX_DEVICES", "5000")),
+        "user_cache_ttl_seconds": float(os.getenv("USER_CACHE_TTL_SECONDS", "60")),
+        "user_cache_max_entries": int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000")),
+        "citytag_max_connections": int(os.getenv("CITYTAG_MAX_CONNECTIONS", "100")),
+        "citytag_max_keepalive": int(os.getenv("CITYTAG_MAX_KEEPALIVE", "20")),
+        "citytag_keepalive_expiry": float(os.getenv("CITYTAG_KEEPALIVE_EXPIRY", "30")),
+        "citytag_http2": os.getenv("CITYTAG_HTTP2", "false").lower() in ("1", "true", "yes"),
+        "citytag_connect_timeout": float(os.getenv("CITYTAG_CONNECT_TIMEOUT", "5")),
+        "citytag_timeout": float(os.getenv("CITYTAG_TIMEOUT", "15")),
+        "citytag_history_timeout": float(os.getenv("CITYTAG_HISTORY_TIMEOUT", "45")),
+        "citytag_rate_limit_rps": float(os.getenv("CITYTAG_RATE_LIMIT_RPS", "20")),
+        "citytag_rate_limit_burst": float(os.getenv("CITYTAG_RATE_LIMIT_BURST", "40")),
+        "citytag_user_rate_limit_rps": float(os.getenv("CITYTAG_USER_RATE_LIMIT_RPS", "5")),
+        "citytag_user_rate_limit_burst": float(os.getenv("CITYTAG_USER_RATE_LIMIT_BURST", "10")),
+        "citytag_retry_attempts": int(os.getenv("CITYTAG_RETRY_ATTEMPTS", "3")),
+        "citytag_retry_backoff": float(os.getenv("CITYTAG_RETRY_BACKOFF", "0.5")),
+        "citytag_breaker_threshold": int(os.getenv("CITYTAG_BREAKER_THRESHOLD", "5")),
+        "citytag_breaker_reset_seconds": float(os.getenv("CITYTAG_BREAKER_RESET_SECONDS", "30")),
+        "sync_max_concurrent_users": int(os.getenv("SYNC_MAX_CONCURRENT_USERS", "8")),
+        "sync_max_concurrent_devices": int(os.getenv("SYNC_MAX_CONCURRENT_DEVICES", "32")),
+        "sync_max_devices_per_user": int(os.getenv("SYNC_MAX_DEVICES_PER_USER", "4")),
+        "sync_overlap_seconds": int(os.getenv("SYNC_OVERLAP_SECONDS", "120")),
+        "sync_catch_up_hours": float(os.getenv("SYNC_CATCH_UP_HOURS", "24")),
+        "sync_initial_window_minutes": float(os.getenv("SYNC_INITIAL_WINDOW_MINUTES", "15")),
+        "sync_shards": int(os.getenv("SYNC_SHARDS", "16")),
+        "sync_shards_per_worker": int(os.getenv("SYNC_SHARDS_PER_WORKER", "0")),
+        "sync_lease_ttl_seconds": float(os.getenv("SYNC_LEASE_TTL_SECONDS", "60")),
+        "sync_time_budget_seconds": float(os.getenv("SYNC_TIME_BUDGET_SECONDS", "50")),
+        "sync_budget_reserve_seconds": float(os.getenv("SYNC_BUDGET_RESERVE_SECONDS", "10")),
+        "sync_poll_min_seconds": float(os.getenv("SYNC_POLL_MIN_SECONDS", "60")),
+        "sync_poll_max_seconds": float(os.getenv("SYNC_POLL_MAX_SECONDS", "3600")),
+        "sync_poll_backoff": float(os.getenv("SYNC_POLL_BACKOFF", "2")),
+        "sync_poll_budget_per_minute": float(os.getenv("SYNC_POLL_BUDGET_PER_MINUTE", "120")),
+        "sync_move_threshold_meters": float(os.getenv("SYNC_MOVE_THRESHOLD_METERS", "50")),
+        "sync_job_workers": int(os.getenv("SYNC_JOB_WORKERS", "2")),
+        "sync_job_retain_seconds": float(os.getenv("SYNC_JOB_RETAIN_SECONDS", "3600")),
+        "device_catalog_ttl_seconds": float(os.getenv("DEVICE_CATALOG_TTL_SECONDS", "300")),
+        "citytag_token_refresh_margin_seconds": float(os.getenv("CITYTAG_TOKEN_REFRESH_MARGIN_SECONDS", "300")),
+        "citytag_token_min_lifetime_seconds": float(os.getenv("CITYTAG_TOKEN_MIN_LIFETIME_SECONDS", "300")),
     }
 
 
+def init_mongo_service() -> MongoService:
+    """
+    Create the process-wide MongoService (one client, one connection pool).
+    Called from the app lifespan and from standalone entry points like the cron.
+    """
+    existing = get_shared_mongo_service()
+    if existing is not None:
+        return existing
+
+    settings = get_settings()
+    service = MongoService(
+        settings["mongo_uri"],
+        bulk_chunk_size=settings["mongo_bulk_chunk_size"],
+        location_storage=settings["location_storage"],
+        retention_tiers=settings["retention_tiers"],
+        user_cache_ttl=settings["user_cache_ttl_seconds"],
+        user_cache_size=settings["user_cache_max_entries"],
+        point_filter=RecentPointFilter(
+            window_seconds=settings["point_filter_window_seconds"],
+            max_devices=settings["point_filter_max_devices"],
+        ) if settings["point_filter_window_seconds"] > 0 else None,
+        maxPoolSize=settings["mongo_max_pool_size"],
+        minPoolSize=settings["mongo_min_pool_size"],
+        maxIdleTimeMS=settings["mongo_max_idle_time_ms"],
+        waitQueueTimeoutMS=settings["mongo_wait_queue_timeout_ms"],
+    )
+    set_shared_mongo_service(service)
+    return service
+
+
+def close_mongo_service() -> None:
+    close_shared_mongo_service()
+
+
 def get_mongo_service() -> MongoService:
+    return get_shared_mongo_service() or init_mongo_service()
+
+
+def init_citytag_client() -> CityTagClient:
+    """
+    Create the process-wide CityTagClient with a keep-alive connection pool,
+    so upstream calls reuse TCP/TLS connections instead of re-handshaking.
+    """
+    existing = get_shared_citytag_client()
+    if existing is not None:
+        return existing
+
     settings = get_settings()
-    return MongoService(settings["mongo_uri"])
+    http = build_http_client(
+        max_connections=settings["citytag_max_connections"],
+        max_keepalive_connections=settings["citytag_max_keepalive"],
+        keepalive_expiry=settings["citytag_keepalive_expiry"],
+        connect_timeout=settings["citytag_connect_timeout"],
+        http2=settings["citytag_http2"],
+    )
+    client = CityTagClient(
+        settings["citytag_base_url"],
+        http=http,
+        timeouts={
+            "login": settings["citytag_timeout"],
+            "devices": settings["citytag_timeout"],
+            "latest": settings["citytag_timeout"],
+            "history": settings["citytag_history_timeout"],
+        },
+        limiter=RateLimiter(
+            global_rate=settings["citytag_rate_limit_rps"],
+            global_burst=settings["citytag_rate_limit_burst"],
+            per_key_rate=settings["citytag_user_rate_limit_rps"],
+            per_key_burst=settings["citytag_user_rate_limit_burst"],
+        ),
+        breaker=CircuitBreaker(
+            failure_threshold=settings["citytag_breaker_threshold"],
+            reset_timeout=settings["citytag_breaker_reset_seconds"],
+        ),
+        retry_attempts=settings["citytag_retry_attempts"],
+        retry_backoff=settings["citytag_retry_backoff"],
+    )
+    set_shared_citytag_client(client)
+    return client
+
+
+async def close_citytag_client() -> None:
+    await close_shared_citytag_client()
 
 
 def get_citytag_client() -> CityTagClient:
-    settings = get_settings()
-    return CityTagClient(settings["citytag_base_url"])
+    return get_shared_citytag_client() or init_citytag_client()
+
+
+def get_device_catalog() -> DeviceCatalog:
+    catalog = get_shared_device_catalog()
+    if catalog is None:
+        settings = get_settings()
+        catalog = DeviceCatalog(
+            get_mongo_service(),
+            get_citytag_client(),
+            ttl_seconds=settings["device_catalog_ttl_seconds"],
+            tokens=get_token_manager(),
+        )
+        set_shared_device_catalog(catalog)
+    return catalog
+
+
+async def close_device_catalog() -> None:
+    await close_shared_device_catalog()
+
+
+def get_token_manager() -> TokenManager:
+    manager = get_shared_token_manager()
+    if manager is None:
+        settings = get_settings()
+        manager = TokenManager(
+            get_mongo_service(),
+            get_citytag_client(),
+            refresh_margin=settings["citytag_token_refresh_margin_seconds"],
+            min_lifetime=settings["citytag_token_min_lifetime_seconds"],
+        )
+        set_shared_token_manager(manager)
+    return manager
+
+
+async def close_token_manager() -> None:
+    await close_shared_token_manager()
+
+
+def get_job_queue() -> JobQueue:
+    queue = get_shared_job_queue()
+    if queue is None:
+        settings = get_settings()
+        queue = JobQueue(
+            get_mongo_service(),
+            workers=settings["sync_job_workers"],
+            retain_seconds=settings["sync_job_retain_seconds"],
+        )
+        set_shared_job_queue(queue)
+    return queue
+
+
+async def close_job_queue() -> None:
+    await close_shared_job_queue()
 
 
 def create_access_token(subject: str) -> str:
@@ -85,7 +307,7 @@ async def get_current_user(
             detail="Invalid token payload",
         )
 
-    user = await mongo.get_user_by_id(user_id)
+    user = await mongo.get_user_by_id(user_id, cached=True)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -95,6 +317,41 @@ async def get_current_user(
     return user
 
 
+async def get_admin_user(
+    current_user: Annotated[UserInDB, Depends(get_current_user)],
+) -> UserInDB:
+    """Authenticated user whose email is listed in ADMIN_EMAILS."""
+    if current_user.email.lower() not in get_settings()["admin_emails"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required",
+        )
+    return current_user
+
+
+async def verify_metrics_token(request: Request) -> None:
+    """Check the scrape token for /metrics, when METRICS_TOKEN is set."""
+    expected = get_settings()["metrics_token"]
+    if not expected:
+        return
+    auth_header = request.headers.get("Authorization") or ""
+    supplied = auth_header.split(" ", 1)[1].strip() if auth_header.startswith("Bearer ") else ""
+    if not hmac.compare_digest(supplied.encode(), expected.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+        )
+
+
+def citytag_unavailable(exc: CityTagUnavailableError) -> HTTPException:
+    """503 with Retry-After, so clients back off instead of piling up while CityTag is down."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(exc),
+        headers={"Retry-After": str(max(1, int(exc.retry_after)))},
+    )
+
+
 def user_to_public(user: UserInDB) -> UserPublic:
     return UserPublic(
         id=str(user.id),
@@ -106,5 +363,5 @@ def user_to_public(user: UserInDB) -> UserPublic:
 def get_location_service(
     mongo: Annotated[MongoService, Depends(get_mongo_service)]
 ) -> LocationService:
-    return LocationService(mongo.db)
+    return LocationService(mongo.location_store)
 
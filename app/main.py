@@ -1,4 +1,7 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.routers.auth import router as auth_router
@@ -6,11 +9,66 @@ from app.routers.devices import router as devices_router
 from app.routers.location import router as location_router
 from app.routers.history import router as history_router
 from app.routers.sync import router as sync_router
-from app.services.auto_sync import start_auto_sync_tasks
+from app.routers.backfill import router as backfill_router
+from app.dependencies import (
+    close_citytag_client,
+    close_device_catalog,
+    close_job_queue,
+    close_mongo_service,
+    close_token_manager,
+    get_admin_user,
+    get_citytag_client,
+    get_mongo_service,
+    get_settings,
+    get_token_manager,
+    init_citytag_client,
+    init_mongo_service,
+    verify_metrics_token,
+)
+from app.services import metrics
+from app.services.auto_sync import start_auto_sync_tasks, stop_auto_sync_tasks
+from app.services.backfill import cancel_backfills
+from app.services.indexes import check_query_plans, ensure_indexes, warn_on_bad_plans
+from app.services.retention import start_retention_task
+
+
+async def prepare_database(app: FastAPI, mongo) -> None:
+    # In the background, so an unreachable Mongo doesn't block startup
+    await ensure_indexes(mongo.db, mongo.location_store)
+    # Kept for /health/indexes, so the explain() queries run once rather than per request
+    app.state.query_plans = await warn_on_bad_plans(mongo.db)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One Mongo client and one CityTag HTTP pool per process,
+    # shared by routers and auto sync
+    mongo = init_mongo_service()
+    init_citytag_client()
+    app.state.query_plans = None
+    index_task = asyncio.create_task(prepare_database(app, mongo))
+    sync_task = start_auto_sync_tasks()
+    settings = get_settings()
+    retention_task = start_retention_task(
+        mongo, settings["retention_interval_seconds"], settings["retention_budget_seconds"],
+    )
+    try:
+        yield
+    finally:
+        index_task.cancel()
+        if retention_task is not None:
+            retention_task.cancel()
+        await stop_auto_sync_tasks(sync_task)
+        await cancel_backfills()
+        await close_job_queue()
+        await close_device_catalog()
+        await close_token_manager()
+        await close_citytag_client()
+        close_mongo_service()
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="CityTag Tracking Dashboard API")
+    app = FastAPI(title="CityTag Tracking Dashboard API", lifespan=lifespan)
 
     # CORS for local development – adjust origins as needed
     app.add_middleware(
@@ -26,13 +84,36 @@ def create_app() -> FastAPI:
     app.include_router(location_router)
     app.include_router(history_router)
     app.include_router(sync_router)
-    start_auto_sync_tasks(app)
-    
+    app.include_router(backfill_router)
 
     @app.get("/health")
     async def health_check():
         return {"status": "ok"}
 
+    # Pool sizes, query plans and upstream state: admins only
+    admin_only = [Depends(get_admin_user)]
+
+    @app.get("/health/mongo", dependencies=admin_only)
+    async def mongo_pool_stats():
+        mongo = get_mongo_service()
+        point_filter = mongo.point_filter.stats() if mongo.point_filter else None
+        return {**mongo.pool_stats(), "point_filter": point_filter}
+
+    @app.get("/health/indexes", dependencies=admin_only)
+    async def query_plans(refresh: bool = Query(False, description="Re-run explain() instead of using the startup report")):
+        if refresh or app.state.query_plans is None:
+            app.state.query_plans = await check_query_plans(get_mongo_service().db)
+        return {"queries": app.state.query_plans}
+
+    # Scraped by Prometheus, which can't hold a user login: a static token instead
+    @app.get("/metrics", include_in_schema=False, dependencies=[Depends(verify_metrics_token)])
+    async def prometheus_metrics():
+        return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+    @app.get("/health/upstream", dependencies=admin_only)
+    async def upstream_stats():
+        return {**get_citytag_client().stats(), "tokens": get_token_manager().stats()}
+
     return app
 
 
@@ -48,6 +48,8 @@ class TrajectoryResponse(BaseModel):
     """GeoJSON-compatible response for drawing route line"""
     feature: TrajectoryFeature
     count: int
+    original_count: int               # stored points before simplification
+    tolerance_m: Optional[float] = None
     start_time: datetime
     end_time: datetime
     device_sn: str
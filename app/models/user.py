@@ -36,6 +36,7 @@ class UserInDB(BaseModel):
 
     # Optional cached CityTag token
     citytag_token: Optional[str] = None
+    citytag_token_at: Optional[datetime] = None
 
     class Config:
         json_encoders = {ObjectId: str}
@@ -4,14 +4,19 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel, EmailStr
 
 from app.dependencies import (
+    citytag_unavailable,
     create_access_token,
     get_citytag_client,
+    get_device_catalog,
     get_mongo_service,
+    get_token_manager,
     user_to_public,
 )
 from app.models.user import UserCreate, UserPublic
-from app.services.citytag import CityTagClient, CityTagError
+from app.services.citytag import CityTagClient, CityTagError, CityTagUnavailableError
+from app.services.device_catalog import DeviceCatalog
 from app.services.mongodb import MongoService
+from app.services.token_manager import TokenManager
 
 
 router = APIRouter(prefix="/api", tags=["auth"])
@@ -34,6 +39,8 @@ async def login(
     payload: LoginRequest,
     mongo: Annotated[MongoService, Depends(get_mongo_service)],
     citytag: Annotated[CityTagClient, Depends(get_citytag_client)],
+    tokens: Annotated[TokenManager, Depends(get_token_manager)],
+    catalog: Annotated[DeviceCatalog, Depends(get_device_catalog)],
 ):
     """
     Login endpoint.
@@ -44,6 +51,9 @@ async def login(
     """
     try:
         citytag_data = await citytag.login(username=payload.email, password=payload.password)
+    except CityTagUnavailableError as exc:
+        # Upstream down or circuit open — not the caller's credentials
+        raise citytag_unavailable(exc)
     except CityTagError as exc:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -63,6 +73,9 @@ async def login(
         uid=payload.uid,
     )
     user = await mongo.create_or_update_user(user_data, citytag_token=token)
+    tokens.store_login(user, citytag_data)
+    # A (re-)login may be for a different CityTag account or device set
+    catalog.invalidate(user.uid)
 
     access_token = create_access_token(str(user.id))
 
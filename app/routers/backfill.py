@@ -0,0 +1,82 @@
+# app/routers/backfill.py
+from datetime import datetime, timedelta
+from typing import Annotated, Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel, Field
+
+from app.dependencies import (
+    get_admin_user,
+    get_citytag_client,
+    get_mongo_service,
+    get_token_manager,
+)
+from app.models.user import UserInDB
+from app.services.backfill import BackfillJob, get_running_backfill, start_backfill
+from app.services.citytag import CityTagClient
+from app.services.location_store import naive_utc
+from app.services.mongodb import MongoService
+from app.services.token_manager import TokenManager
+
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+
+class BackfillRequest(BaseModel):
+    uid: str
+    sn: str
+    start: datetime
+    end: Optional[datetime] = None
+    chunk_hours: float = Field(default=24, gt=0, le=24 * 31)
+    concurrency: int = Field(default=4, ge=1, le=32)
+
+
+@router.post("/backfill", status_code=status.HTTP_202_ACCEPTED)
+async def create_backfill(
+    payload: BackfillRequest,
+    admin: Annotated[UserInDB, Depends(get_admin_user)],
+    mongo: Annotated[MongoService, Depends(get_mongo_service)],
+    citytag: Annotated[CityTagClient, Depends(get_citytag_client)],
+    tokens: Annotated[TokenManager, Depends(get_token_manager)],
+) -> Dict[str, Any]:
+    """
+    Start (or resume) a chunked history backfill for one device in the
+    background. Repeating the same request returns the same job.
+    """
+    user = await mongo.users.find_one({"uid": payload.uid})
+    if not user:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, f"No user with uid {payload.uid}")
+
+    try:
+        job = BackfillJob(
+            mongo,
+            citytag,
+            tokens,
+            user,
+            sn=payload.sn,
+            start=naive_utc(payload.start),
+            end=naive_utc(payload.end) if payload.end else datetime.utcnow(),
+            chunk=timedelta(hours=payload.chunk_hours),
+            concurrency=payload.concurrency,
+        )
+    except ValueError as exc:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(exc))
+
+    return start_backfill(job).summary()
+
+
+@router.get("/backfill/{job_id}")
+async def backfill_status(
+    job_id: str,
+    admin: Annotated[UserInDB, Depends(get_admin_user)],
+    mongo: Annotated[MongoService, Depends(get_mongo_service)],
+) -> Dict[str, Any]:
+    running = get_running_backfill(job_id)
+    if running is not None:
+        return running.summary()
+
+    doc = await mongo.get_backfill_job(job_id)
+    if not doc:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Backfill job not found")
+    doc["job_id"] = doc.pop("_id")
+    return doc
@@ -2,10 +2,11 @@ from typing import Annotated, Any, Dict, List
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 
-from app.dependencies import get_citytag_client, get_current_user, get_mongo_service
+from app.dependencies import citytag_unavailable, get_current_user, get_device_catalog, get_token_manager
 from app.models.user import UserInDB
-from app.services.citytag import CityTagClient, CityTagError
-from app.services.mongodb import MongoService
+from app.services.citytag import CityTagError, CityTagUnavailableError
+from app.services.device_catalog import DeviceCatalog
+from app.services.token_manager import TokenManager
 
 
 router = APIRouter(prefix="/api", tags=["devices"])
@@ -15,27 +16,20 @@ router = APIRouter(prefix="/api", tags=["devices"])
 async def list_devices(
     sn: str | None = Query(default=None, description="Optional device SN filter"),
     current_user: Annotated[UserInDB, Depends(get_current_user)] = None,
-    citytag: Annotated[CityTagClient, Depends(get_citytag_client)] = None,
-    mongo: Annotated[MongoService, Depends(get_mongo_service)] = None,
+    catalog: Annotated[DeviceCatalog, Depends(get_device_catalog)] = None,
+    tokens: Annotated[TokenManager, Depends(get_token_manager)] = None,
 ) -> List[Dict[str, Any]]:
     """
     Get all devices associated with the authenticated user.
+    Served from the device catalog; stale entries refresh in the background.
     """
-    token = current_user.citytag_token
-    if not token:
-        # If token missing, we cannot transparently re-login without password;
-        # for prototype we expect login endpoint to have set this.
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="CityTag token missing; please login again",
-        )
-
     try:
-        devices = await citytag.get_devices(
-            uid=current_user.uid,
-            token=token,
-            
+        devices = await tokens.call(
+            current_user,
+            lambda token: catalog.get_devices(uid=current_user.uid, token=token, sn=sn, user=current_user),
         )
+    except CityTagUnavailableError as exc:
+        raise citytag_unavailable(exc)
     except CityTagError as exc:
         # If token is invalid, instruct client to re-login
         raise HTTPException(
@@ -1,5 +1,5 @@
 # app/routers/history.py
-from typing import Annotated
+from typing import Annotated, Optional
 from datetime import datetime
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
@@ -8,6 +8,7 @@ from app.dependencies import get_current_user, get_location_service
 from app.models.user import UserInDB
 from app.models.location import TrajectoryResponse, PlaybackResponse
 from app.services.location import LocationService
+from app.services.simplify import MAX_ZOOM, MIN_ZOOM
 
 
 router = APIRouter(prefix="/api", tags=["history"])
@@ -20,9 +21,13 @@ async def get_device_trajectory(
     end: Annotated[datetime, Query(...)],
     current_user: Annotated[UserInDB, Depends(get_current_user)],
     service: Annotated[LocationService, Depends(get_location_service)],
+    tolerance: Annotated[Optional[float], Query(gt=0, description="Simplification tolerance in meters")] = None,
+    zoom: Annotated[Optional[int], Query(ge=MIN_ZOOM, le=MAX_ZOOM, description="Map zoom; simplifies to ~1px")] = None,
 ):
     """
-    Get GeoJSON LineString for drawing the route on a map
+    Get GeoJSON LineString for drawing the route on a map.
+    Pass `zoom` (or `tolerance` in meters) to get a simplified line;
+    `original_count` reports how many points were stored.
     """
     if start >= end:
         raise HTTPException(400, "start must be before end")
@@ -32,6 +37,8 @@ async def get_device_trajectory(
         sn=sn,
         start_time=start,
         end_time=end,
+        tolerance_m=tolerance,
+        zoom=zoom,
     )
 
     if not result:
@@ -1,10 +1,19 @@
+from datetime import datetime
 from typing import Annotated, Any, Dict, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Path, status
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, status
 
-from app.dependencies import get_citytag_client, get_current_user
+from app.dependencies import (
+    citytag_unavailable,
+    get_citytag_client,
+    get_current_user,
+    get_mongo_service,
+    get_token_manager,
+)
 from app.models.user import UserInDB
-from app.services.citytag import CityTagClient, CityTagError
+from app.services.citytag import CityTagClient, CityTagError, CityTagUnavailableError
+from app.services.mongodb import MongoService
+from app.services.token_manager import TokenManager
 
 
 router = APIRouter(prefix="/api", tags=["location"])
@@ -13,25 +22,41 @@ router = APIRouter(prefix="/api", tags=["location"])
 @router.get("/location/{sn}")
 async def get_latest_location(
     sn: str = Path(..., description="Device serial number"),
+    max_staleness: Optional[int] = Query(
+        default=None,
+        ge=0,
+        description="Max age in seconds of the stored position before CityTag is queried",
+    ),
     current_user: Annotated[UserInDB, Depends(get_current_user)] = None,
     citytag: Annotated[CityTagClient, Depends(get_citytag_client)] = None,
+    mongo: Annotated[MongoService, Depends(get_mongo_service)] = None,
+    tokens: Annotated[TokenManager, Depends(get_token_manager)] = None,
 ) -> Dict[str, Any]:
     """
     Return the latest known location for a given device SN.
+
+    Served from the device_latest store kept up to date by ingest; CityTag is
+    only queried when nothing is stored or the last check is older than
+    `max_staleness` seconds.
     """
-    token = current_user.citytag_token
-    if not token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="CityTag token missing; please login again",
-        )
+    stored = await mongo.get_device_latest(current_user.uid, sn)
+    age: Optional[float] = None
+    if stored and stored.get("timestamp"):
+        checked_at = stored.get("checked_at") or stored["timestamp"]
+        age = (datetime.utcnow() - checked_at).total_seconds()
+        if max_staleness is None or age <= max_staleness:
+            return {"sn": sn, "latest": stored.get("raw") or None, "source": "store", "age_seconds": age}
 
     try:
-        latest: Optional[Dict[str, Any]] = await citytag.get_latest_location(
-            uid=current_user.uid,
-            token=token,
-            sn=sn,
+        latest: Optional[Dict[str, Any]] = await tokens.call(
+            current_user,
+            lambda token: citytag.get_latest_location(uid=current_user.uid, token=token, sn=sn),
         )
+    except CityTagUnavailableError as exc:
+        # Upstream is down: a stale position beats an error on the dashboard
+        if age is not None:
+            return {"sn": sn, "latest": stored.get("raw") or None, "source": "store", "age_seconds": age, "stale": True}
+        raise citytag_unavailable(exc)
     except CityTagError as exc:
         raise HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY,
@@ -39,7 +64,7 @@ async def get_latest_location(
         )
 
     if not latest:
-        return {"sn": sn, "latest": None}
-
-    return {"sn": sn, "latest": latest}
+        return {"sn": sn, "latest": None, "source": "upstream"}
 
+    await mongo.upsert_location_from_citytag(history_item=latest, uid=current_user.uid, sn=sn)
+    return {"sn": sn, "latest": latest, "source": "upstream", "age_seconds": 0.0}
@@ -1,72 +1,142 @@
 # app/routers/sync.py
+from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
-from typing import Annotated
+from typing import Annotated, Any, Dict
 
-from app.dependencies import get_current_user, get_citytag_client, get_mongo_service
+from app.dependencies import (
+    get_citytag_client,
+    get_current_user,
+    get_device_catalog,
+    get_job_queue,
+    get_mongo_service,
+    get_settings,
+    get_token_manager,
+)
 from app.models.user import UserInDB
-from app.services.citytag import CityTagClient, CityTagError
+from app.services.auto_sync import SyncStats, sync_device
+from app.services.citytag import CityTagClient
+from app.services.device_catalog import DeviceCatalog
+from app.services.jobs import Job, JobQueue
 from app.services.mongodb import MongoService
+from app.services.sync_state import SyncWindowPolicy, device_lag
+from app.services.token_manager import TokenManager
 
 
 router = APIRouter(prefix="/api", tags=["sync"])
 
+MANUAL_SYNC_MAX_WINDOW = timedelta(days=10)
 
-@router.post("/sync/locations")
+
+def manual_window_policy() -> SyncWindowPolicy:
+    # A manual sync may catch up further than the scheduler, one day per chunk
+    return SyncWindowPolicy(
+        overlap=timedelta(seconds=get_settings()["sync_overlap_seconds"]),
+        catch_up=MANUAL_SYNC_MAX_WINDOW,
+        initial=MANUAL_SYNC_MAX_WINDOW,
+        chunk=timedelta(days=1),
+    )
+
+
+async def run_manual_sync(
+    job: Job,
+    user: UserInDB,
+    mongo: MongoService,
+    citytag: CityTagClient,
+    catalog: DeviceCatalog,
+    tokens: TokenManager,
+) -> Dict[str, Any]:
+    """Job body for a manual sync: refresh the catalog, then sync each device in turn."""
+    devices = await tokens.call(user, lambda token: catalog.refresh(uid=user.uid, token=token))
+    serials = [device["sn"] for device in devices or [] if device.get("sn")]
+    job.progress.update(devices_total=len(serials), devices_done=0, points_inserted=0)
+    if not serials:
+        return {"devices_found": 0, "points_inserted": 0, "message": "No devices found"}
+
+    stats = SyncStats()
+    states = await mongo.get_sync_states(user.uid)
+    policy = manual_window_policy()
+    failed = []
+
+    for sn in serials:
+        token = await tokens.get_token(user)
+        outcome = await sync_device(
+            mongo,
+            citytag,
+            uid=user.uid,
+            token=token,
+            email=user.email,
+            sn=sn,
+            policy=policy,
+            stats=stats,
+            state=states.get(sn),
+        )
+        if outcome.auth_failed:
+            tokens.report_auth_failure(user, token)
+        if not outcome.ok:
+            failed.append(sn)
+        job.progress.update(devices_done=job.progress["devices_done"] + 1, points_inserted=stats.points)
+
+    return {
+        "devices_found": len(serials),
+        "points_inserted": stats.points,
+        "failed_devices": failed,
+        "message": "Sync completed",
+    }
+
+
+@router.post("/sync/locations", status_code=status.HTTP_202_ACCEPTED)
 async def sync_device_locations(
     current_user: Annotated[UserInDB, Depends(get_current_user)],
     citytag: Annotated[CityTagClient, Depends(get_citytag_client)],
     mongo: Annotated[MongoService, Depends(get_mongo_service)],
+    catalog: Annotated[DeviceCatalog, Depends(get_device_catalog)],
+    tokens: Annotated[TokenManager, Depends(get_token_manager)],
+    jobs: Annotated[JobQueue, Depends(get_job_queue)],
 ):
     """
-    Fetch recent location history from CityTag for the current user's devices
-    and store it in our MongoDB (for trajectory & playback).
-    """
-    if not current_user.citytag_token:
-        raise HTTPException(status.HTTP_401_UNAUTHORIZED, "CityTag token missing")
+    Queue a sync of new location history from CityTag for the current user's
+    devices (for trajectory & playback). Each device only fetches from its
+    stored watermark, up to 10 days back.
 
-    # Get all devices for this user
+    Returns a job id at once; poll GET /api/sync/jobs/{job_id} for progress.
+    While a sync for this user is queued or running, the same job is returned.
+    """
     try:
-        devices = await citytag.get_devices(
-            uid=current_user.uid,
-            token=current_user.citytag_token,
+        job, created = await jobs.submit(
+            kind="manual_sync",
+            key=f"manual_sync:{current_user.uid}",
+            owner=current_user.uid,
+            fn=lambda job: run_manual_sync(job, current_user, mongo, citytag, catalog, tokens),
         )
-    except CityTagError as e:
-        raise HTTPException(status.HTTP_502_BAD_GATEWAY, str(e))
-
-    if not devices:
-        return {"message": "No devices found", "inserted": 0}
-
-    inserted_count = 0
-    from datetime import datetime, timedelta
-    start_time = datetime.utcnow() - timedelta(days=10)  # last 3 days - adjust as needed
-
-    for device in devices:
-        sn = device.get("sn")
-        if not sn:
-            continue
-
-        try:
-            history = await citytag.get_location_history(  # ← you need this method!
-                uid=current_user.uid,
-                token=current_user.citytag_token,
-                sn=sn,
-                start_time=start_time,
-                end_time=datetime.utcnow(),
-            )
-        except CityTagError:
-            continue
-
-        for item in history:
-            inserted = await mongo.upsert_location_from_citytag(
-                history_item=item,
-                uid=current_user.uid,
-                sn=sn,
-            )
-            if inserted:
-                inserted_count += 1
+    except RuntimeError as e:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, str(e))
 
-    return {
-        "devices_found": len(devices),
-        "points_inserted": inserted_count,
-        "message": "Sync completed"
-    }
\ No newline at end of file
+    return {**job.summary(), "deduplicated": not created}
+
+
+@router.get("/sync/jobs/{job_id}")
+async def sync_job_status(
+    job_id: str,
+    current_user: Annotated[UserInDB, Depends(get_current_user)],
+    jobs: Annotated[JobQueue, Depends(get_job_queue)],
+):
+    """
+    Progress (devices done, points inserted) and, once finished, the result of a sync job.
+    """
+    job = await jobs.get(job_id)
+    if job is None or job.owner != current_user.uid:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Job not found")
+    return job.summary()
+
+
+@router.get("/sync/status")
+async def sync_status(
+    current_user: Annotated[UserInDB, Depends(get_current_user)],
+    mongo: Annotated[MongoService, Depends(get_mongo_service)],
+):
+    """
+    Per-device sync freshness: newest stored point and end of the last sync window.
+    """
+    now = datetime.utcnow()
+    states = await mongo.get_sync_states(current_user.uid)
+    return {"devices": [device_lag(state, now) for state in states.values()]}
@@ -1,124 +1,567 @@
 import asyncio
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from httpx import HTTPStatusError
+from typing import Optional, Set
 
-from app.dependencies import get_settings
+from app.dependencies import get_citytag_client, get_device_catalog, get_mongo_service, get_settings, get_token_manager
 from app.services.mongodb import MongoService
-from app.services.citytag import CityTagClient, CityTagError
-from app.routers.auth import login
-from app.models.user import UserCreate
+from app.services.citytag import CityTagAuthError, CityTagClient, CityTagError
+from app.services.device_catalog import DeviceCatalog
+from app.services.metrics import (
+    DEVICE_SYNC_SECONDS,
+    FRESHNESS_LAG,
+    POLL_IN_FLIGHT,
+    POLL_SCHEDULED,
+    SYNC_BUDGET_EXHAUSTED,
+    POINTS_FETCHED,
+    POINTS_WRITTEN,
+    SYNC_DEVICES,
+    SYNC_INTERVAL,
+    SYNC_LAST_RUN,
+    SYNC_RELOGINS,
+    SYNC_RUN_SECONDS,
+    SYNC_RUNS,
+    SYNC_USERS,
+)
+from app.services.leases import LeaseManager, due_shards, shard_lease_name, shard_of
+from app.services.poll_scheduler import AdaptivePollScheduler, PollPolicy, movement_extent_m
+from app.services.resilience import TokenBucket
+from app.services.sync_checkpoint import SyncCheckpoint, TimeBudget
+from app.services.sync_state import SyncWindowPolicy
+from app.services.token_manager import TokenManager
 
-SYNC_INTERVAL_SECONDS = 600  # 1 minute
+SYNC_INTERVAL_SECONDS = 600  # 10 minutes
+SCHEDULER_MAX_SLEEP_SECONDS = 30
 
+SYNC_INTERVAL.set(SYNC_INTERVAL_SECONDS)
 
-async def try_relogin(email: str, password: str, uid: str, mongo: MongoService, citytag: CityTagClient) -> str | None:
-    """Attempt to re-login to CityTag and update the token in DB."""
-    print(f"   ↻ Re-login attempt for {email} ...")
+
+async def get_user_devices(catalog: DeviceCatalog, uid: str, token: str, email: str):
+    """Refresh the device catalog for a user. Returns None if token is invalid/expired."""
     try:
-        payload = UserCreate(email=email, password=password, uid=uid)
-        await login(payload=payload, mongo=mongo, citytag=citytag)
+        devices = await catalog.refresh(uid=uid, token=token)
+        return devices
+    except CityTagAuthError as e:
+        print(f"   ⚠ Token invalid/expired ({e}) for {email} → re-login triggered")
+        return None
+    except CityTagError as e:
+        print(f"❌ Non-auth error fetching devices for {email}: {e}")
+        return []
+
+
+@dataclass
+class SyncStats:
+    users: int = 0
+    re_logins: int = 0
+    devices: int = 0
+    points: int = 0
+    skipped_users: int = 0
+    complete: bool = True
+
+
+@dataclass
+class SyncLimits:
+    """Concurrency bounds for one sync run."""
+    max_users: int = 8
+    max_devices: int = 32
+    max_devices_per_user: int = 4
+
+    @classmethod
+    def from_settings(cls) -> "SyncLimits":
+        settings = get_settings()
+        return cls(
+            max_users=settings["sync_max_concurrent_users"],
+            max_devices=settings["sync_max_concurrent_devices"],
+            max_devices_per_user=settings["sync_max_devices_per_user"],
+        )
+
+
+@dataclass
+class DeviceSyncOutcome:
+    ok: bool = False
+    auth_failed: bool = False
+    changed: int = 0
+    movement_m: float = 0.0
+    synced_until: Optional[datetime] = None
+    watermark: Optional[datetime] = None
+
+
+@dataclass
+class UserSyncTarget:
+    uid: str
+    email: str
+    token: str
+    devices: list
+    user: dict
+
+
+async def sync_device(
+    mongo: MongoService,
+    citytag: CityTagClient,
+    uid: str,
+    token: str,
+    email: str,
+    sn: str,
+    policy: SyncWindowPolicy,
+    stats: SyncStats,
+    state: Optional[dict] = None,
+) -> DeviceSyncOutcome:
+    """Fetch and ingest everything newer than the device's high-water mark."""
+    started = time.perf_counter()
+    end_time = datetime.utcnow()
+    start_time = policy.window_start(state, end_time)
+    outcome = DeviceSyncOutcome()
+    try:
+        # Movement is measured from the last stored position, not just within this poll's pages
+        latest = await mongo.get_device_latest(uid, sn)
+        origin = (latest["lat"], latest["lng"]) if latest and latest.get("lat") is not None else None
+        async for page in citytag.iter_location_history(uid=uid, token=token, sn=sn, start_time=start_time, end_time=end_time, chunk=policy.chunk):
+            result = await mongo.ingest_locations_from_citytag(page, uid=uid, sn=sn)
+            POINTS_FETCHED.inc(len(page))
+            POINTS_WRITTEN.inc(result.inserted, result="inserted")
+            POINTS_WRITTEN.inc(result.modified, result="modified")
+            outcome.changed += result.changed
+            stats.points += result.changed
+            outcome.movement_m = max(outcome.movement_m, movement_extent_m(page, origin))
+            if result.newest and (outcome.watermark is None or result.newest > outcome.watermark):
+                outcome.watermark = result.newest
+        await mongo.touch_device_latest(uid, sn)
+        await mongo.advance_sync_state(uid, sn, synced_until=end_time, watermark=outcome.watermark)
+        outcome.ok = True
+        outcome.synced_until = end_time
+    except CityTagError as e:
+        outcome.auth_failed = isinstance(e, CityTagAuthError)
+        print(f"❌ History fetch failed for SN={sn} ({email}): {e}")
+
+    DEVICE_SYNC_SECONDS.observe(time.perf_counter() - started)
+    SYNC_DEVICES.inc(result="ok" if outcome.ok else "auth_failed" if outcome.auth_failed else "error")
+    newest = max(filter(None, [outcome.watermark, (state or {}).get("watermark")]), default=None)
+    if newest is not None:
+        FRESHNESS_LAG.observe(max(0.0, (datetime.utcnow() - newest).total_seconds()))
+
+    if outcome.changed:
+        print(f"   + {outcome.changed} new points for SN={sn}")
+    return outcome
 
-        user_doc = await mongo.users.find_one({"email": email})
-        if user_doc and user_doc.get("citytag_token"):
-            print(f"   ✓ Re-login successful → new token obtained")
-            return user_doc["citytag_token"]
 
-        print(f"   ✗ Login succeeded but token not found in DB")
+async def resolve_user_devices(
+    user: dict,
+    tokens: TokenManager,
+    catalog: DeviceCatalog,
+    stats: SyncStats,
+) -> Optional[UserSyncTarget]:
+    """Get a working token and the device list for a user, re-logging in if needed."""
+    email, password, uid = user.get("email"), user.get("password"), user.get("uid")
+    if not all([email, password, uid]):
+        print("⚠ Skipping user — missing email/password/uid")
         return None
-    except Exception as exc:
-        print(f"   ✗ Re-login failed for {email}: {exc}")
+
+    SYNC_USERS.inc()
+    try:
+        token = await tokens.get_token(user)
+        devices = await get_user_devices(catalog, uid, token, email)
+        if devices is None:
+            tokens.report_auth_failure(user, token)
+            print(f"   ↻ Re-login attempt for {email} ...")
+            token = await tokens.refresh(user, stale_token=token)
+            stats.re_logins += 1
+            SYNC_RELOGINS.inc()
+            devices = await get_user_devices(catalog, uid, token, email)
+            if devices is None:
+                print(f"   ✗ Failed to get devices even after re-login for {email}")
+                return None
+    except CityTagError as exc:
+        print(f"   ✗ Re-login failed for {email}: {exc} — skipping this user")
         return None
 
+    if not devices:
+        print(f"   ⚠ No devices found for {email} after all attempts")
+        return None
 
-async def get_user_devices(citytag: CityTagClient, uid: str, token: str, email: str):
-    """Fetch devices for a user. Returns None if token is invalid/expired."""
-    try:
-        devices = await citytag.get_devices(uid=uid, token=token)
-        return devices
-    except (CityTagError, HTTPStatusError) as e:
-        msg = str(e).lower()
-        if any(kw in msg for kw in ["token", "expired", "invalid token", "invalid", "401", "unauthorized", "400", "bad request"]):
-            print(f"   ⚠ Token invalid/expired ({e}) for {email} → re-login triggered")
-            return None
-        print(f"❌ Non-auth error fetching devices for {email}: {e}")
-        return []
+    return UserSyncTarget(uid=uid, email=email, token=token, devices=devices, user=user)
+
+
+async def sync_user(
+    user: dict,
+    mongo: MongoService,
+    citytag: CityTagClient,
+    catalog: DeviceCatalog,
+    tokens: TokenManager,
+    device_slots: asyncio.Semaphore,
+    limits: SyncLimits,
+    policy: SyncWindowPolicy,
+    stats: SyncStats,
+    budget: Optional[TimeBudget] = None,
+) -> bool:
+    """Sync one user's devices. Returns False if the budget ran out before all of them finished."""
+    target = await resolve_user_devices(user, tokens, catalog, stats)
+    if target is None:
+        return True
 
+    stats.devices += len(target.devices)
+    states = await mongo.get_sync_states(target.uid)
+    user_slots = asyncio.Semaphore(limits.max_devices_per_user)
+    cut_short = False
 
-async def sync_all_users() -> None:
-    """Sync location history for all users and devices, with automatic re-login."""
+    async def bounded(sn: str) -> None:
+        nonlocal cut_short
+        async with user_slots, device_slots:
+            if budget is not None and budget.exhausted():
+                cut_short = True
+                return
+            work = sync_device(mongo, citytag, target.uid, target.token, target.email, sn, policy, stats, states.get(sn))
+            if budget is None:
+                await work
+                return
+            try:
+                # Slow pages and retries must not run the invocation past its budget
+                await asyncio.wait_for(work, budget.in_flight_timeout())
+            except asyncio.TimeoutError:
+                # Watermark not advanced, so the next run refetches from where this stopped
+                print(f"⏸ Device sync for SN={sn} ({target.email}) stopped at the time budget")
+                cut_short = True
+
+    results = await asyncio.gather(
+        *(bounded(device["sn"]) for device in target.devices if device.get("sn")),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"❌ Device sync crashed for {target.email}: {result!r}")
+    return not cut_short
+
+
+def scheduled_window_policy() -> SyncWindowPolicy:
     settings = get_settings()
-    mongo = MongoService(settings["mongo_uri"])
-    citytag = CityTagClient(settings["citytag_base_url"])
+    return SyncWindowPolicy(
+        overlap=timedelta(seconds=settings["sync_overlap_seconds"]),
+        catch_up=timedelta(hours=settings["sync_catch_up_hours"]),
+        initial=timedelta(minutes=settings["sync_initial_window_minutes"]),
+    )
+
 
+async def sync_all_users(
+    limits: SyncLimits | None = None,
+    policy: SyncWindowPolicy | None = None,
+    shards: Optional[Set[int]] = None,
+    total_shards: int = 1,
+    budget: Optional[TimeBudget] = None,
+    checkpoint: Optional[SyncCheckpoint] = None,
+) -> SyncStats:
+    """
+    Sync location history for all users and devices, with automatic re-login.
+
+    Users run concurrently (up to `limits.max_users`), and each user's devices
+    run concurrently within both a per-user and a global device limit. A
+    failure in one user or device never aborts the others. When `shards` is
+    given, only users whose uid hashes into one of them are synced.
+
+    With a `budget`, no new user or device is started once it is nearly
+    spent, device syncs still running at the deadline are cancelled, and
+    `stats.complete` is False; with a `checkpoint` (requires
+    `shards`), users before the stored cursors are skipped and the cursors
+    advance as users finish, so the next run resumes where this one stopped.
+    """
+    limits = limits or SyncLimits.from_settings()
+    policy = policy or scheduled_window_policy()
+    mongo = get_mongo_service()
+    citytag = get_citytag_client()
+    catalog = get_device_catalog()
+    tokens = get_token_manager()
+
+    started = time.perf_counter()
     print("\n🔄 ===== AUTO SYNC STARTED =====")
+    if shards is not None:
+        print(f"🧩 Shards: {sorted(shards)} of {total_shards}")
+
+    stats = SyncStats()
+    user_slots = asyncio.Semaphore(limits.max_users)
+    device_slots = asyncio.Semaphore(limits.max_devices)
+    tasks: list[asyncio.Task] = []
 
-    total_users = total_devices = total_points = re_logins = 0
+    async def run_user(user: dict, shard: int) -> None:
+        finished = True
+        try:
+            finished = await sync_user(user, mongo, citytag, catalog, tokens, device_slots, limits, policy, stats, budget)
+        except Exception as exc:
+            # A crashing user counts as visited, so it cannot pin the cursor forever
+            print(f"❌ Sync crashed for {user.get('email')}: {exc!r}")
+        finally:
+            user_slots.release()
+        if not finished:
+            stats.complete = False
+        elif checkpoint is not None:
+            await checkpoint.completed(shard, user["_id"])
 
-    async for user in mongo.users.find({}):
-        total_users += 1
-        email, password, uid, token = user.get("email"), user.get("password"), user.get("uid"), user.get("citytag_token")
-        if not all([email, password, uid]):
-            print(f"⚠ Skipping user — missing email/password/uid")
+    query = checkpoint.user_query(shards) if checkpoint is not None and shards else {}
+    if checkpoint is not None and checkpoint.resumed_shards:
+        print(f"⏩ Resuming shards {sorted(checkpoint.resumed_shards)} from checkpoint")
+
+    async for user in mongo.users.find(query).sort("_id", 1):
+        shard = shard_of(user.get("uid") or "", total_shards)
+        if shards is not None and shard not in shards:
+            continue
+        if checkpoint is not None and checkpoint.should_skip(shard, user["_id"]):
+            stats.skipped_users += 1
             continue
+        if budget is not None and budget.exhausted():
+            stats.complete = False
+            break
+        await user_slots.acquire()
+        if budget is not None and budget.exhausted():
+            user_slots.release()
+            stats.complete = False
+            break
+        stats.users += 1
+        if checkpoint is not None:
+            checkpoint.dispatched(shard, user["_id"])
+        tasks.append(asyncio.create_task(run_user(user, shard)))
 
-        current_token = token
-        devices = await get_user_devices(citytag, uid, current_token, email) if current_token else None
-        if devices is None:
-            new_token = await try_relogin(email, password, uid, mongo, citytag)
-            if new_token:
-                current_token, re_logins = new_token, re_logins + 1
-                devices = await get_user_devices(citytag, uid, current_token, email)
-                if devices is None:
-                    print(f"   ✗ Failed to get devices even after re-login for {email}")
+    await asyncio.gather(*tasks)
+
+    if not stats.complete:
+        SYNC_BUDGET_EXHAUSTED.inc()
+    SYNC_RUNS.inc(mode="batch")
+    SYNC_RUN_SECONDS.observe(time.perf_counter() - started, mode="batch")
+    SYNC_LAST_RUN.set(time.time(), mode="batch")
+
+    if stats.complete:
+        print("✅ ===== AUTO SYNC COMPLETED =====")
+    else:
+        print("⏸ ===== AUTO SYNC PAUSED (time budget) =====")
+    print(f"👥 Users processed:       {stats.users:3d}")
+    print(f"🔑 Successful re-logins:   {stats.re_logins:3d}")
+    print(f"📱 Devices processed:      {stats.devices:3d}")
+    print(f"📍 Points inserted/updated: {stats.points:3d}")
+    print("====================================\n")
+    return stats
+
+
+def create_lease_manager(owner: Optional[str] = None) -> LeaseManager:
+    settings = get_settings()
+    return LeaseManager(
+        get_mongo_service().sync_leases,
+        owner=owner,
+        ttl_seconds=settings["sync_lease_ttl_seconds"],
+    )
+
+
+async def run_leased_sync(leases: LeaseManager, limit: int = 0, budget: Optional[TimeBudget] = None) -> Optional[SyncStats]:
+    """
+    Claim shard leases and sync the shards that are due.
+
+    Returns None when this process owns no due shard — another worker or
+    replica already covers them, so nothing is synced twice. If `budget`
+    runs out first, the shards stay due and keep their checkpoints, so the
+    next invocation resumes the same pass instead of starting over.
+    """
+    total = get_settings()["sync_shards"]
+    owned = await leases.acquire_shards(total, limit)
+    due = due_shards(owned, SYNC_INTERVAL_SECONDS)
+    if not due:
+        return None
+
+    checkpoint = SyncCheckpoint(leases, {shard: owned[shard] for shard in due})
+    stats = await sync_all_users(shards=set(due), total_shards=total, budget=budget, checkpoint=checkpoint)
+    if not stats.complete:
+        return stats
+    for shard in due:
+        # Stamp the pass with when it started, which may be an earlier invocation
+        await leases.mark_run(shard_lease_name(shard), at=checkpoint.pass_started_at[shard])
+    return stats
+
+
+def poll_policy_from_settings() -> PollPolicy:
+    settings = get_settings()
+    return PollPolicy(
+        min_interval=settings["sync_poll_min_seconds"],
+        max_interval=settings["sync_poll_max_seconds"],
+        backoff=settings["sync_poll_backoff"],
+        move_threshold_m=settings["sync_move_threshold_meters"],
+    )
+
+
+class AdaptiveSyncRunner:
+    """
+    Long-running per-device poller for API workers.
+
+    Every SYNC_INTERVAL_SECONDS it re-claims shard leases and rebuilds the
+    roster (tokens and device lists) of users in owned shards. In between,
+    devices are popped from an AdaptivePollScheduler as they fall due and
+    synced concurrently, gated by a global polls-per-minute budget.
+    """
+
+    def __init__(self) -> None:
+        settings = get_settings()
+        self.mongo = get_mongo_service()
+        self.citytag = get_citytag_client()
+        self.catalog = get_device_catalog()
+        self.tokens = get_token_manager()
+        self.leases = create_lease_manager()
+        self.limits = SyncLimits.from_settings()
+        self.window = scheduled_window_policy()
+        self.scheduler = AdaptivePollScheduler(poll_policy_from_settings())
+        budget = settings["sync_poll_budget_per_minute"]
+        self.budget = TokenBucket(rate=budget / 60, burst=max(1.0, budget / 6))
+        self.device_slots = asyncio.Semaphore(self.limits.max_devices)
+        self.roster: dict[str, UserSyncTarget] = {}
+        self.states: dict[tuple, dict] = {}
+        self.stats = SyncStats()
+        self.next_roster = datetime.utcnow()
+        self._tasks: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+
+    async def refresh_roster(self) -> None:
+        started = time.perf_counter()
+        total = get_settings()["sync_shards"]
+        owned = await self.leases.acquire_shards(total, get_settings()["sync_shards_per_worker"])
+        shards = set(owned)
+        roster: dict[str, UserSyncTarget] = {}
+        now = datetime.utcnow()
+
+        user_slots = asyncio.Semaphore(self.limits.max_users)
+
+        async def load(user: dict) -> None:
+            async with user_slots:
+                try:
+                    target = await resolve_user_devices(user, self.tokens, self.catalog, self.stats)
+                    if target is None:
+                        return
+                    states = await self.mongo.get_sync_states(target.uid)
+                except Exception as exc:
+                    print(f"❌ Roster refresh failed for {user.get('email')}: {exc!r}")
+                    return
+            roster[target.uid] = target
+            for device in target.devices:
+                sn = device.get("sn")
+                if not sn or (target.uid, sn) in self.scheduler:
                     continue
-            else:
-                print(f"   ✗ Re-login failed for {email} — skipping this user")
-                continue
+                state = states.get(sn) or {}
+                self.states[(target.uid, sn)] = state
+                self.scheduler.schedule(
+                    target.uid,
+                    sn,
+                    due=min(state.get("next_poll_at") or now, now + timedelta(seconds=self.scheduler.policy.max_interval)),
+                    interval=state.get("poll_interval"),
+                )
 
-        if not devices:
-            print(f"   ⚠ No devices found for {email} after all attempts")
-            continue
+        users = [
+            user async for user in self.mongo.users.find({})
+            if shard_of(user.get("uid") or "", total) in shards
+        ]
+        await asyncio.gather(*(load(user) for user in users))
+
+        for shard in shards:
+            await self.leases.mark_run(shard_lease_name(shard), at=now)
+        self.roster = roster
+        self.next_roster = now + timedelta(seconds=SYNC_INTERVAL_SECONDS)
+        SYNC_RUNS.inc(mode="roster")
+        SYNC_RUN_SECONDS.observe(time.perf_counter() - started, mode="roster")
+        SYNC_LAST_RUN.set(time.time(), mode="roster")
+        POLL_SCHEDULED.set(len(self.scheduler))
+        print(
+            f"🗓 Roster: {len(roster)} users, {len(self.scheduler)} devices in shards {sorted(shards)} "
+            f"| points so far {self.stats.points}, re-logins {self.stats.re_logins}"
+        )
+
+    async def poll(self, uid: str, sn: str) -> None:
+        target = self.roster.get(uid)
+        if target is None or not any(d.get("sn") == sn for d in target.devices):
+            self.scheduler.remove(uid, sn)
+            return
+
+        key = (uid, sn)
+        self.stats.devices += 1
+        token = None
+        try:
+            # The manager refreshes ahead of expiry, so long-lived rosters keep working tokens
+            token = await self.tokens.get_token(target.user)
+            outcome = await sync_device(
+                self.mongo, self.citytag, uid, token, target.email, sn,
+                self.window, self.stats, self.states.get(key),
+            )
+        except Exception as exc:
+            print(f"❌ Device sync crashed for SN={sn}: {exc!r}")
+            outcome = DeviceSyncOutcome()
 
-        total_devices += len(devices)
-        start_time, end_time = datetime.utcnow() - timedelta(minutes=15), datetime.utcnow()
+        if outcome.ok:
+            state = self.states.setdefault(key, {})
+            state["synced_until"] = outcome.synced_until
+            if outcome.watermark:
+                state["watermark"] = max(filter(None, [state.get("watermark"), outcome.watermark]))
+        if outcome.auth_failed and token:
+            # The next poll of any of this user's devices logs in again
+            self.tokens.report_auth_failure(target.user, token)
 
-        for device in devices:
-            sn = device.get("sn")
-            if not sn:
-                continue
+        if key not in self.scheduler:
+            return
+        now = datetime.utcnow()
+        moved = outcome.movement_m >= self.scheduler.policy.move_threshold_m
+        interval = self.scheduler.record(uid, sn, moved=moved, ok=outcome.ok, now=now)
+        POLL_SCHEDULED.set(len(self.scheduler))
+        self._wakeup.set()
+        await self.mongo.set_poll_schedule(uid, sn, interval, now + timedelta(seconds=interval))
 
+    def _spawn(self, uid: str, sn: str) -> None:
+        async def run() -> None:
+            POLL_IN_FLIGHT.inc()
             try:
-                history = await citytag.get_location_history(uid=uid, token=current_token, sn=sn, start_time=start_time, end_time=end_time)
-            except (CityTagError, HTTPStatusError) as e:
-                print(f"❌ History fetch failed for SN={sn} ({email}): {e}")
-                continue
-
-            inserted_this_device = 0
-            for item in history:
-                if await mongo.upsert_location_from_citytag(history_item=item, uid=uid, sn=sn):
-                    inserted_this_device += 1
-                    total_points += 1
-
-            if inserted_this_device:
-                print(f"   + {inserted_this_device} new points for SN={sn}")
-
-    print("✅ ===== AUTO SYNC COMPLETED =====")
-    print(f"👥 Users processed:       {total_users:3d}")
-    print(f"🔑 Successful re-logins:   {re_logins:3d}")
-    print(f"📱 Devices processed:      {total_devices:3d}")
-    print(f"📍 Points inserted/updated: {total_points:3d}")
-    print("====================================\n")
+                await self.poll(uid, sn)
+            finally:
+                POLL_IN_FLIGHT.dec()
+                self.device_slots.release()
+
+        task = asyncio.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run_forever(self) -> None:
+        heartbeat = asyncio.create_task(self.leases.heartbeat())
+        try:
+            while True:
+                now = datetime.utcnow()
+                if now >= self.next_roster:
+                    try:
+                        await self.refresh_roster()
+                    except Exception as exc:
+                        print(f"❌ Roster refresh failed: {exc!r}")
+                        self.next_roster = now + timedelta(seconds=self.scheduler.policy.min_interval)
+
+                while (key := self.scheduler.pop_due(datetime.utcnow())) is not None:
+                    await self.budget.acquire()
+                    await self.device_slots.acquire()
+                    self._spawn(*key)
+
+                # Sleep until the next due device, or until a finished poll reschedules one
+                self._wakeup.clear()
+                wake_at = min(filter(None, [self.scheduler.next_due(), self.next_roster]))
+                delay = (wake_at - datetime.utcnow()).total_seconds()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(max(delay, 0.5), SCHEDULER_MAX_SLEEP_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            heartbeat.cancel()
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self.leases.release_all()
 
 
 async def scheduler_loop() -> None:
-    await sync_all_users()
-    while True:
-        await asyncio.sleep(SYNC_INTERVAL_SECONDS)
-        await sync_all_users()
+    await AdaptiveSyncRunner().run_forever()
 
 
-def start_auto_sync_tasks(app):
-    @app.on_event("startup")
-    async def start_scheduler():
-        print("🚀 Starting Auto Sync Scheduler...")
-        asyncio.create_task(scheduler_loop())
+def start_auto_sync_tasks() -> asyncio.Task:
+    print("🚀 Starting Auto Sync Scheduler...")
+    return asyncio.create_task(scheduler_loop())
+
+
+async def stop_auto_sync_tasks(task: asyncio.Task) -> None:
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
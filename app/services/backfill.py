@@ -0,0 +1,249 @@
+# app/services/backfill.py
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.citytag import CityTagClient
+from app.services.metrics import POINTS_FETCHED, POINTS_WRITTEN
+from app.services.mongodb import MongoService
+from app.services.token_manager import TokenManager
+
+
+DEFAULT_CHUNK = timedelta(days=1)
+DEFAULT_CONCURRENCY = 4
+PROGRESS_SAVE_SECONDS = 2.0
+
+_EPOCH = datetime(1970, 1, 1)
+
+Chunk = Tuple[datetime, datetime]
+
+
+def split_range(start: datetime, end: datetime, chunk: timedelta) -> List[Chunk]:
+    """
+    Split [start, end) into chunks aligned to a fixed grid from the epoch, so
+    different jobs over overlapping ranges produce the same inner chunks.
+    """
+    chunks = []
+    cursor = start
+    while cursor < end:
+        grid = _EPOCH + ((cursor - _EPOCH) // chunk + 1) * chunk
+        chunk_end = min(grid, end)
+        chunks.append((cursor, chunk_end))
+        cursor = chunk_end
+    return chunks
+
+
+def backfill_job_id(uid: str, sn: str, start: datetime, end: datetime, chunk: timedelta) -> str:
+    key = f"{uid}|{sn}|{start.isoformat()}|{end.isoformat()}|{int(chunk.total_seconds())}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class BackfillProgress:
+    job_id: str
+    uid: str
+    sn: str
+    start: datetime
+    end: datetime
+    chunk_seconds: float
+    concurrency: int
+    status: str = "pending"
+    chunks_total: int = 0
+    chunks_done: int = 0
+    chunks_reused: int = 0
+    chunks_failed: int = 0
+    fetched: int = 0
+    inserted: int = 0
+    elapsed_seconds: float = 0.0
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+    @property
+    def points_per_second(self) -> float:
+        return self.fetched / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.__dict__, "points_per_second": round(self.points_per_second, 1)}
+
+    def to_doc(self) -> Dict[str, Any]:
+        doc = self.summary()
+        doc["_id"] = doc.pop("job_id")
+        return doc
+
+
+class BackfillJob:
+    """
+    Fetch a device's history over a long range, one time chunk per task.
+
+    Chunks run concurrently up to `concurrency`; every CityTag call still
+    passes through the client's global and per-user rate limiters. Each
+    chunk is written with bulk ingest and recorded in backfill_chunks when
+    done, so re-running the same (or an overlapping) range skips finished
+    chunks. A failed chunk is left unrecorded and retried on the next run.
+    """
+
+    def __init__(
+        self,
+        mongo: MongoService,
+        citytag: CityTagClient,
+        tokens: TokenManager,
+        user: Any,
+        sn: str,
+        start: datetime,
+        end: datetime,
+        chunk: timedelta = DEFAULT_CHUNK,
+        concurrency: int = DEFAULT_CONCURRENCY,
+    ):
+        # The id uses the requested range so repeat requests map to the same job
+        uid = user["uid"] if isinstance(user, dict) else user.uid
+        job_id = backfill_job_id(uid, sn, start, end, chunk)
+        end = min(end, datetime.utcnow())
+        if start >= end:
+            raise ValueError("Backfill start must be before end (and before now)")
+        self.mongo = mongo
+        self.citytag = citytag
+        self.tokens = tokens
+        self.user = user
+        self.uid = uid
+        self.sn = sn
+        self.chunk = chunk
+        self.progress = BackfillProgress(
+            job_id=job_id,
+            uid=self.uid,
+            sn=sn,
+            start=start,
+            end=end,
+            chunk_seconds=chunk.total_seconds(),
+            concurrency=max(1, concurrency),
+        )
+        self._last_save = 0.0
+
+    @property
+    def job_id(self) -> str:
+        return self.progress.job_id
+
+    async def _save(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if force or now - self._last_save >= PROGRESS_SAVE_SECONDS:
+            self._last_save = now
+            await self.mongo.save_backfill_job(self.progress.to_doc())
+
+    async def _fetch_chunk(self, start: datetime, end: datetime) -> Tuple[int, int, Optional[datetime]]:
+        async def fetch(token: str) -> Tuple[int, int, Optional[datetime]]:
+            fetched = inserted = 0
+            newest = None
+            async for page in self.citytag.iter_location_history(
+                uid=self.uid, token=token, sn=self.sn, start_time=start, end_time=end,
+            ):
+                result = await self.mongo.ingest_locations_from_citytag(page, uid=self.uid, sn=self.sn)
+                fetched += len(page)
+                inserted += result.inserted
+                POINTS_FETCHED.inc(len(page))
+                POINTS_WRITTEN.inc(result.inserted, result="inserted")
+                POINTS_WRITTEN.inc(result.modified, result="modified")
+                if result.newest and (newest is None or result.newest > newest):
+                    newest = result.newest
+                # Count as we go so throughput is visible while the chunk runs
+                self.progress.fetched += len(page)
+                self.progress.inserted += result.inserted
+            return fetched, inserted, newest
+
+        return await self.tokens.call(self.user, fetch)
+
+    async def run(self) -> BackfillProgress:
+        progress = self.progress
+        started = time.perf_counter()
+        chunks = split_range(progress.start, progress.end, self.chunk)
+        done = await self.mongo.get_done_backfill_chunks(self.uid, self.sn, progress.start, progress.end)
+        pending = [c for c in chunks if c not in done]
+        progress.chunks_total = len(chunks)
+        progress.chunks_reused = progress.chunks_done = len(chunks) - len(pending)
+        progress.status = "running"
+        await self._save(force=True)
+        print(
+            f"⏪ Backfill {progress.job_id} SN={self.sn}: {len(pending)}/{len(chunks)} chunks to fetch "
+            f"({progress.start:%Y-%m-%d} → {progress.end:%Y-%m-%d}, concurrency {progress.concurrency})"
+        )
+
+        slots = asyncio.Semaphore(progress.concurrency)
+        newest: Optional[datetime] = None
+
+        async def run_chunk(chunk: Chunk) -> None:
+            nonlocal newest
+            async with slots:
+                try:
+                    fetched, inserted, chunk_newest = await self._fetch_chunk(*chunk)
+                except Exception as exc:
+                    progress.chunks_failed += 1
+                    progress.error = f"{chunk[0]:%Y-%m-%d %H:%M}: {exc}"
+                    print(f"❌ Backfill chunk {chunk[0]} → {chunk[1]} failed for SN={self.sn}: {exc}")
+                    return
+                await self.mongo.mark_backfill_chunk_done(self.uid, self.sn, chunk[0], chunk[1], fetched, inserted)
+                if chunk_newest and (newest is None or chunk_newest > newest):
+                    newest = chunk_newest
+                progress.chunks_done += 1
+                progress.elapsed_seconds = time.perf_counter() - started
+                await self._save()
+
+        try:
+            await asyncio.gather(*(run_chunk(chunk) for chunk in pending))
+        except asyncio.CancelledError:
+            progress.status = "cancelled"
+            raise
+        finally:
+            progress.elapsed_seconds = time.perf_counter() - started
+            progress.finished_at = datetime.utcnow()
+            if progress.status == "running":
+                progress.status = "failed" if progress.chunks_failed else "completed"
+            if newest is not None:
+                await self.mongo.advance_sync_state(self.uid, self.sn, synced_until=progress.start, watermark=newest)
+            await self._save(force=True)
+
+        print(
+            f"✅ Backfill {progress.job_id} {progress.status}: {progress.fetched} points fetched, "
+            f"{progress.inserted} new, {progress.points_per_second:.0f} pts/s over {progress.elapsed_seconds:.1f}s"
+        )
+        return progress
+
+
+# ────────────────────────────────────────────────
+#        Background backfill jobs (API workers)
+# ────────────────────────────────────────────────
+
+_running: Dict[str, Tuple[BackfillJob, asyncio.Task]] = {}
+
+
+def start_backfill(job: BackfillJob) -> BackfillProgress:
+    """Run `job` in the background; a job already running for the same range is reused."""
+    existing = _running.get(job.job_id)
+    if existing is not None and not existing[1].done():
+        return existing[0].progress
+
+    async def run() -> None:
+        try:
+            await job.run()
+        except asyncio.CancelledError:
+            pass
+        except Exception as exc:
+            print(f"❌ Backfill {job.job_id} crashed: {exc!r}")
+
+    task = asyncio.create_task(run())
+    _running[job.job_id] = (job, task)
+    task.add_done_callback(lambda _: _running.pop(job.job_id, None))
+    return job.progress
+
+
+def get_running_backfill(job_id: str) -> Optional[BackfillProgress]:
+    entry = _running.get(job_id)
+    return entry[0].progress if entry else None
+
+
+async def cancel_backfills() -> None:
+    tasks = [task for _, task in _running.values()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
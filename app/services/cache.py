@@ -0,0 +1,52 @@
+# app/services/cache.py
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, Tuple, TypeVar
+
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """
+    Small bounded in-process cache with per-entry expiry.
+
+    Entries are evicted least-recently-used once `max_entries` is reached.
+    `get_entry` also returns the entry age so callers can serve stale data
+    while refreshing it in the background.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_entry(self, key: Hashable) -> Optional[Tuple[V, float]]:
+        """Return (value, age_seconds) regardless of expiry, or None."""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        self._data.move_to_end(key)
+        stored_at, value = item
+        return value, time.monotonic() - stored_at
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.get_entry(key)
+        if entry is None or entry[1] > self.ttl_seconds:
+            return default
+        return entry[0]
+
+    def set(self, key: Hashable, value: V) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
@@ -1,18 +1,62 @@
+import asyncio
 import base64
 import json
-from typing import Any, Dict, List, Optional
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
 import httpx
 from Crypto.Cipher import DES3
 from Crypto.Util.Padding import pad, unpad
 
+from app.services.metrics import DECRYPT_SECONDS, UPSTREAM_RETRIES, UPSTREAM_SECONDS
+from app.services.resilience import CircuitBreaker, CircuitOpenError, RateLimiter, backoff_delay
+from app.services.singleflight import SingleFlight
+
 BLOCK_SIZE = 8  # 3DES block size in bytes
+CIPHER_CACHE_SIZE = 256  # distinct tokens kept warm (one per active user)
+DECRYPT_OFFLOAD_THRESHOLD = 32 * 1024  # base64 chars; larger payloads decrypt off-loop
+
+DEVICE_PAGE_SIZE = 50
+DEVICE_MAX_PAGES = 50
+HISTORY_PAGE_SIZE = 500
+HISTORY_MAX_PAGES = 200  # hard stop in case upstream never returns a short page
+HISTORY_PAGE_CONCURRENCY = 4
+
+_crypto_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="citytag-crypto")
+
+
+AUTH_HTTP_STATUSES = (400, 401, 403)
+AUTH_ERROR_KEYWORDS = ("token", "expired", "unauthorized", "not logged", "login")
 
 
 class CityTagError(Exception):
     """Raised when CityTag API returns an error."""
 
 
+class CityTagAuthError(CityTagError):
+    """Raised when CityTag rejects the token; the caller should re-login."""
+
+
+class CityTagUnavailableError(CityTagError):
+    """Raised when CityTag is unreachable, timing out or failing with 5xx."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _raise_for_body(body: Dict[str, Any], default_message: str) -> None:
+    """Turn a non-success CityTag envelope into the right CityTagError subclass."""
+    if body.get("code") == "00000":
+        return
+    message = body.get("msg") or default_message
+    if any(keyword in message.lower() for keyword in AUTH_ERROR_KEYWORDS):
+        raise CityTagAuthError(message)
+    raise CityTagError(message)
+
+
 def _build_3des_key(token: str) -> bytes:
     """Build a valid 3DES key from the CityTag token."""
     key = token.encode("utf-8")
@@ -21,10 +65,18 @@ def _build_3des_key(token: str) -> bytes:
     return DES3.adjust_key_parity(key)
 
 
+@lru_cache(maxsize=CIPHER_CACHE_SIZE)
+def _get_cipher(token: str):
+    """
+    Return the 3DES-ECB cipher for a token, built once and reused.
+    ECB carries no IV or chaining state, so one object can serve every call.
+    """
+    return DES3.new(_build_3des_key(token), DES3.MODE_ECB)
+
+
 def encrypt_payload(payload: Dict[str, Any], token: str) -> str:
     """Encrypt JSON payload using 3DES-ECB with PKCS7 padding."""
-    key = _build_3des_key(token)
-    cipher = DES3.new(key, DES3.MODE_ECB)
+    cipher = _get_cipher(token)
     plaintext = json.dumps(payload, separators=(",", ":")).encode("utf-8")
     padded = pad(plaintext, BLOCK_SIZE)
     encrypted = cipher.encrypt(padded)
@@ -33,48 +85,205 @@ def encrypt_payload(payload: Dict[str, Any], token: str) -> str:
 
 def decrypt_payload(ciphertext: str, token: str) -> Dict[str, Any]:
     """Decrypt CityTag response 'data' field using 3DES-ECB PKCS7."""
-    key = _build_3des_key(token)
-    cipher = DES3.new(key, DES3.MODE_ECB)
+    cipher = _get_cipher(token)
     raw = base64.b64decode(ciphertext)
     padded = cipher.decrypt(raw)
     plaintext = unpad(padded, BLOCK_SIZE)
     return json.loads(plaintext.decode("utf-8"))
 
 
+async def decrypt_payload_async(ciphertext: str, token: str) -> Dict[str, Any]:
+    """
+    Decrypt on the event loop for small payloads; hand large ones (history
+    pages) to the crypto thread pool so base64 + 3DES + JSON don't block it.
+    """
+    try:
+        if len(ciphertext) < DECRYPT_OFFLOAD_THRESHOLD:
+            with DECRYPT_SECONDS.time(path="inline"):
+                return decrypt_payload(ciphertext, token)
+        loop = asyncio.get_running_loop()
+        with DECRYPT_SECONDS.time(path="offload"):
+            return await loop.run_in_executor(_crypto_executor, decrypt_payload, ciphertext, token)
+    except (ValueError, TypeError) as exc:
+        # Bad base64, padding or JSON inside the envelope
+        raise CityTagError(f"Could not decrypt CityTag response: {exc}") from exc
+
+
+def _json_body(resp: httpx.Response, operation: str) -> Dict[str, Any]:
+    """The response's JSON object, or CityTagUnavailableError for anything else (e.g. a proxy error page)."""
+    try:
+        body = resp.json()
+    except ValueError as exc:
+        raise CityTagUnavailableError(f"CityTag {operation} returned a non-JSON body") from exc
+    if not isinstance(body, dict):
+        raise CityTagUnavailableError(f"CityTag {operation} returned an unexpected body")
+    return body
+
+
+DEFAULT_TIMEOUTS: Dict[str, float] = {
+    "login": 15,
+    "devices": 15,
+    "latest": 15,
+    "history": 45,
+}
+
+
+def build_http_client(
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 30.0,
+    connect_timeout: float = 5.0,
+    http2: bool = False,
+) -> httpx.AsyncClient:
+    """Build a long-lived, keep-alive HTTP client for CityTag calls."""
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("⚠ CITYTAG_HTTP2 requested but 'h2' is not installed; using HTTP/1.1")
+            http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    timeout = httpx.Timeout(DEFAULT_TIMEOUTS["devices"], connect=connect_timeout)
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+
 class CityTagClient:
-    def __init__(self, base_url: str):
+    def __init__(
+        self,
+        base_url: str,
+        http: Optional[httpx.AsyncClient] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+        limiter: Optional[RateLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        retry_attempts: int = 3,
+        retry_backoff: float = 0.5,
+    ):
         self.base_url = base_url.rstrip("/")
+        self._http = http
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.singleflight = SingleFlight()
+        self.limiter = limiter or RateLimiter(0, 0, 0, 0)
+        self.breaker = breaker or CircuitBreaker()
+        self.retry_attempts = max(1, retry_attempts)
+        self.retry_backoff = retry_backoff
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = build_http_client()
+        return self._http
+
+    async def aclose(self) -> None:
+        if self._http is not None and not self._http.is_closed:
+            await self._http.aclose()
+
+    def _timeout(self, operation: str) -> httpx.Timeout:
+        return httpx.Timeout(self.timeouts[operation], connect=self.http.timeout.connect)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "singleflight": self.singleflight.stats(),
+            "limiter": self.limiter.stats(),
+            "breaker": self.breaker.stats(),
+        }
+
+    async def _request(self, url: str, operation: str, uid: Optional[str] = None, **kwargs: Any) -> httpx.Response:
+        """
+        POST through the rate limiter and circuit breaker, retrying timeouts,
+        transport errors and 5xx with jittered backoff.
+        """
+        last_error: Optional[Exception] = None
+        for attempt in range(self.retry_attempts):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError as exc:
+                raise CityTagUnavailableError(str(exc), retry_after=self.breaker.retry_after()) from last_error
+
+            started = time.perf_counter()
+            try:
+                await self.limiter.acquire(uid)
+                started = time.perf_counter()
+                resp = await self.http.post(url, timeout=self._timeout(operation), **kwargs)
+            except httpx.TimeoutException as exc:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started, operation=operation, outcome="timeout")
+                last_error = exc
+            except httpx.TransportError as exc:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started, operation=operation, outcome="transport_error")
+                last_error = exc
+            except httpx.RequestError as exc:
+                # Not retryable (bad encoding, redirect loop), but still upstream misbehaving
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started, operation=operation, outcome="request_error")
+                self.breaker.record_failure()
+                raise CityTagUnavailableError(
+                    f"CityTag {operation} failed: {exc!r}", retry_after=self.breaker.retry_after(),
+                ) from exc
+            except BaseException:
+                # Cancelled, or failed without a verdict on CityTag: don't hold the half-open trial slot
+                self.breaker.release_trial()
+                raise
+            else:
+                outcome = "ok" if resp.status_code < 400 else f"{resp.status_code // 100}xx"
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started, operation=operation, outcome=outcome)
+                if resp.status_code < 500:
+                    self.breaker.record_success()
+                    if resp.status_code in AUTH_HTTP_STATUSES:
+                        raise CityTagAuthError(f"CityTag rejected the request ({resp.status_code})")
+                    if resp.is_error:
+                        raise CityTagError(f"CityTag {operation} failed with HTTP {resp.status_code}")
+                    return resp
+                last_error = CityTagUnavailableError(f"CityTag {operation} failed with HTTP {resp.status_code}")
+
+            self.breaker.record_failure()
+            if attempt + 1 < self.retry_attempts:
+                UPSTREAM_RETRIES.inc(operation=operation)
+                await asyncio.sleep(backoff_delay(attempt, self.retry_backoff))
+
+        raise CityTagUnavailableError(
+            f"CityTag {operation} unavailable after {self.retry_attempts} attempts: {last_error}",
+            retry_after=self.breaker.retry_after(),
+        ) from last_error
+
+    async def _post_encrypted(self, url: str, payload: Dict[str, Any], token: str, operation: str, uid: Optional[str] = None) -> Dict[str, Any]:
+        encryption = encrypt_payload(payload, token)
+        resp = await self._request(url, operation, uid=uid, json={"encryption": encryption})
+        return _json_body(resp, operation)
 
     async def login(self, username: str, password: str) -> Dict[str, Any]:
         """Call CityTag login endpoint (no encryption)."""
         url = f"{self.base_url}/api/interface/login"
         data = {"username": username, "password": password}
-        async with httpx.AsyncClient(timeout=15) as client:
-            resp = await client.post(url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
-        resp.raise_for_status()
-        body = resp.json()
+        resp = await self._request(
+            url,
+            "login",
+            data=data,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        body = _json_body(resp, "login")
         if body.get("code") != "00000":
             raise CityTagError(body.get("msg") or "CityTag login failed")
         return body["data"]
 
     async def get_devices(self, uid: str, token: str, sn: Optional[str] = None, page_no: int = 1, page_size: int = 20) -> List[Dict[str, Any]]:
         """Get list of devices for a user via encrypted payload."""
+        key = ("devices", uid, sn, page_no, page_size)
+        return await self.singleflight.do(key, lambda: self._get_devices(uid, token, sn, page_no, page_size))
+
+    async def _get_devices(self, uid: str, token: str, sn: Optional[str], page_no: int, page_size: int) -> List[Dict[str, Any]]:
         url = f"{self.base_url}/api2/v4/device/{uid}"
         payload: Dict[str, Any] = {"pageNo": page_no, "pageSize": page_size}
         if sn:
             payload["sn"] = sn
-        encryption = encrypt_payload(payload, token)
-        body = {"encryption": encryption}
-        async with httpx.AsyncClient(timeout=15) as client:
-            resp = await client.post(url, json=body)
-        resp.raise_for_status()
-        data = resp.json()
-        if data.get("code") != "00000":
-            raise CityTagError(data.get("msg") or "CityTag device list failed")
+        data = await self._post_encrypted(url, payload, token, "devices", uid=uid)
+        _raise_for_body(data, "CityTag device list failed")
         encrypted_data = data.get("data")
         if not encrypted_data:
             return []
-        decrypted = decrypt_payload(encrypted_data, token)
+        decrypted = await decrypt_payload_async(encrypted_data, token)
         if isinstance(decrypted, dict):
             if "list" in decrypted and isinstance(decrypted["list"], list):
                 return decrypted["list"]
@@ -84,27 +293,35 @@ class CityTagClient:
             return decrypted
         return []
 
+    async def get_all_devices(self, uid: str, token: str, page_size: int = DEVICE_PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Walk every device page for a user until upstream returns a short page."""
+        devices: List[Dict[str, Any]] = []
+        for page_no in range(1, DEVICE_MAX_PAGES + 1):
+            page = await self.get_devices(uid=uid, token=token, page_no=page_no, page_size=page_size)
+            devices.extend(page)
+            if len(page) < page_size:
+                break
+        return devices
+
     async def get_latest_location(self, uid: str, token: str, sn: str, page_no: int = 1, page_size: int = 20) -> Optional[Dict[str, Any]]:
         """Get latest location for a specific device SN."""
+        key = ("latest", uid, sn, page_no, page_size)
+        return await self.singleflight.do(key, lambda: self._get_latest_location(uid, token, sn, page_no, page_size))
+
+    async def _get_latest_location(self, uid: str, token: str, sn: str, page_no: int, page_size: int) -> Optional[Dict[str, Any]]:
         url = f"{self.base_url}/api/interface/v2/device/{uid}"
         payload = {"uid": int(uid), "sn": sn, "pageNo": page_no, "pageSize": page_size}
-        encryption = encrypt_payload(payload, token)
-        body = {"encryption": encryption}
-        async with httpx.AsyncClient(timeout=15) as client:
-            resp = await client.post(url, json=body)
-        resp.raise_for_status()
-        data = resp.json()
-        if data.get("code") != "00000":
-            raise CityTagError(data.get("msg") or "CityTag trajectory failed")
+        data = await self._post_encrypted(url, payload, token, "latest", uid=uid)
+        _raise_for_body(data, "CityTag trajectory failed")
         encrypted_data = data.get("data")
         if not encrypted_data:
             return None
-        decrypted = decrypt_payload(encrypted_data, token)
+        decrypted = await decrypt_payload_async(encrypted_data, token)
         history = decrypted.get("history") or []
         return history[-1] if history else None
 
-    async def get_location_history(self, uid: str, token: str, sn: str, start_time: datetime, end_time: datetime, page_no: int = 1, page_size: int = 500) -> list[dict]:
-        """Fetch location history for a device in a time range."""
+    async def _fetch_history_page(self, uid: str, token: str, sn: str, start_time: datetime, end_time: datetime, page_no: int, page_size: int) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Fetch one history page; returns (points, total) where total may be unknown."""
         url = f"{self.base_url}/api/interface/v2/device/{uid}"
         payload = {
             "uid": int(uid),
@@ -114,16 +331,104 @@ class CityTagClient:
             "beginTime": int(start_time.timestamp() * 1000),
             "endTime": int(end_time.timestamp() * 1000),
         }
-        encryption = encrypt_payload(payload, token)
-        body = {"encryption": encryption}
-        async with httpx.AsyncClient(timeout=45) as client:
-            resp = await client.post(url, json=body)
-        resp.raise_for_status()
-        data = resp.json()
-        if data.get("code") != "00000":
-            raise CityTagError(data.get("msg") or "Failed to fetch location history")
+        data = await self._post_encrypted(url, payload, token, "history", uid=uid)
+        _raise_for_body(data, "Failed to fetch location history")
         encrypted_data = data.get("data")
         if not encrypted_data:
-            return []
-        decrypted = decrypt_payload(encrypted_data, token)
-        return decrypted.get("history", [])
+            return [], None
+        decrypted = await decrypt_payload_async(encrypted_data, token)
+        total = None
+        for key in ("total", "totalCount", "count"):
+            if isinstance(decrypted.get(key), int):
+                total = decrypted[key]
+                break
+        return decrypted.get("history") or [], total
+
+    async def get_location_history(self, uid: str, token: str, sn: str, start_time: datetime, end_time: datetime, page_no: int = 1, page_size: int = 500) -> list[dict]:
+        """Fetch a single page of location history for a device in a time range."""
+        history, _ = await self._fetch_history_page(uid, token, sn, start_time, end_time, page_no, page_size)
+        return history
+
+    async def iter_location_history(
+        self,
+        uid: str,
+        token: str,
+        sn: str,
+        start_time: datetime,
+        end_time: datetime,
+        page_size: int = HISTORY_PAGE_SIZE,
+        chunk: Optional[timedelta] = None,
+        concurrency: int = HISTORY_PAGE_CONCURRENCY,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream the full location history for a device, one page at a time.
+
+        The range is optionally split into `chunk`-sized windows. Within a
+        window, if upstream reports a total, the remaining pages are fetched
+        concurrently and yielded as they complete (not necessarily in order);
+        otherwise pages are walked sequentially until a short page.
+        """
+        window_start = start_time
+        while window_start < end_time:
+            window_end = min(window_start + chunk, end_time) if chunk else end_time
+            async for page in self._iter_window(uid, token, sn, window_start, window_end, page_size, concurrency):
+                yield page
+            window_start = window_end
+
+    async def _iter_window(self, uid: str, token: str, sn: str, start_time: datetime, end_time: datetime, page_size: int, concurrency: int) -> AsyncIterator[List[Dict[str, Any]]]:
+        first, total = await self._fetch_history_page(uid, token, sn, start_time, end_time, 1, page_size)
+        if first:
+            yield first
+        if len(first) < page_size:
+            return
+
+        if total is None:
+            for page_no in range(2, HISTORY_MAX_PAGES + 1):
+                page, _ = await self._fetch_history_page(uid, token, sn, start_time, end_time, page_no, page_size)
+                if page:
+                    yield page
+                if len(page) < page_size:
+                    return
+            return
+
+        last_page = min(-(-total // page_size), HISTORY_MAX_PAGES)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def fetch(page_no: int) -> List[Dict[str, Any]]:
+            async with semaphore:
+                page, _ = await self._fetch_history_page(uid, token, sn, start_time, end_time, page_no, page_size)
+                return page
+
+        tasks = [asyncio.create_task(fetch(page_no)) for page_no in range(2, last_page + 1)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                page = await next_done
+                if page:
+                    yield page
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# ────────────────────────────────────────────────
+#          Process-wide shared CityTagClient
+# ────────────────────────────────────────────────
+
+_shared_client: Optional[CityTagClient] = None
+
+
+def get_shared_citytag_client() -> Optional[CityTagClient]:
+    return _shared_client
+
+
+def set_shared_citytag_client(client: Optional[CityTagClient]) -> None:
+    global _shared_client
+    _shared_client = client
+
+
+async def close_shared_citytag_client() -> None:
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.aclose()
+        _shared_client = None
@@ -0,0 +1,122 @@
+# app/services/device_catalog.py
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from app.services.cache import TTLCache
+from app.services.citytag import CityTagClient
+from app.services.mongodb import MongoService
+from app.services.token_manager import TokenManager
+
+
+class DeviceCatalog:
+    """
+    Per-user device list, persisted in Mongo with an in-process TTL cache.
+
+    Reads are served from memory (or Mongo on a cold cache); stale entries
+    are returned immediately while a background refresh re-reads every
+    device page from CityTag. Only a user with no stored catalog at all
+    waits on the upstream. Given the user, background refreshes go through
+    the TokenManager, so an expired token is renewed rather than leaving
+    the stale list in place.
+    """
+
+    def __init__(
+        self,
+        mongo: MongoService,
+        citytag: CityTagClient,
+        ttl_seconds: float = 300,
+        max_entries: int = 1024,
+        tokens: Optional[TokenManager] = None,
+    ):
+        self.mongo = mongo
+        self.citytag = citytag
+        self.tokens = tokens
+        self._cache: TTLCache[List[Dict[str, Any]]] = TTLCache(ttl_seconds, max_entries)
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._invalidated: Set[str] = set()
+
+    async def get_devices(self, uid: str, token: str, sn: Optional[str] = None, user: Any = None) -> List[Dict[str, Any]]:
+        devices = await self._load(uid, token, user)
+        if sn:
+            return [d for d in devices if d.get("sn") == sn]
+        return devices
+
+    async def _load(self, uid: str, token: str, user: Any = None) -> List[Dict[str, Any]]:
+        entry = self._cache.get_entry(uid)
+        if entry is not None:
+            devices, age = entry
+            if age > self._cache.ttl_seconds:
+                self.schedule_refresh(uid, token, user)
+            return devices
+
+        doc = await self.mongo.get_device_catalog(uid)
+        if doc is None:
+            return await self.refresh(uid, token)
+
+        self._cache.set(uid, doc["devices"])
+        updated_at = doc.get("updated_at")
+        stale = not updated_at or (datetime.utcnow() - updated_at).total_seconds() > self._cache.ttl_seconds
+        if stale or uid in self._invalidated:
+            self._invalidated.discard(uid)
+            self.schedule_refresh(uid, token, user)
+        return doc["devices"]
+
+    async def refresh(self, uid: str, token: str) -> List[Dict[str, Any]]:
+        """Fetch every device page from CityTag and store the result. Errors propagate."""
+        devices = await self.citytag.get_all_devices(uid=uid, token=token)
+        await self.mongo.save_device_catalog(uid, devices)
+        self._cache.set(uid, devices)
+        self._invalidated.discard(uid)
+        return devices
+
+    def schedule_refresh(self, uid: str, token: str, user: Any = None) -> None:
+        task = self._refreshing.get(uid)
+        if task is not None and not task.done():
+            return
+        task = asyncio.create_task(self._background_refresh(uid, token, user))
+        self._refreshing[uid] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(uid, None))
+
+    async def _background_refresh(self, uid: str, token: str, user: Any = None) -> None:
+        try:
+            if user is not None and self.tokens is not None:
+                await self.tokens.call(user, lambda fresh: self.refresh(uid, fresh))
+            else:
+                await self.refresh(uid, token)
+        except Exception as exc:
+            print(f"⚠ Device catalog refresh failed for uid={uid}: {exc}")
+
+    def invalidate(self, uid: str) -> None:
+        """Drop the cached list; the next read serves the stored one and refreshes it."""
+        self._cache.pop(uid)
+        self._invalidated.add(uid)
+
+    async def close(self) -> None:
+        tasks = list(self._refreshing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# ────────────────────────────────────────────────
+#          Process-wide shared DeviceCatalog
+# ────────────────────────────────────────────────
+
+_shared_catalog: Optional[DeviceCatalog] = None
+
+
+def get_shared_device_catalog() -> Optional[DeviceCatalog]:
+    return _shared_catalog
+
+
+def set_shared_device_catalog(catalog: Optional[DeviceCatalog]) -> None:
+    global _shared_catalog
+    _shared_catalog = catalog
+
+
+async def close_shared_device_catalog() -> None:
+    global _shared_catalog
+    if _shared_catalog is not None:
+        await _shared_catalog.close()
+        _shared_catalog = None
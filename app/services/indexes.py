@@ -0,0 +1,290 @@
+# app/services/indexes.py
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, OperationFailure
+
+from app.services.location_store import (
+    DUPLICATE_KEY_ERROR,
+    LOCATION_BUCKETS_COLLECTION,
+    LOCATIONS_COLLECTION,
+    BucketLocationStore,
+    DocumentLocationStore,
+    LocationStore,
+    TieredLocationStore,
+)
+from app.services.mongodb import (
+    BACKFILL_CHUNKS_COLLECTION,
+    DEVICE_CATALOG_COLLECTION,
+    DEVICE_LATEST_COLLECTION,
+    JOBS_COLLECTION,
+    SYNC_STATE_COLLECTION,
+    USERS_COLLECTION,
+)
+
+
+LOCATION_KEY = [("uid", ASCENDING), ("sn", ASCENDING), ("timestamp", ASCENDING)]
+
+# Covers the trajectory/playback projection (lat, lng, timestamp) without fetching documents
+LOCATION_COVERING_KEY = LOCATION_KEY + [("lat", ASCENDING), ("lng", ASCENDING)]
+
+LOCATION_INDEXES = [
+    IndexModel(LOCATION_KEY, name="uid_sn_timestamp_unique", unique=True),
+    IndexModel(LOCATION_COVERING_KEY, name="uid_sn_timestamp_lat_lng"),
+]
+
+LOCATION_BUCKET_INDEXES = [
+    IndexModel([("uid", ASCENDING), ("sn", ASCENDING), ("start", ASCENDING)], name="uid_sn_start_unique", unique=True),
+]
+
+REQUIRED_INDEXES: Dict[str, List[IndexModel]] = {
+    LOCATIONS_COLLECTION: LOCATION_INDEXES,
+    LOCATION_BUCKETS_COLLECTION: LOCATION_BUCKET_INDEXES,
+    USERS_COLLECTION: [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("uid", ASCENDING)], name="uid"),
+    ],
+    DEVICE_CATALOG_COLLECTION: [
+        IndexModel([("uid", ASCENDING)], name="uid_unique", unique=True),
+    ],
+    DEVICE_LATEST_COLLECTION: [
+        IndexModel([("uid", ASCENDING), ("sn", ASCENDING)], name="uid_sn_unique", unique=True),
+    ],
+    SYNC_STATE_COLLECTION: [
+        IndexModel([("uid", ASCENDING), ("sn", ASCENDING)], name="uid_sn_unique", unique=True),
+    ],
+    BACKFILL_CHUNKS_COLLECTION: [
+        IndexModel(
+            [("uid", ASCENDING), ("sn", ASCENDING), ("start", ASCENDING), ("end", ASCENDING)],
+            name="uid_sn_range_unique",
+            unique=True,
+        ),
+    ],
+    JOBS_COLLECTION: [
+        IndexModel([("key", ASCENDING), ("created_at", DESCENDING)], name="key_created"),
+        # At most one queued/running job per key, across all workers
+        IndexModel(
+            [("key", ASCENDING)],
+            name="key_active_unique",
+            unique=True,
+            partialFilterExpression={"active": True},
+        ),
+    ],
+}
+
+
+def _key_of(model: IndexModel) -> List[tuple]:
+    return list(model.document["key"].items())
+
+
+async def _existing_index(collection, model: IndexModel) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """An index on the same key (and partial filter) as `model`, under any name."""
+    info = await collection.index_information()
+    for name, spec in info.items():
+        if name == "_id_" or list(spec["key"]) != _key_of(model):
+            continue
+        if spec.get("partialFilterExpression") == model.document.get("partialFilterExpression"):
+            return name, spec
+    return None
+
+
+async def _make_unique(collection, name: str) -> None:
+    """
+    Convert an existing index to unique in place (MongoDB 6.0+), so the
+    collection is never without it. Fails, leaving the index as it was,
+    while duplicates exist.
+    """
+    for option in ("prepareUnique", "unique"):
+        await collection.database.command("collMod", collection.name, index={"name": name, option: True})
+
+
+async def remove_duplicate_locations(db: AsyncIOMotorDatabase, dry_run: bool = False) -> int:
+    """
+    Delete all but the newest document for each duplicated (uid, sn, timestamp);
+    returns how many were (or, with `dry_run`, would be) removed. Scans the
+    whole collection, so it is only run on request (dedupe_locations.py).
+    """
+    pipeline = [
+        {"$group": {
+            "_id": {"uid": "$uid", "sn": "$sn", "timestamp": "$timestamp"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    removed = 0
+    collection = db[LOCATIONS_COLLECTION]
+    async for group in collection.aggregate(pipeline, allowDiskUse=True):
+        extra = sorted(group["ids"])[:-1]
+        if dry_run:
+            removed += len(extra)
+            continue
+        result = await collection.delete_many({"_id": {"$in": extra}})
+        removed += result.deleted_count
+    return removed
+
+
+def _is_duplicate_error(exc: Exception) -> bool:
+    return isinstance(exc, DuplicateKeyError) or getattr(exc, "code", None) == DUPLICATE_KEY_ERROR
+
+
+def _warn_not_unique(collection_name: str, model: IndexModel, exc: Exception) -> None:
+    hint = " — run `python dedupe_locations.py`" if collection_name == LOCATIONS_COLLECTION else ""
+    print(f"⚠ {collection_name}.{model.document['name']} is not unique yet ({exc}){hint}")
+
+
+async def _ensure_index(db: AsyncIOMotorDatabase, collection_name: str, model: IndexModel) -> None:
+    collection = db[collection_name]
+    unique = bool(model.document.get("unique"))
+    existing = await _existing_index(collection, model)
+    if existing is not None:
+        name, spec = existing
+        if not unique or spec.get("unique"):
+            return  # already there, possibly under an older name
+        try:
+            await _make_unique(collection, name)
+            print(f"   ↻ Made index {collection_name}.{name} unique")
+        except OperationFailure as exc:
+            _warn_not_unique(collection_name, model, exc)
+        return
+
+    try:
+        await collection.create_indexes([model])
+        return
+    except OperationFailure as exc:
+        if not (unique and _is_duplicate_error(exc)):
+            raise
+        _warn_not_unique(collection_name, model, exc)
+
+    # Keep serving with a plain index; a later startup converts it once the duplicates are gone
+    options = {"name": model.document["name"]}
+    if model.document.get("partialFilterExpression"):
+        options["partialFilterExpression"] = model.document["partialFilterExpression"]
+    await collection.create_index(_key_of(model), **options)
+
+
+def location_store_indexes(store: LocationStore) -> Dict[str, List[IndexModel]]:
+    """Indexes for the collections behind a location store, including retention tiers."""
+    if isinstance(store, TieredLocationStore):
+        indexes = location_store_indexes(store.raw)
+        for _, tier_store in store.tiers:
+            indexes.update(location_store_indexes(tier_store))
+        return indexes
+    if isinstance(store, BucketLocationStore):
+        return {store.collection.name: LOCATION_BUCKET_INDEXES}
+    if isinstance(store, DocumentLocationStore):
+        return {store.collection.name: LOCATION_INDEXES}
+    return {}
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase, store: Optional[LocationStore] = None) -> None:
+    """Create every index the app relies on. Safe to run on each startup."""
+    required = dict(REQUIRED_INDEXES)
+    if store is not None:
+        required.update(location_store_indexes(store))
+    for collection_name, models in required.items():
+        for model in models:
+            try:
+                await _ensure_index(db, collection_name, model)
+            except ConnectionFailure as exc:
+                print(f"❌ Mongo unreachable, skipping index check: {exc}")
+                return
+            except Exception as exc:
+                print(f"❌ Could not ensure index {collection_name}.{model.document['name']}: {exc}")
+
+
+# ────────────────────────────────────────────────
+#            Query plan check (explain)
+# ────────────────────────────────────────────────
+
+
+def _plan_stages(node: Any, found: Optional[Set[str]] = None) -> Set[str]:
+    """Every stage name in an explain plan tree (classic or SBE layout)."""
+    found = found if found is not None else set()
+    if isinstance(node, dict):
+        stage = node.get("stage")
+        if isinstance(stage, str):
+            found.add(stage)
+        for value in node.values():
+            _plan_stages(value, found)
+    elif isinstance(node, list):
+        for item in node:
+            _plan_stages(item, found)
+    return found
+
+
+def hot_queries(now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """The app's frequent query shapes, with placeholder values."""
+    now = now or datetime.utcnow()
+    window = {"$gte": now - timedelta(days=1), "$lte": now}
+    return [
+        {
+            "name": "trajectory",
+            "collection": LOCATIONS_COLLECTION,
+            "filter": {"uid": "0", "sn": "0", "timestamp": window},
+            "projection": {"_id": 0, "lat": 1, "lng": 1, "timestamp": 1},
+            "sort": [("timestamp", ASCENDING)],
+            "expect_covered": True,
+        },
+        {
+            "name": "location_upsert_key",
+            "collection": LOCATIONS_COLLECTION,
+            "filter": {"uid": "0", "sn": "0", "timestamp": now},
+        },
+        {
+            "name": "trajectory_buckets",
+            "collection": LOCATION_BUCKETS_COLLECTION,
+            "filter": {"uid": "0", "sn": "0", "start": window},
+            "sort": [("start", ASCENDING)],
+        },
+        {"name": "user_by_email", "collection": USERS_COLLECTION, "filter": {"email": "probe@example.com"}},
+        {"name": "users_by_uid", "collection": USERS_COLLECTION, "filter": {"uid": "0"}},
+        {"name": "device_catalog", "collection": DEVICE_CATALOG_COLLECTION, "filter": {"uid": "0"}},
+        {"name": "device_latest", "collection": DEVICE_LATEST_COLLECTION, "filter": {"uid": "0", "sn": "0"}},
+        {"name": "sync_states", "collection": SYNC_STATE_COLLECTION, "filter": {"uid": "0"}},
+        {
+            "name": "active_job",
+            "collection": JOBS_COLLECTION,
+            "filter": {"key": "probe", "active": True},
+        },
+    ]
+
+
+async def check_query_plans(db: AsyncIOMotorDatabase, queries: Optional[Iterable[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Explain each hot query and report its winning plan. `collscan` marks a
+    full collection scan; `covered` means no document fetch was needed.
+    """
+    report = []
+    for query in queries or hot_queries():
+        cursor = db[query["collection"]].find(query["filter"], query.get("projection"))
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        entry: Dict[str, Any] = {"name": query["name"], "collection": query["collection"]}
+        try:
+            plan = await cursor.limit(1 if not query.get("sort") else 0).explain()
+        except Exception as exc:
+            entry["error"] = str(exc)
+            report.append(entry)
+            continue
+        stages = _plan_stages(plan.get("queryPlanner", {}).get("winningPlan", {}))
+        entry["stages"] = sorted(stages)
+        entry["collscan"] = "COLLSCAN" in stages
+        entry["covered"] = "FETCH" not in stages and not entry["collscan"]
+        entry["ok"] = not entry["collscan"] and (entry["covered"] or not query.get("expect_covered"))
+        report.append(entry)
+    return report
+
+
+async def warn_on_bad_plans(db: AsyncIOMotorDatabase) -> List[Dict[str, Any]]:
+    report = await check_query_plans(db)
+    for entry in report:
+        if entry.get("error"):
+            print(f"⚠ Could not explain {entry['name']}: {entry['error']}")
+        elif entry["collscan"]:
+            print(f"⚠ Query {entry['name']} on {entry['collection']} falls back to a COLLSCAN")
+        elif not entry["ok"]:
+            print(f"⚠ Query {entry['name']} is not covered by an index (stages: {', '.join(entry['stages'])})")
+    return report
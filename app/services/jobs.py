@@ -0,0 +1,228 @@
+# app/services/jobs.py
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.services.cache import TTLCache
+from app.services.mongodb import MongoService
+
+
+ACTIVE_STATUSES = ("queued", "running")
+HEARTBEAT_SECONDS = 15.0
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    key: str
+    owner: str
+    status: str = "queued"
+    progress: Dict[str, Any] = field(default_factory=dict)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    updated_at: datetime = field(default_factory=datetime.utcnow)
+
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def to_doc(self) -> Dict[str, Any]:
+        doc = {k: v for k, v in self.__dict__.items() if k != "id"}
+        doc["_id"] = self.id
+        # Indexed (unique per key while true) so two workers can't both run a key
+        doc["active"] = self.active
+        return doc
+
+
+JobFn = Callable[[Job], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class JobQueue:
+    """
+    Bounded pool of background workers for user-triggered jobs.
+
+    `submit` deduplicates on `key`: while a job with the same key is queued
+    or running — in this process, or in another worker whose job document
+    was updated within the last few heartbeats — that job is returned
+    instead of starting another. Submits for one key are serialized here,
+    and the job insert is the atomic claim across workers. Every active job,
+    queued or running, is heartbeated so other workers don't take it over;
+    one that was declared lost anyway is skipped rather than run twice.
+    Job state is mirrored to Mongo so any worker can answer status
+    requests; finished jobs also stay in memory for `retain_seconds`.
+    """
+
+    def __init__(self, mongo: MongoService, workers: int = 2, retain_seconds: float = 3600, max_queued: int = 1000):
+        self.mongo = mongo
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self._queue: "asyncio.Queue[tuple[Job, JobFn]]" = asyncio.Queue()
+        self._jobs: TTLCache[Job] = TTLCache(retain_seconds, max_entries=10_000)
+        self._active: Dict[str, Job] = {}
+        self._key_locks: Dict[str, asyncio.Lock] = {}
+        self._key_waiters: Dict[str, int] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._last_save: Dict[str, float] = {}
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        running = sum(1 for job in self._active.values() if job.status == "running")
+        return {"workers": self.workers, "queued": self._queue.qsize(), "running": running}
+
+    async def submit(self, kind: str, key: str, owner: str, fn: JobFn) -> tuple[Job, bool]:
+        """Queue a job, or return the active one with the same key. Returns (job, created)."""
+        lock = self._key_locks.setdefault(key, asyncio.Lock())
+        self._key_waiters[key] = self._key_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                return await self._submit(kind, key, owner, fn)
+        finally:
+            self._key_waiters[key] -= 1
+            if not self._key_waiters[key]:
+                del self._key_waiters[key]
+                del self._key_locks[key]
+
+    async def _submit(self, kind: str, key: str, owner: str, fn: JobFn) -> tuple[Job, bool]:
+        existing = self._active.get(key)
+        if existing is not None:
+            return existing, False
+
+        if self._queue.qsize() >= self.max_queued:
+            raise RuntimeError("Job queue is full")
+
+        job = Job(id=uuid.uuid4().hex, kind=kind, key=key, owner=owner)
+        fresh_after = datetime.utcnow() - timedelta(seconds=HEARTBEAT_SECONDS * 4)
+        holder = await self.mongo.claim_job(job.to_doc(), fresh_after)
+        if holder is not None:
+            return _job_from_doc(holder), False
+
+        self._active[key] = job
+        self._jobs.set(job.id, job)
+        self._last_save[job.id] = time.monotonic()
+        self.start()
+        await self._queue.put((job, fn))
+        return job, True
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        doc = await self.mongo.get_job(job_id)
+        return _job_from_doc(doc) if doc else None
+
+    async def save(self, job: Job, force: bool = False) -> bool:
+        """
+        Persist job state; progress updates are throttled to one write per
+        heartbeat. Returns False if another worker has declared the job lost.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_save.get(job.id, 0) < HEARTBEAT_SECONDS:
+            return True
+        self._last_save[job.id] = now
+        job.updated_at = datetime.utcnow()
+        try:
+            return await self.mongo.save_job(job.to_doc())
+        except Exception as exc:
+            print(f"⚠ Could not persist job {job.id}: {exc}")
+            return True
+
+    def _release(self, job: Job) -> None:
+        if self._active.get(job.key) is job:
+            del self._active[job.key]
+        self._last_save.pop(job.id, None)
+
+    async def _worker(self) -> None:
+        while True:
+            job, fn = await self._queue.get()
+            job.status = "running"
+            job.started_at = datetime.utcnow()
+            if not await self.save(job, force=True):
+                print(f"⚠ Job {job.id} ({job.kind}) was taken over by another worker; skipping it")
+                job.status = "failed"
+                job.error = "Worker lost"
+                job.finished_at = datetime.utcnow()
+                self._release(job)
+                self._queue.task_done()
+                continue
+            try:
+                job.result = await fn(job)
+                job.status = "completed"
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "Worker shut down"
+                raise
+            except Exception as exc:
+                job.status = "failed"
+                job.error = str(exc) or repr(exc)
+                print(f"❌ Job {job.id} ({job.kind}) failed: {exc!r}")
+            finally:
+                job.finished_at = datetime.utcnow()
+                self._release(job)
+                await self.save(job, force=True)
+                self._queue.task_done()
+
+    async def _heartbeat(self) -> None:
+        # Queued jobs too: one waiting behind long syncs must not look abandoned
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            for job in list(self._active.values()):
+                if not await self.save(job, force=True):
+                    print(f"⚠ Job {job.id} ({job.kind}) was declared lost by another worker")
+
+
+def _job_from_doc(doc: Dict[str, Any]) -> Job:
+    fields = {k: v for k, v in doc.items() if k in Job.__dataclass_fields__ and k != "id"}
+    return Job(id=doc["_id"], **fields)
+
+
+# ────────────────────────────────────────────────
+#             Process-wide shared JobQueue
+# ────────────────────────────────────────────────
+
+_shared_queue: Optional[JobQueue] = None
+
+
+def get_shared_job_queue() -> Optional[JobQueue]:
+    return _shared_queue
+
+
+def set_shared_job_queue(queue: Optional[JobQueue]) -> None:
+    global _shared_queue
+    _shared_queue = queue
+
+
+async def close_shared_job_queue() -> None:
+    global _shared_queue
+    if _shared_queue is not None:
+        await _shared_queue.close()
+        _shared_queue = None
@@ -0,0 +1,139 @@
+# app/services/leases.py
+import asyncio
+import os
+import socket
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def shard_of(uid: str, total_shards: int) -> int:
+    """Stable shard for a uid; crc32 so every process agrees."""
+    return zlib.crc32(str(uid).encode("utf-8")) % total_shards
+
+
+def shard_lease_name(shard: int) -> str:
+    return f"sync-shard-{shard}"
+
+
+class LeaseManager:
+    """
+    Expiring leases in a Mongo collection, one document per lease name.
+
+    A lease is taken when it is free, expired, or already ours; the upsert
+    races on `_id`, so exactly one process wins. Holders must renew before
+    `ttl` runs out (see `heartbeat`); a crashed holder's lease simply
+    expires and is taken over by the next claimant.
+    """
+
+    def __init__(self, collection, owner: Optional[str] = None, ttl_seconds: float = 60):
+        self.collection = collection
+        self.owner = owner or worker_id()
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.held: Set[str] = set()
+
+    async def try_acquire(self, name: str) -> Optional[dict]:
+        now = datetime.utcnow()
+        try:
+            doc = await self.collection.find_one_and_update(
+                {"_id": name, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + self.ttl, "heartbeat_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Someone else holds an unexpired lease
+            self.held.discard(name)
+            return None
+        self.held.add(name)
+        return doc
+
+    async def renew(self, name: str) -> bool:
+        now = datetime.utcnow()
+        result = await self.collection.update_one(
+            {"_id": name, "owner": self.owner},
+            {"$set": {"expires_at": now + self.ttl, "heartbeat_at": now}},
+        )
+        if result.matched_count == 0:
+            self.held.discard(name)
+            return False
+        return True
+
+    async def release(self, name: str) -> None:
+        await self.collection.update_one(
+            {"_id": name, "owner": self.owner},
+            {"$set": {"expires_at": datetime.utcnow()}},
+        )
+        self.held.discard(name)
+
+    async def release_all(self) -> None:
+        for name in list(self.held):
+            await self.release(name)
+
+    async def mark_run(self, name: str, at: Optional[datetime] = None) -> None:
+        """Record a completed pass; any resume cursor from a partial pass is dropped."""
+        await self.collection.update_one(
+            {"_id": name, "owner": self.owner},
+            {"$set": {"last_run_at": at or datetime.utcnow()}, "$unset": {"cursor": ""}},
+        )
+
+    async def save_cursor(self, name: str, cursor: dict) -> bool:
+        """Store where a partial pass stopped; ignored if the lease was lost."""
+        result = await self.collection.update_one(
+            {"_id": name, "owner": self.owner},
+            {"$set": {"cursor": {**cursor, "updated_at": datetime.utcnow()}}},
+        )
+        return result.matched_count > 0
+
+    async def acquire_shards(self, total_shards: int, limit: int = 0) -> Dict[int, dict]:
+        """
+        Claim up to `limit` shards (0 = all available), keeping ones already held.
+        Returns {shard: lease_doc} for every shard this process now owns.
+        """
+        owned: Dict[int, dict] = {}
+        order: Iterable[int] = sorted(
+            range(total_shards),
+            key=lambda s: shard_lease_name(s) not in self.held,
+        )
+        for shard in order:
+            if limit and len(owned) >= limit:
+                break
+            doc = await self.try_acquire(shard_lease_name(shard))
+            if doc is not None:
+                owned[shard] = doc
+        return owned
+
+    async def heartbeat(self, interval: Optional[float] = None) -> None:
+        """Renew every held lease forever; run as a background task."""
+        interval = interval or self.ttl.total_seconds() / 3
+        while True:
+            await asyncio.sleep(interval)
+            for name in list(self.held):
+                try:
+                    if not await self.renew(name):
+                        print(f"⚠ Lost lease {name}")
+                except Exception as exc:
+                    print(f"⚠ Lease renew failed for {name}: {exc}")
+
+
+def due_shards(owned: Dict[int, dict], interval_seconds: float, now: Optional[datetime] = None, slack: float = 0.1) -> List[int]:
+    """
+    Shards whose last run (by any process) is at least one interval ago.
+    `slack` tolerates schedulers firing slightly early, e.g. cron jitter.
+    """
+    now = now or datetime.utcnow()
+    threshold = interval_seconds * (1 - slack)
+    due = []
+    for shard, doc in owned.items():
+        last_run = doc.get("last_run_at")
+        if last_run is None or (now - last_run).total_seconds() >= threshold:
+            due.append(shard)
+    return sorted(due)
@@ -1,17 +1,25 @@
 # app/services/location.py
+import asyncio
 from datetime import datetime
 from typing import Dict, List, Optional
 
-from motor.motor_asyncio import AsyncIOMotorDatabase
-from bson import ObjectId
+from app.models.location import TrajectoryResponse, PlaybackResponse
+from app.services.cache import TTLCache
+from app.services.location_store import LocationStore
+from app.services.simplify import simplify_coordinates, zoom_tolerance_m
 
-from app.models.location import LocationPointDB, TrajectoryResponse, PlaybackResponse
+
+SIMPLIFY_CACHE_TTL_SECONDS = 300
+# Above this many points, simplification runs in a worker thread to keep the loop responsive
+SIMPLIFY_THREAD_THRESHOLD = 5000
+
+# Simplified trajectories per (uid, sn, start, end, zoom, tolerance), shared across requests
+_simplified: TTLCache[TrajectoryResponse] = TTLCache(SIMPLIFY_CACHE_TTL_SECONDS, max_entries=512)
 
 
 class LocationService:
-    def __init__(self, db: AsyncIOMotorDatabase):
-        self.db = db
-        self.collection = db["locations"]
+    def __init__(self, store: LocationStore):
+        self.store = store
 
     async def get_trajectory(
         self,
@@ -19,25 +27,38 @@ class LocationService:
         sn: str,
         start_time: datetime,
         end_time: datetime,
+        tolerance_m: Optional[float] = None,
+        zoom: Optional[int] = None,
     ) -> Optional[TrajectoryResponse]:
-        cursor = self.collection.find(
-            {
-                "uid": uid,
-                "sn": sn,
-                "timestamp": {"$gte": start_time, "$lte": end_time},
-            },
-            {"lat": 1, "lng": 1, "timestamp": 1},
-            sort=[("timestamp", 1)],
-        )
+        """
+        Route as a GeoJSON LineString. With `tolerance_m` (meters) or `zoom`
+        (tolerance = one pixel at that zoom) the line is simplified with
+        Douglas-Peucker; `tolerance_m` wins if both are given.
+        """
+        simplify = tolerance_m is not None or zoom is not None
+        cache_key = (uid, sn, start_time, end_time, zoom, tolerance_m)
+        if simplify:
+            cached = _simplified.get(cache_key)
+            if cached is not None:
+                return cached
 
-        points = []
-        async for doc in cursor:
-            points.append([doc["lng"], doc["lat"]])  # GeoJSON: [lng, lat]
+        rows = await self.store.read(uid, sn, start_time, end_time)
+        points = [[lng, lat] for _, lat, lng in rows]  # GeoJSON: [lng, lat]
 
         if not points:
             return None
 
-        return TrajectoryResponse(
+        original_count = len(points)
+        if simplify:
+            if tolerance_m is None:
+                mid_lat = sum(p[1] for p in points) / len(points)
+                tolerance_m = zoom_tolerance_m(zoom, mid_lat)
+            if len(points) > SIMPLIFY_THREAD_THRESHOLD:
+                points = await asyncio.to_thread(simplify_coordinates, points, tolerance_m)
+            else:
+                points = simplify_coordinates(points, tolerance_m)
+
+        result = TrajectoryResponse(
             feature={
                 "type": "Feature",
                 "geometry": {"type": "LineString", "coordinates": points},
@@ -48,10 +69,15 @@ class LocationService:
                 },
             },
             count=len(points),
+            original_count=original_count,
+            tolerance_m=tolerance_m,
             start_time=start_time,
             end_time=end_time,
             device_sn=sn,
         )
+        if simplify:
+            _simplified.set(cache_key, result)
+        return result
 
     async def get_playback_points(
         self,
@@ -60,23 +86,8 @@ class LocationService:
         start_time: datetime,
         end_time: datetime,
     ) -> Optional[PlaybackResponse]:
-        cursor = self.collection.find(
-            {
-                "uid": uid,
-                "sn": sn,
-                "timestamp": {"$gte": start_time, "$lte": end_time},
-            },
-            {"lat": 1, "lng": 1, "timestamp": 1, "speed": 1, "accuracy": 1},
-            sort=[("timestamp", 1)],
-        )
-
-        points = []
-        async for doc in cursor:
-            points.append({
-                "lat": doc["lat"],
-                "lng": doc["lng"],
-                "timestamp": doc["timestamp"],
-            })
+        rows = await self.store.read(uid, sn, start_time, end_time)
+        points = [{"lat": lat, "lng": lng, "timestamp": ts} for ts, lat, lng in rows]
 
         if not points:
             return None
@@ -0,0 +1,426 @@
+# app/services/location_store.py
+import abc
+import bisect
+import heapq
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.services.metrics import MONGO_WRITE_SECONDS
+
+
+LOCATIONS_COLLECTION = "locations"
+LOCATION_BUCKETS_COLLECTION = "location_buckets"
+
+DUPLICATE_KEY_ERROR = 11000
+BUCKET_SECONDS = 3600
+TIER_BUCKET_SECONDS = 86400
+MAX_WRITE_ATTEMPTS = 5
+
+_EPOCH = datetime(1970, 1, 1)
+
+# (timestamp, lat, lng), in timestamp order
+Point = Tuple[datetime, float, float]
+
+
+@dataclass
+class IngestResult:
+    """Outcome of a batch ingest, mirroring the per-item upsert semantics."""
+    inserted: int = 0
+    modified: int = 0
+    duplicates_in_batch: int = 0
+    skipped: int = 0
+    known: int = 0
+    newest: Optional[datetime] = None
+
+    @property
+    def changed(self) -> int:
+        return self.inserted + self.modified
+
+    def __iadd__(self, other: "IngestResult") -> "IngestResult":
+        self.inserted += other.inserted
+        self.modified += other.modified
+        self.duplicates_in_batch += other.duplicates_in_batch
+        self.skipped += other.skipped
+        self.known += other.known
+        if other.newest and (self.newest is None or other.newest > self.newest):
+            self.newest = other.newest
+        return self
+
+
+def naive_utc(value: datetime) -> datetime:
+    """Mongo stores naive UTC; aware timestamps from upstream are converted to match."""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def bucket_start(ts: datetime, seconds: int = BUCKET_SECONDS) -> datetime:
+    offset = int((ts - _EPOCH).total_seconds()) // seconds * seconds
+    return _EPOCH + timedelta(seconds=offset)
+
+
+async def _distinct_devices(collection) -> List[Tuple[str, str]]:
+    # $sort on the (uid, sn, ...) index prefix lets the server walk distinct keys
+    pipeline = [
+        {"$sort": {"uid": 1, "sn": 1}},
+        {"$group": {"_id": {"uid": "$uid", "sn": "$sn"}}},
+    ]
+    rows = [row["_id"] async for row in collection.aggregate(pipeline, allowDiskUse=True)]
+    return sorted((row["uid"], row["sn"]) for row in rows if row.get("uid") and row.get("sn"))
+
+
+class LocationStore(abc.ABC):
+    """
+    Where location points live. Ingest writes normalized docs
+    ({uid, sn, timestamp, lat, lng}) and readers get time-ordered points;
+    neither needs to know how they are laid out in Mongo.
+
+    `write` has upsert semantics: a point already stored for the same
+    (uid, sn, timestamp) is overwritten, and counts as modified only if
+    its position changed.
+    """
+
+    name = "abstract"
+
+    @abc.abstractmethod
+    async def write(self, docs: Sequence[dict], chunk_size: int = 500) -> IngestResult:
+        """Upsert normalized docs, `chunk_size` per round trip."""
+
+    @abc.abstractmethod
+    async def read(self, uid: str, sn: str, start: datetime, end: datetime) -> List[Point]:
+        """Points in [start, end], ordered by timestamp."""
+
+    @abc.abstractmethod
+    async def count(self, uid: str, sn: str) -> int:
+        """Number of points stored for the device."""
+
+    @abc.abstractmethod
+    async def first_timestamp(self, uid: str, sn: str) -> Optional[datetime]:
+        """Timestamp of the device's oldest stored point, if any."""
+
+    @abc.abstractmethod
+    async def delete(self, uid: str, sn: str, start: datetime, end: datetime) -> int:
+        """Remove points in [start, end); returns how many were removed."""
+
+    @abc.abstractmethod
+    async def devices(self) -> List[Tuple[str, str]]:
+        """Every (uid, sn) with at least one stored point, sorted."""
+
+
+class DocumentLocationStore(LocationStore):
+    """One document per fix in `locations` (the original layout)."""
+
+    name = "documents"
+
+    def __init__(self, db: AsyncIOMotorDatabase, collection: str = LOCATIONS_COLLECTION):
+        self.collection = db[collection]
+
+    async def write(self, docs: Sequence[dict], chunk_size: int = 500) -> IngestResult:
+        ops = [
+            UpdateOne(
+                {"uid": doc["uid"], "sn": doc["sn"], "timestamp": doc["timestamp"]},
+                {"$set": doc},
+                upsert=True,
+            )
+            for doc in docs
+        ]
+        result = IngestResult()
+        for start in range(0, len(ops), chunk_size):
+            result += await self._bulk_upsert(ops[start:start + chunk_size])
+        return result
+
+    async def _bulk_upsert(self, ops: List[UpdateOne]) -> IngestResult:
+        try:
+            with MONGO_WRITE_SECONDS.time(operation="locations_bulk_upsert"):
+                bulk = await self.collection.bulk_write(ops, ordered=False)
+            return IngestResult(inserted=bulk.upserted_count, modified=bulk.modified_count)
+        except BulkWriteError as exc:
+            # Concurrent writers racing on the same key lose with a duplicate-key
+            # error; the point is stored either way, so only re-raise real failures.
+            details = exc.details
+            if any(err.get("code") != DUPLICATE_KEY_ERROR for err in details.get("writeErrors", [])):
+                raise
+            return IngestResult(inserted=details.get("nUpserted", 0), modified=details.get("nModified", 0))
+
+    async def read(self, uid: str, sn: str, start: datetime, end: datetime) -> List[Point]:
+        cursor = self.collection.find(
+            {"uid": uid, "sn": sn, "timestamp": {"$gte": start, "$lte": end}},
+            # _id excluded so the (uid, sn, timestamp, lat, lng) index covers the query
+            {"_id": 0, "lat": 1, "lng": 1, "timestamp": 1},
+            sort=[("timestamp", 1)],
+        )
+        return [(doc["timestamp"], doc["lat"], doc["lng"]) async for doc in cursor]
+
+    async def count(self, uid: str, sn: str) -> int:
+        return await self.collection.count_documents({"uid": uid, "sn": sn})
+
+    async def first_timestamp(self, uid: str, sn: str) -> Optional[datetime]:
+        doc = await self.collection.find_one({"uid": uid, "sn": sn}, {"_id": 0, "timestamp": 1}, sort=[("timestamp", 1)])
+        return doc["timestamp"] if doc else None
+
+    async def delete(self, uid: str, sn: str, start: datetime, end: datetime) -> int:
+        result = await self.collection.delete_many({"uid": uid, "sn": sn, "timestamp": {"$gte": start, "$lt": end}})
+        return result.deleted_count
+
+    async def devices(self) -> List[Tuple[str, str]]:
+        return await _distinct_devices(self.collection)
+
+
+class BucketLocationStore(LocationStore):
+    """
+    Points packed into one document per device per hour in `location_buckets`:
+
+        {uid, sn, start, count, v, t: [ms offsets from start], lat: [...], lng: [...]}
+
+    Arrays are kept sorted by `t`. uid/sn and the index entry are paid once
+    per bucket instead of once per fix, and a day of playback is ~24 reads.
+
+    Writes merge in Python and store the bucket with an optimistic version
+    check (`v`); a writer that loses the race re-reads and merges again.
+    """
+
+    name = "buckets"
+
+    def __init__(self, db: AsyncIOMotorDatabase, bucket_seconds: int = BUCKET_SECONDS, collection: str = LOCATION_BUCKETS_COLLECTION):
+        self.collection = db[collection]
+        self.bucket_seconds = bucket_seconds
+
+    async def write(self, docs: Sequence[dict], chunk_size: int = 500) -> IngestResult:
+        groups: Dict[tuple, Dict[int, Tuple[float, float]]] = {}
+        for doc in docs:
+            ts = naive_utc(doc["timestamp"])
+            start = bucket_start(ts, self.bucket_seconds)
+            offset = int((ts - start).total_seconds() * 1000)
+            groups.setdefault((doc["uid"], doc["sn"], start), {})[offset] = (doc["lat"], doc["lng"])
+
+        result = IngestResult()
+        for (uid, sn, start), points in groups.items():
+            inserted, modified = await self._merge_bucket(uid, sn, start, points)
+            result.inserted += inserted
+            result.modified += modified
+        return result
+
+    async def _merge_bucket(self, uid: str, sn: str, start: datetime, points: Dict[int, Tuple[float, float]]) -> Tuple[int, int]:
+        key = {"uid": uid, "sn": sn, "start": start}
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            bucket = await self.collection.find_one(key, {"t": 1, "lat": 1, "lng": 1, "v": 1})
+            t = list(bucket["t"]) if bucket else []
+            lat = list(bucket["lat"]) if bucket else []
+            lng = list(bucket["lng"]) if bucket else []
+
+            inserted = modified = 0
+            for offset in sorted(points):
+                new_lat, new_lng = points[offset]
+                i = bisect.bisect_left(t, offset)
+                if i < len(t) and t[i] == offset:
+                    if (lat[i], lng[i]) != (new_lat, new_lng):
+                        lat[i], lng[i] = new_lat, new_lng
+                        modified += 1
+                    continue
+                t.insert(i, offset)
+                lat.insert(i, new_lat)
+                lng.insert(i, new_lng)
+                inserted += 1
+
+            if not inserted and not modified:
+                return 0, 0
+
+            fields = {"t": t, "lat": lat, "lng": lng, "count": len(t)}
+            with MONGO_WRITE_SECONDS.time(operation="location_bucket_write"):
+                if bucket is None:
+                    try:
+                        await self.collection.insert_one({**key, **fields, "v": 1})
+                        return inserted, modified
+                    except DuplicateKeyError:
+                        continue
+                update = await self.collection.update_one(
+                    {"_id": bucket["_id"], "v": bucket.get("v", 0)},
+                    {"$set": fields, "$inc": {"v": 1}},
+                )
+                if update.matched_count:
+                    return inserted, modified
+        raise RuntimeError(f"Location bucket {uid}/{sn}/{start.isoformat()} kept changing; gave up after {MAX_WRITE_ATTEMPTS} attempts")
+
+    async def read(self, uid: str, sn: str, start: datetime, end: datetime) -> List[Point]:
+        start, end = naive_utc(start), naive_utc(end)
+        cursor = self.collection.find(
+            {"uid": uid, "sn": sn, "start": {"$gte": bucket_start(start, self.bucket_seconds), "$lte": end}},
+            {"_id": 0, "start": 1, "t": 1, "lat": 1, "lng": 1},
+            sort=[("start", 1)],
+        )
+        points: List[Point] = []
+        async for bucket in cursor:
+            base = bucket["start"]
+            for offset, lat, lng in zip(bucket["t"], bucket["lat"], bucket["lng"]):
+                ts = base + timedelta(milliseconds=offset)
+                if start <= ts <= end:
+                    points.append((ts, lat, lng))
+        return points
+
+    async def count(self, uid: str, sn: str) -> int:
+        pipeline = [
+            {"$match": {"uid": uid, "sn": sn}},
+            {"$group": {"_id": None, "n": {"$sum": "$count"}}},
+        ]
+        async for row in self.collection.aggregate(pipeline):
+            return row["n"]
+        return 0
+
+    async def first_timestamp(self, uid: str, sn: str) -> Optional[datetime]:
+        bucket = await self.collection.find_one({"uid": uid, "sn": sn}, {"start": 1, "t": 1}, sort=[("start", 1)])
+        if not bucket or not bucket["t"]:
+            return None
+        return bucket["start"] + timedelta(milliseconds=bucket["t"][0])
+
+    async def delete(self, uid: str, sn: str, start: datetime, end: datetime) -> int:
+        # Whole buckets only; callers (the retention compactor) work on aligned ranges
+        if bucket_start(start, self.bucket_seconds) != start or bucket_start(end, self.bucket_seconds) != end:
+            raise ValueError(f"Bucket delete range must align to {self.bucket_seconds}s")
+        query = {"uid": uid, "sn": sn, "start": {"$gte": start, "$lt": end}}
+        removed = sum([bucket["count"] async for bucket in self.collection.find(query, {"count": 1})])
+        await self.collection.delete_many(query)
+        return removed
+
+    async def devices(self) -> List[Tuple[str, str]]:
+        return await _distinct_devices(self.collection)
+
+
+# ────────────────────────────────────────────────
+#              Retention tiers
+# ────────────────────────────────────────────────
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value: str) -> timedelta:
+    match = re.fullmatch(r"\s*(\d+)\s*([smhd])\s*", value)
+    if not match:
+        raise ValueError(f"Bad duration {value!r}; expected e.g. 90s, 10m, 6h, 30d")
+    return timedelta(seconds=int(match.group(1)) * _UNITS[match.group(2)])
+
+
+def _format_duration(value: timedelta) -> str:
+    seconds = int(value.total_seconds())
+    for unit in ("d", "h", "m"):
+        if seconds % _UNITS[unit] == 0:
+            return f"{seconds // _UNITS[unit]}{unit}"
+    return f"{seconds}s"
+
+
+@dataclass(frozen=True)
+class RetentionTier:
+    """Points older than `after` are kept at one per `resolution`."""
+    after: timedelta
+    resolution: timedelta
+
+    @property
+    def name(self) -> str:
+        return _format_duration(self.resolution)
+
+
+def parse_tiers(spec: str) -> List[RetentionTier]:
+    """
+    Parse "30d:1m,365d:10m" (age:resolution pairs). Tiers must get older and
+    coarser together; an empty spec means keep everything at full resolution.
+    """
+    tiers = []
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        after, _, resolution = part.partition(":")
+        tiers.append(RetentionTier(parse_duration(after), parse_duration(resolution)))
+    tiers.sort(key=lambda t: t.after)
+    for finer, coarser in zip(tiers, tiers[1:]):
+        if coarser.resolution <= finer.resolution:
+            raise ValueError("Retention tiers must get coarser as they get older")
+    return tiers
+
+
+class TieredLocationStore(LocationStore):
+    """
+    Full-resolution store plus one downsampled store per retention tier.
+
+    New points always go to `raw`; the retention compactor moves old ones
+    into the tiers. Reads merge every store that can hold points in the
+    range: a tier only ever receives points older than its age threshold,
+    so recent ranges are served by `raw` alone.
+    """
+
+    name = "tiered"
+
+    def __init__(self, raw: LocationStore, tiers: Sequence[Tuple[RetentionTier, LocationStore]]):
+        self.raw = raw
+        self.tiers = list(tiers)
+
+    async def write(self, docs: Sequence[dict], chunk_size: int = 500) -> IngestResult:
+        return await self.raw.write(docs, chunk_size)
+
+    async def read(self, uid: str, sn: str, start: datetime, end: datetime) -> List[Point]:
+        now = datetime.utcnow()
+        parts = [await self.raw.read(uid, sn, start, end)]
+        for tier, store in self.tiers:
+            if naive_utc(start) < now - tier.after:
+                parts.append(await store.read(uid, sn, start, end))
+        parts = [part for part in parts if part]
+        if len(parts) <= 1:
+            return parts[0] if parts else []
+
+        # A point copied into a tier but not yet deleted from its source shows up twice
+        points: List[Point] = []
+        for point in heapq.merge(*parts, key=lambda p: p[0]):
+            if not points or points[-1][0] != point[0]:
+                points.append(point)
+        return points
+
+    async def count(self, uid: str, sn: str) -> int:
+        total = await self.raw.count(uid, sn)
+        for _, store in self.tiers:
+            total += await store.count(uid, sn)
+        return total
+
+    async def first_timestamp(self, uid: str, sn: str) -> Optional[datetime]:
+        stamps = [await self.raw.first_timestamp(uid, sn)]
+        stamps += [await store.first_timestamp(uid, sn) for _, store in self.tiers]
+        return min(filter(None, stamps), default=None)
+
+    async def delete(self, uid: str, sn: str, start: datetime, end: datetime) -> int:
+        removed = await self.raw.delete(uid, sn, start, end)
+        for _, store in self.tiers:
+            removed += await store.delete(uid, sn, start, end)
+        return removed
+
+    async def devices(self) -> List[Tuple[str, str]]:
+        found = set(await self.raw.devices())
+        for _, store in self.tiers:
+            found.update(await store.devices())
+        return sorted(found)
+
+
+def build_tier_store(db: AsyncIOMotorDatabase, kind: str, tier: RetentionTier) -> LocationStore:
+    if kind == BucketLocationStore.name:
+        return BucketLocationStore(db, TIER_BUCKET_SECONDS, f"{LOCATION_BUCKETS_COLLECTION}_{tier.name}")
+    return DocumentLocationStore(db, f"{LOCATIONS_COLLECTION}_{tier.name}")
+
+
+LOCATION_STORES = {
+    DocumentLocationStore.name: DocumentLocationStore,
+    BucketLocationStore.name: BucketLocationStore,
+}
+
+
+def build_location_store(
+    db: AsyncIOMotorDatabase,
+    kind: Optional[str] = None,
+    tiers: Optional[Sequence[RetentionTier]] = None,
+) -> LocationStore:
+    kind = kind or DocumentLocationStore.name
+    if kind not in LOCATION_STORES:
+        raise ValueError(f"Unknown location storage {kind!r}; expected one of {', '.join(LOCATION_STORES)}")
+    store = LOCATION_STORES[kind](db)
+    if not tiers:
+        return store
+    return TieredLocationStore(store, [(tier, build_tier_store(db, kind, tier)) for tier in tiers])
@@ -0,0 +1,245 @@
+# app/services/metrics.py
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms with optional labels, registered in a
+module-level REGISTRY and rendered by `render()` for the /metrics route.
+Values are per process; Prometheus aggregates across workers.
+"""
+import abc
+import bisect
+import math
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+LAG_BUCKETS = (30, 60, 120, 300, 600, 1800, 3600, 6 * 3600, 24 * 3600, 7 * 86400)
+RUN_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 900, 1800)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """Exposition lines for every series of this metric."""
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        # Unlabelled series exist from the start, so they scrape as 0 rather than missing
+        self._values: Dict[LabelValues, float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        # Unlabelled series exist from the start, so they scrape as 0 rather than missing
+        self._values: Dict[LabelValues, float] = {} if self.labelnames else {(): 0}
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last)], sum
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key in sorted(self._counts):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), self._counts[key]):
+                cumulative += count
+                le = _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', le))} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# ────────────────────────────────────────────────
+#               Sync pipeline metrics
+# ────────────────────────────────────────────────
+
+SYNC_RUNS = REGISTRY.register(Counter(
+    "citytag_sync_runs_total", "Completed sync runs", ["mode"]))
+SYNC_RUN_SECONDS = REGISTRY.register(Histogram(
+    "citytag_sync_run_duration_seconds", "Wall time of a sync run", ["mode"], buckets=RUN_BUCKETS))
+SYNC_INTERVAL = REGISTRY.register(Gauge(
+    "citytag_sync_interval_seconds", "Configured interval between scheduled sync runs"))
+SYNC_LAST_RUN = REGISTRY.register(Gauge(
+    "citytag_sync_last_run_timestamp_seconds", "Unix time the last sync run finished", ["mode"]))
+SYNC_BUDGET_EXHAUSTED = REGISTRY.register(Counter(
+    "citytag_sync_budget_exhausted_total", "Sync runs stopped early by their time budget, to resume later"))
+SYNC_USERS = REGISTRY.register(Counter(
+    "citytag_sync_users_total", "Users processed by sync"))
+SYNC_DEVICES = REGISTRY.register(Counter(
+    "citytag_sync_devices_total", "Device syncs attempted", ["result"]))
+SYNC_RELOGINS = REGISTRY.register(Counter(
+    "citytag_sync_relogins_total", "CityTag logins triggered by rejected tokens"))
+POINTS_FETCHED = REGISTRY.register(Counter(
+    "citytag_points_fetched_total", "History points received from CityTag"))
+POINTS_WRITTEN = REGISTRY.register(Counter(
+    "citytag_points_written_total", "History points written to Mongo", ["result"]))
+DEVICE_SYNC_SECONDS = REGISTRY.register(Histogram(
+    "citytag_device_sync_duration_seconds", "Wall time to fetch and ingest one device"))
+POLL_SCHEDULED = REGISTRY.register(Gauge(
+    "citytag_poll_scheduled_devices", "Devices queued in this worker's adaptive poll scheduler"))
+POLL_IN_FLIGHT = REGISTRY.register(Gauge(
+    "citytag_poll_in_flight", "Device polls currently running in this worker"))
+FRESHNESS_LAG = REGISTRY.register(Histogram(
+    "citytag_device_freshness_lag_seconds",
+    "Age of a device's newest stored point, observed after each device sync",
+    buckets=LAG_BUCKETS,
+))
+
+# ────────────────────────────────────────────────
+#               Upstream and storage metrics
+# ────────────────────────────────────────────────
+
+UPSTREAM_SECONDS = REGISTRY.register(Histogram(
+    "citytag_upstream_request_duration_seconds", "CityTag HTTP request latency per attempt", ["operation", "outcome"]))
+UPSTREAM_RETRIES = REGISTRY.register(Counter(
+    "citytag_upstream_retries_total", "CityTag request attempts that were retried", ["operation"]))
+DECRYPT_SECONDS = REGISTRY.register(Histogram(
+    "citytag_decrypt_duration_seconds", "3DES decrypt + JSON decode time per response", ["path"], buckets=FAST_BUCKETS))
+TOKEN_LOGINS = REGISTRY.register(Counter(
+    "citytag_token_logins_total", "CityTag logins performed by the token manager", ["reason"]))
+MONGO_WRITE_SECONDS = REGISTRY.register(Histogram(
+    "citytag_mongo_write_duration_seconds", "Mongo write latency", ["operation"]))
+POINT_FILTER = REGISTRY.register(Counter(
+    "citytag_point_filter_total", "Ingested points checked against the recent-point filter (hit = already stored, not written)", ["result"]))
+POINT_FILTER_SEEDS = REGISTRY.register(Counter(
+    "citytag_point_filter_seeds_total", "Devices whose recent points were loaded from the store into the filter"))
+RETENTION_POINTS = REGISTRY.register(Counter(
+    "citytag_retention_points_total", "Points kept in or removed from a tier's source by retention compaction", ["tier", "result"]))
+RETENTION_RUN_SECONDS = REGISTRY.register(Histogram(
+    "citytag_retention_run_duration_seconds", "Wall time of a retention compaction pass", buckets=RUN_BUCKETS))
@@ -1,24 +1,161 @@
-from typing import Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from datetime import datetime
+import threading
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from bson import ObjectId
+from pymongo import monitoring
+from pymongo.errors import DuplicateKeyError
 
 from app.models.user import UserInDB, UserCreate
+from app.services.cache import TTLCache
+from app.services.location_store import (
+    LOCATION_BUCKETS_COLLECTION,
+    LOCATIONS_COLLECTION,
+    IngestResult,
+    LocationStore,
+    RetentionTier,
+    build_location_store,
+)
+from app.services.metrics import MONGO_WRITE_SECONDS
+from app.services.point_filter import RecentPointFilter
 
 
 MONGO_DB_NAME = "citytag_dashboard"
 USERS_COLLECTION = "users"
+DEVICE_CATALOG_COLLECTION = "device_catalog"
+DEVICE_LATEST_COLLECTION = "device_latest"
+SYNC_STATE_COLLECTION = "sync_state"
+SYNC_LEASES_COLLECTION = "sync_leases"
+BACKFILL_JOBS_COLLECTION = "backfill_jobs"
+BACKFILL_CHUNKS_COLLECTION = "backfill_chunks"
+JOBS_COLLECTION = "jobs"
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Collects connection pool counters from pymongo's CMAP events.
+
+    Checkout wait is the time between a checkout being requested and a
+    connection being handed out; a growing wait means the pool is too small.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: Dict[str, float] = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "checked_out": 0,
+            "checkout_wait_total_ms": 0.0,
+            "checkout_wait_max_ms": 0.0,
+        }
+
+    def _incr(self, key: str, value: float = 1) -> None:
+        with self._lock:
+            self._stats[key] += value
+
+    def _record_wait(self, duration: Optional[float]) -> None:
+        if duration is None:
+            return
+        wait_ms = duration * 1000
+        with self._lock:
+            self._stats["checkout_wait_total_ms"] += wait_ms
+            if wait_ms > self._stats["checkout_wait_max_ms"]:
+                self._stats["checkout_wait_max_ms"] = wait_ms
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        checkouts = stats["checkouts"]
+        stats["checkout_wait_avg_ms"] = (
+            stats["checkout_wait_total_ms"] / checkouts if checkouts else 0.0
+        )
+        return stats
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        self._incr("connections_created")
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        self._incr("connections_closed")
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+    def connection_check_out_failed(self, event) -> None:
+        self._incr("checkout_failures")
+        self._record_wait(getattr(event, "duration", None))
+
+    def connection_checked_out(self, event) -> None:
+        self._incr("checkouts")
+        self._incr("checked_out")
+        self._record_wait(getattr(event, "duration", None))
+
+    def connection_checked_in(self, event) -> None:
+        self._incr("checked_out", -1)
 
 
 class MongoService:
-    def __init__(self, uri: str):
-        self._client = AsyncIOMotorClient(uri)
+    def __init__(
+        self,
+        uri: str,
+        bulk_chunk_size: int = 500,
+        location_storage: Optional[str] = None,
+        retention_tiers: Optional[List[RetentionTier]] = None,
+        user_cache_ttl: float = 60,
+        user_cache_size: int = 10_000,
+        point_filter: Optional[RecentPointFilter] = None,
+        **client_options: Any,
+    ):
+        self.bulk_chunk_size = bulk_chunk_size
+        # Verified users by id (the JWT subject); writes below invalidate, the
+        # TTL bounds staleness from writes made by other workers
+        self._user_cache: TTLCache[UserInDB] = TTLCache(user_cache_ttl, max_entries=user_cache_size)
+        # Sequence number of each user's last invalidation, so a read that was
+        # already in flight can't put the old document back afterwards
+        self._user_seq = 0
+        self._user_invalidated: TTLCache[int] = TTLCache(max(user_cache_ttl, 60), max_entries=user_cache_size)
+        self._pool_stats = PoolStatsListener()
+        self._pool_options = {
+            key: value for key, value in client_options.items() if value is not None
+        }
+        self._client = AsyncIOMotorClient(
+            uri,
+            event_listeners=[self._pool_stats],
+            **self._pool_options,
+        )
+        self._location_store = build_location_store(self.db, location_storage, retention_tiers)
+        self.point_filter = point_filter
 
     @property
     def client(self) -> AsyncIOMotorClient:
         return self._client
 
+    def close(self) -> None:
+        self._client.close()
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Return pool configuration plus live checkout/connection counters."""
+        return {"options": dict(self._pool_options), **self._pool_stats.snapshot()}
+
     @property
     def db(self) -> AsyncIOMotorDatabase:
         return self._client[MONGO_DB_NAME]
@@ -29,7 +166,47 @@ class MongoService:
 
     @property
     def locations(self):
-        return self.db["locations"]
+        return self.db[LOCATIONS_COLLECTION]
+
+    @property
+    def location_buckets(self):
+        return self.db[LOCATION_BUCKETS_COLLECTION]
+
+    @property
+    def location_store(self) -> LocationStore:
+        """
+        Backend holding location points (per-point documents or hourly
+        buckets), wrapped with the downsampled tiers when retention is on.
+        """
+        return self._location_store
+
+    @property
+    def device_catalog(self):
+        return self.db[DEVICE_CATALOG_COLLECTION]
+
+    @property
+    def device_latest(self):
+        return self.db[DEVICE_LATEST_COLLECTION]
+
+    @property
+    def sync_state(self):
+        return self.db[SYNC_STATE_COLLECTION]
+
+    @property
+    def sync_leases(self):
+        return self.db[SYNC_LEASES_COLLECTION]
+
+    @property
+    def backfill_jobs(self):
+        return self.db[BACKFILL_JOBS_COLLECTION]
+
+    @property
+    def backfill_chunks(self):
+        return self.db[BACKFILL_CHUNKS_COLLECTION]
+
+    @property
+    def jobs(self):
+        return self.db[JOBS_COLLECTION]
 
     async def get_user_by_email(self, email: str) -> Optional[UserInDB]:
         doc = await self.users.find_one({"email": email})
@@ -37,17 +214,32 @@ class MongoService:
             return None
         return UserInDB(**doc)
 
-    async def get_user_by_id(self, user_id: str) -> Optional[UserInDB]:
+    async def get_user_by_id(self, user_id: str, cached: bool = False) -> Optional[UserInDB]:
+        if cached:
+            user = self._user_cache.get(user_id)
+            if user is not None:
+                return user
+
         try:
             oid = ObjectId(user_id)
         except Exception:
             return None
 
+        read_seq = self._user_seq
         doc = await self.users.find_one({"_id": oid})
         if not doc:
             return None
 
-        return UserInDB(**doc)
+        user = UserInDB(**doc)
+        if self._user_invalidated.get(user_id, 0) <= read_seq:
+            self._user_cache.set(user_id, user)
+        return user
+
+    def invalidate_user(self, user_id: Any) -> None:
+        key = str(user_id)
+        self._user_seq += 1
+        self._user_invalidated.set(key, self._user_seq)
+        self._user_cache.pop(key)
 
     async def create_or_update_user(
         self,
@@ -63,31 +255,43 @@ class MongoService:
         }
         if citytag_token is not None:
             payload["citytag_token"] = citytag_token
+            payload["citytag_token_at"] = datetime.utcnow()
 
         if existing:
             await self.users.update_one(
                 {"_id": existing.id},
                 {"$set": payload},
             )
+            self.invalidate_user(existing.id)
             updated = await self.users.find_one({"_id": existing.id})
             return UserInDB(**updated)
 
         result = await self.users.insert_one(payload)
+        self.invalidate_user(result.inserted_id)
         created = await self.users.find_one({"_id": result.inserted_id})
         return UserInDB(**created)
 
     async def update_user_token(self, user_id: str, token: str) -> None:
         await self.users.update_one(
             {"_id": ObjectId(user_id)},
-            {"$set": {"citytag_token": token}},
+            {"$set": {"citytag_token": token, "citytag_token_at": datetime.utcnow()}},
         )
+        self.invalidate_user(user_id)
 
-    async def upsert_location_from_citytag(
-        self,
-        history_item: dict,
-        uid: str,
-        sn: Optional[str] = None,
-    ) -> bool:
+    async def get_device_catalog(self, uid: str) -> Optional[dict]:
+        return await self.device_catalog.find_one({"uid": uid}, {"_id": 0})
+
+    async def save_device_catalog(self, uid: str, devices: List[Dict[str, Any]]) -> datetime:
+        updated_at = datetime.utcnow()
+        await self.device_catalog.update_one(
+            {"uid": uid},
+            {"$set": {"uid": uid, "devices": devices, "updated_at": updated_at}},
+            upsert=True,
+        )
+        return updated_at
+
+    def normalize_citytag_item(self, history_item: dict, uid: str, sn: Optional[str] = None) -> Optional[dict]:
+        """Map a CityTag history item to a locations document, or None if unusable."""
         ts_raw = (
             history_item.get("gpstime")
             or history_item.get("time")
@@ -104,21 +308,229 @@ class MongoService:
         }
 
         if doc["lat"] == 0 or doc["lng"] == 0 or not doc["sn"]:
+            return None
+        return doc
+
+    async def upsert_location_from_citytag(
+        self,
+        history_item: dict,
+        uid: str,
+        sn: Optional[str] = None,
+    ) -> bool:
+        doc = self.normalize_citytag_item(history_item, uid, sn)
+        if doc is None:
             return False
 
-        query = {
-            "uid": doc["uid"],
-            "sn": doc["sn"],
-            "timestamp": doc["timestamp"],
+        result, fresh = await self._write_points([doc])
+        if fresh:
+            await self.update_device_latest(doc, history_item)
+
+        return result.changed > 0
+
+    async def ingest_locations_from_citytag(
+        self,
+        history: Iterable[dict],
+        uid: str,
+        sn: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+    ) -> IngestResult:
+        """
+        Batch version of upsert_location_from_citytag.
+
+        Normalizes the whole list, keeps the last item per (sn, timestamp),
+        and hands it to the location store in one batch (bulk upserts in
+        chunks, or one merge per hourly bucket). device_latest is updated
+        once, with the newest point of the batch.
+        """
+        result = IngestResult()
+        docs: Dict[tuple, dict] = {}
+        raws: Dict[tuple, dict] = {}
+        for item in history:
+            doc = self.normalize_citytag_item(item, uid, sn)
+            if doc is None:
+                result.skipped += 1
+                continue
+            key = (doc["sn"], doc["timestamp"])
+            if key in docs:
+                result.duplicates_in_batch += 1
+            docs[key] = doc
+            raws[key] = item
+
+        if not docs:
+            return result
+
+        written, fresh = await self._write_points(list(docs.values()), chunk_size or self.bulk_chunk_size)
+        result += written
+
+        # Known points are already reflected in device_latest; only newly written ones can move it
+        if fresh:
+            newest = max(fresh, key=lambda doc: doc["timestamp"])
+            newest_key = (newest["sn"], newest["timestamp"])
+            await self.update_device_latest(newest, raws[newest_key])
+        result.newest = max(key[1] for key in docs)
+        return result
+
+    async def _write_points(self, docs: List[dict], chunk_size: Optional[int] = None) -> Tuple[IngestResult, List[dict]]:
+        """
+        Write through the location store, skipping points the recent-point
+        filter knows are stored. Returns the result and the docs actually sent.
+        """
+        if self.point_filter is None:
+            return await self.location_store.write(docs, chunk_size or self.bulk_chunk_size), docs
+
+        for uid, sn in {(doc["uid"], doc["sn"]) for doc in docs}:
+            if not self.point_filter.is_seeded(uid, sn):
+                await self._seed_point_filter(uid, sn)
+        fresh = self.point_filter.unknown(docs)
+        result = IngestResult()
+        if fresh:
+            result = await self.location_store.write(fresh, chunk_size or self.bulk_chunk_size)
+            self.point_filter.remember(fresh)
+        result.known = len(docs) - len(fresh)
+        return result, fresh
+
+    async def _seed_point_filter(self, uid: str, sn: str) -> None:
+        state = await self.sync_state.find_one({"uid": uid, "sn": sn}, {"_id": 0, "watermark": 1})
+        window = self.point_filter.seed_range((state or {}).get("watermark"))
+        points = await self.location_store.read(uid, sn, *window) if window else []
+        self.point_filter.seed(uid, sn, points)
+
+    async def update_device_latest(self, doc: dict, raw: Optional[dict] = None) -> None:
+        """
+        Keep the one-doc-per-(uid, sn) "last known position" in step with ingest.
+
+        A single pipeline update compares timestamps server-side, so concurrent
+        writers can only move the stored point forward in time.
+        """
+        ts = doc["timestamp"]
+        is_newer = {"$gt": [{"$literal": ts}, {"$ifNull": ["$timestamp", _EPOCH]}]}
+        fields = {
+            "timestamp": ts,
+            "lat": doc["lat"],
+            "lng": doc["lng"],
+            "raw": raw or {},
         }
+        stage = {
+            "uid": {"$literal": doc["uid"]},
+            "sn": {"$literal": doc["sn"]},
+            "checked_at": {"$literal": datetime.utcnow()},
+        }
+        for key, value in fields.items():
+            stage[key] = {"$cond": [is_newer, {"$literal": value}, f"${key}"]}
+
+        with MONGO_WRITE_SECONDS.time(operation="device_latest"):
+            await self.device_latest.update_one(
+                {"uid": doc["uid"], "sn": doc["sn"]},
+                [{"$set": stage}],
+                upsert=True,
+            )
 
-        result = await self.locations.update_one(
-            query,
-            {"$set": doc},
+    async def get_device_latest(self, uid: str, sn: str) -> Optional[dict]:
+        return await self.device_latest.find_one({"uid": uid, "sn": sn}, {"_id": 0})
+
+    async def touch_device_latest(self, uid: str, sn: str) -> None:
+        """Record that upstream was checked for this device, even if nothing new arrived."""
+        await self.device_latest.update_one(
+            {"uid": uid, "sn": sn},
+            {"$set": {"checked_at": datetime.utcnow()}},
+        )
+
+    async def get_sync_states(self, uid: str) -> Dict[str, dict]:
+        """Per-device sync state for a user, keyed by sn."""
+        states = {}
+        async for doc in self.sync_state.find({"uid": uid}, {"_id": 0}):
+            states[doc["sn"]] = doc
+        return states
+
+    async def advance_sync_state(
+        self,
+        uid: str,
+        sn: str,
+        synced_until: datetime,
+        watermark: Optional[datetime] = None,
+    ) -> None:
+        """Move the device's sync marks forward; $max keeps them monotonic."""
+        marks = {"synced_until": synced_until}
+        if watermark is not None:
+            marks["watermark"] = watermark
+        with MONGO_WRITE_SECONDS.time(operation="sync_state"):
+            await self.sync_state.update_one(
+                {"uid": uid, "sn": sn},
+                {"$max": marks, "$setOnInsert": {"uid": uid, "sn": sn}},
+                upsert=True,
+            )
+
+    async def set_poll_schedule(self, uid: str, sn: str, interval_seconds: float, next_poll_at: datetime) -> None:
+        await self.sync_state.update_one(
+            {"uid": uid, "sn": sn},
+            {"$set": {"poll_interval": interval_seconds, "next_poll_at": next_poll_at}},
             upsert=True,
         )
 
-        return bool(result.upserted_id or result.modified_count > 0)
+    async def save_job(self, job: Dict[str, Any]) -> bool:
+        """
+        Upsert job state. Returns False, leaving the doc alone, if another
+        worker marked the job lost or now holds its key.
+        """
+        try:
+            await self.jobs.update_one({"_id": job["_id"], "lost": {"$ne": True}}, {"$set": job}, upsert=True)
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        return await self.jobs.find_one({"_id": job_id})
+
+    async def claim_job(self, job: Dict[str, Any], fresh_after: datetime, attempts: int = 3) -> Optional[dict]:
+        """
+        Insert `job` (an active job doc) unless another active job holds its
+        key, atomically via the unique partial index on active keys. Returns
+        None once inserted, or the holder's doc. A holder whose worker hasn't
+        reported since `fresh_after` is marked lost and the claim retried.
+        """
+        for _ in range(attempts):
+            try:
+                await self.jobs.insert_one(job)
+                return None
+            except DuplicateKeyError:
+                holder = await self.jobs.find_one({"key": job["key"], "active": True})
+                if holder is None:
+                    continue  # finished in between
+                if holder.get("updated_at") and holder["updated_at"] >= fresh_after:
+                    return holder
+                await self.jobs.update_one(
+                    {"_id": holder["_id"], "updated_at": holder.get("updated_at")},
+                    {"$set": {
+                        "status": "failed",
+                        "active": False,
+                        "lost": True,
+                        "error": "Worker lost",
+                        "finished_at": datetime.utcnow(),
+                    }},
+                )
+        raise RuntimeError(f"Could not claim job key {job['key']!r}")
+
+    async def save_backfill_job(self, job: Dict[str, Any]) -> None:
+        await self.backfill_jobs.update_one({"_id": job["_id"]}, {"$set": job}, upsert=True)
+
+    async def get_backfill_job(self, job_id: str) -> Optional[dict]:
+        return await self.backfill_jobs.find_one({"_id": job_id})
+
+    async def get_done_backfill_chunks(self, uid: str, sn: str, start: datetime, end: datetime) -> Dict[tuple, dict]:
+        """Completed chunks inside [start, end], keyed by (start, end)."""
+        done = {}
+        query = {"uid": uid, "sn": sn, "start": {"$gte": start}, "end": {"$lte": end}}
+        async for doc in self.backfill_chunks.find(query):
+            done[(doc["start"], doc["end"])] = doc
+        return done
+
+    async def mark_backfill_chunk_done(self, uid: str, sn: str, start: datetime, end: datetime, fetched: int, inserted: int) -> None:
+        # Keyed by range, not job, so overlapping or repeated jobs reuse finished chunks
+        await self.backfill_chunks.update_one(
+            {"uid": uid, "sn": sn, "start": start, "end": end},
+            {"$set": {"fetched": fetched, "inserted": inserted, "completed_at": datetime.utcnow()}},
+            upsert=True,
+        )
 
     def _parse_citytag_timestamp(self, value) -> datetime:
         if isinstance(value, (int, float)):
@@ -132,4 +544,26 @@ class MongoService:
             except Exception:
                 pass
 
-        return datetime.utcnow()  # fallback
\ No newline at end of file
+        return datetime.utcnow()  # fallback
+
+# ────────────────────────────────────────────────
+#          Process-wide shared MongoService
+# ────────────────────────────────────────────────
+
+_shared_service: Optional[MongoService] = None
+
+
+def get_shared_mongo_service() -> Optional[MongoService]:
+    return _shared_service
+
+
+def set_shared_mongo_service(service: Optional[MongoService]) -> None:
+    global _shared_service
+    _shared_service = service
+
+
+def close_shared_mongo_service() -> None:
+    global _shared_service
+    if _shared_service is not None:
+        _shared_service.close()
+        _shared_service = None
@@ -0,0 +1,115 @@
+# app/services/point_filter.py
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.services.cache import TTLCache
+from app.services.location_store import naive_utc
+from app.services.metrics import POINT_FILTER, POINT_FILTER_SEEDS
+
+
+def _key(ts: datetime) -> datetime:
+    """Timestamps as Mongo stores them: naive UTC, millisecond precision."""
+    ts = naive_utc(ts)
+    return ts.replace(microsecond=ts.microsecond // 1000 * 1000)
+
+
+class _DeviceKeys:
+    __slots__ = ("points", "newest", "prune_at")
+
+    def __init__(self) -> None:
+        self.points: Dict[datetime, Tuple[float, float]] = {}
+        self.newest: Optional[datetime] = None
+        self.prune_at = 256
+
+
+class RecentPointFilter:
+    """
+    Per-device memory of recently stored points, so overlapping sync windows
+    don't re-send points Mongo already holds.
+
+    Each device keeps {timestamp: (lat, lng)} for the last `window_seconds`
+    before its newest known point. A point is only dropped when the exact
+    timestamp *and* position are known, so late-arriving or corrected fixes
+    still reach the store. Devices are seeded from the store (the window
+    below the device's watermark) and reseeded every `seed_ttl_seconds`,
+    which picks up points other workers wrote in the meantime.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = 1800,
+        max_devices: int = 5000,
+        max_keys: int = 4096,
+        seed_ttl_seconds: float = 3600,
+    ):
+        self.window = timedelta(seconds=window_seconds)
+        self.max_keys = max_keys
+        self._devices: TTLCache[_DeviceKeys] = TTLCache(seed_ttl_seconds, max_entries=max_devices)
+
+    def is_seeded(self, uid: str, sn: str) -> bool:
+        return self._devices.get((uid, sn)) is not None
+
+    def seed(self, uid: str, sn: str, points: Iterable[Tuple[datetime, float, float]]) -> None:
+        keys = _DeviceKeys()
+        self._devices.set((uid, sn), keys)
+        self._add(keys, points)
+        POINT_FILTER_SEEDS.inc()
+
+    def seed_range(self, watermark: Optional[datetime]) -> Optional[Tuple[datetime, datetime]]:
+        """Time range to load when seeding a device whose newest stored point is `watermark`."""
+        if watermark is None:
+            return None
+        return watermark - self.window, watermark
+
+    def unknown(self, docs: Iterable[dict]) -> List[dict]:
+        """Docs that are not known to be stored already; counts hits and misses."""
+        fresh = []
+        hits = 0
+        for doc in docs:
+            keys = self._devices.get((doc["uid"], doc["sn"]))
+            if keys is not None and keys.points.get(_key(doc["timestamp"])) == (doc["lat"], doc["lng"]):
+                hits += 1
+            else:
+                fresh.append(doc)
+        POINT_FILTER.inc(hits, result="hit")
+        POINT_FILTER.inc(len(fresh), result="miss")
+        return fresh
+
+    def remember(self, docs: Iterable[dict]) -> None:
+        """Record docs that were just written."""
+        by_device: Dict[tuple, List[tuple]] = {}
+        for doc in docs:
+            by_device.setdefault((doc["uid"], doc["sn"]), []).append((doc["timestamp"], doc["lat"], doc["lng"]))
+        for key, points in by_device.items():
+            keys = self._devices.get(key)
+            if keys is None:
+                # Evicted since the check; the next batch reseeds from the store
+                continue
+            self._add(keys, points)
+
+    def forget(self, uid: str, sn: str) -> None:
+        """Drop a device whose stored points were deleted; its next batch reseeds from the store."""
+        self._devices.pop((uid, sn))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "devices": len(self._devices),
+            "hits": int(POINT_FILTER.value(result="hit")),
+            "misses": int(POINT_FILTER.value(result="miss")),
+        }
+
+    def _add(self, keys: _DeviceKeys, points: Iterable[Tuple[datetime, float, float]]) -> None:
+        for ts, lat, lng in points:
+            ts = _key(ts)
+            keys.points[ts] = (lat, lng)
+            if keys.newest is None or ts > keys.newest:
+                keys.newest = ts
+        if len(keys.points) > keys.prune_at:
+            self._prune(keys)
+
+    def _prune(self, keys: _DeviceKeys) -> None:
+        horizon = keys.newest - self.window
+        kept = sorted((ts for ts in keys.points if ts >= horizon), reverse=True)[:self.max_keys]
+        keys.points = {ts: keys.points[ts] for ts in kept}
+        # Amortize: the next prune happens once the map has doubled again
+        keys.prune_at = max(256, 2 * len(keys.points))
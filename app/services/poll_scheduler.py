@@ -0,0 +1,123 @@
+# app/services/poll_scheduler.py
+import heapq
+import math
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+EARTH_RADIUS_M = 6_371_000
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def movement_extent_m(points: Iterable[dict], origin: Optional[Tuple[float, float]] = None) -> float:
+    """
+    Diagonal of the bounding box of the given CityTag points, in metres.
+    `origin` is the device's previously stored (lat, lng); including it means
+    a device that reports one fix per poll still registers its movement.
+    """
+    lats, lngs = [], []
+    if origin is not None:
+        lats.append(float(origin[0]))
+        lngs.append(float(origin[1]))
+    for item in points:
+        lat = item.get("lat") or item.get("latitude")
+        lng = item.get("lng") or item.get("lon") or item.get("longitude")
+        if lat and lng:
+            lats.append(float(lat))
+            lngs.append(float(lng))
+    if len(lats) < 2:
+        return 0.0
+    return haversine_m(min(lats), min(lngs), max(lats), max(lngs))
+
+
+@dataclass(order=True)
+class _Entry:
+    due: datetime
+    uid: str = field(compare=False)
+    sn: str = field(compare=False)
+    generation: int = field(compare=False)
+
+
+@dataclass
+class PollPolicy:
+    min_interval: float = 60
+    max_interval: float = 3600
+    backoff: float = 2.0
+    move_threshold_m: float = 50
+
+
+class AdaptivePollScheduler:
+    """
+    Priority queue of devices keyed by next poll time.
+
+    A device that moved is polled again after `min_interval`; a stationary,
+    empty or failing one has its interval multiplied by `backoff`, up to
+    `max_interval`. Rescheduling a device supersedes any earlier entry.
+    """
+
+    def __init__(self, policy: PollPolicy):
+        self.policy = policy
+        self._heap: List[_Entry] = []
+        self._intervals: Dict[Tuple[str, str], float] = {}
+        self._generation: Dict[Tuple[str, str], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._generation)
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self._generation
+
+    def interval(self, uid: str, sn: str) -> float:
+        return self._intervals.get((uid, sn), self.policy.min_interval)
+
+    def _clamp(self, interval: float) -> float:
+        return min(self.policy.max_interval, max(self.policy.min_interval, interval))
+
+    def schedule(self, uid: str, sn: str, due: datetime, interval: Optional[float] = None) -> None:
+        key = (uid, sn)
+        if interval is not None:
+            self._intervals[key] = self._clamp(interval)
+        generation = self._generation.get(key, 0) + 1
+        self._generation[key] = generation
+        heapq.heappush(self._heap, _Entry(due, uid, sn, generation))
+
+    def remove(self, uid: str, sn: str) -> None:
+        # Lazy deletion: stale heap entries are skipped when popped
+        self._generation.pop((uid, sn), None)
+        self._intervals.pop((uid, sn), None)
+
+    def next_due(self) -> Optional[datetime]:
+        self._drop_stale()
+        return self._heap[0].due if self._heap else None
+
+    def pop_due(self, now: datetime) -> Optional[Tuple[str, str]]:
+        self._drop_stale()
+        if not self._heap or self._heap[0].due > now:
+            return None
+        entry = heapq.heappop(self._heap)
+        # Popped devices stay known but have no pending entry until rescheduled
+        self._generation[(entry.uid, entry.sn)] = entry.generation + 1
+        return entry.uid, entry.sn
+
+    def record(self, uid: str, sn: str, moved: bool, ok: bool, now: datetime) -> float:
+        """Reschedule after a poll; returns the new interval in seconds."""
+        if ok and moved:
+            interval = self.policy.min_interval
+        else:
+            interval = self._clamp(self.interval(uid, sn) * self.policy.backoff)
+        self.schedule(uid, sn, now + timedelta(seconds=interval), interval=interval)
+        return interval
+
+    def _drop_stale(self) -> None:
+        while self._heap:
+            top = self._heap[0]
+            if self._generation.get((top.uid, top.sn)) == top.generation:
+                return
+            heapq.heappop(self._heap)
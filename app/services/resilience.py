@@ -0,0 +1,176 @@
+# app/services/resilience.py
+import asyncio
+import random
+import time
+from typing import Any, Dict, Optional
+
+from app.services.cache import TTLCache
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open."""
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst` stored."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """Take one token, sleeping until one is available. Returns seconds waited."""
+        waited = 0.0
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                delay = (1 - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self._refill()
+            self._tokens -= 1
+        return waited
+
+
+class RateLimiter:
+    """
+    Global token bucket plus one bucket per key (CityTag uid).
+    A rate of 0 disables the corresponding bucket.
+    """
+
+    def __init__(
+        self,
+        global_rate: float,
+        global_burst: float,
+        per_key_rate: float,
+        per_key_burst: float,
+        max_keys: int = 4096,
+    ):
+        self._global = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self.per_key_rate = per_key_rate
+        self.per_key_burst = per_key_burst
+        self._per_key: TTLCache[TokenBucket] = TTLCache(ttl_seconds=3600, max_entries=max_keys)
+        self.acquired = 0
+        self.waited = 0
+        self.wait_total_seconds = 0.0
+        self.wait_max_seconds = 0.0
+
+    def _bucket_for(self, key: str) -> TokenBucket:
+        bucket = self._per_key.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.per_key_rate, self.per_key_burst)
+        # Re-set on every use so only idle keys expire; a busy key would otherwise get a fresh burst hourly
+        self._per_key.set(key, bucket)
+        return bucket
+
+    async def acquire(self, key: Optional[str] = None) -> float:
+        wait = 0.0
+        if key is not None and self.per_key_rate > 0:
+            wait += await self._bucket_for(key).acquire()
+        if self._global is not None:
+            wait += await self._global.acquire()
+
+        self.acquired += 1
+        if wait > 0:
+            self.waited += 1
+            self.wait_total_seconds += wait
+            self.wait_max_seconds = max(self.wait_max_seconds, wait)
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "wait_total_seconds": round(self.wait_total_seconds, 3),
+            "wait_max_seconds": round(self.wait_max_seconds, 3),
+            "tracked_keys": len(self._per_key),
+        }
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed → open after `failure_threshold` failures in a row; open rejects
+    calls for `reset_timeout` seconds, then half_open lets a single trial call
+    through, whose outcome closes or re-opens the circuit. A trial that never
+    reports back (cancelled, or released without a verdict) frees its slot via
+    `release_trial`, and one outstanding for over `reset_timeout` is treated
+    as abandoned so the circuit can't wedge in half_open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+        self.opened_count = 0
+        self.rejected = 0
+
+    def retry_after(self) -> float:
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def before_call(self) -> None:
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError("CityTag circuit is open")
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+
+        if self.state == self.HALF_OPEN:
+            now = time.monotonic()
+            if self._trial_in_flight and now - self._trial_started < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError("CityTag circuit is half-open; trial call in flight")
+            self._trial_in_flight = True
+            self._trial_started = now
+
+    def release_trial(self) -> None:
+        """Free the half-open trial slot without counting a success or failure."""
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._trial_in_flight = False
+        self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened_count += 1
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "opened_count": self.opened_count,
+            "rejected": self.rejected,
+            "retry_after_seconds": round(self.retry_after(), 1),
+        }
+
+
+def backoff_delay(attempt: int, base: float, cap: float = 10.0) -> float:
+    """Full-jitter exponential backoff for the given zero-based attempt."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
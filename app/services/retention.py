@@ -0,0 +1,212 @@
+# app/services/retention.py
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.services.leases import LeaseManager
+from app.services.location_store import (
+    TIER_BUCKET_SECONDS,
+    LocationStore,
+    Point,
+    RetentionTier,
+    TieredLocationStore,
+    bucket_start,
+)
+from app.services.metrics import RETENTION_POINTS, RETENTION_RUN_SECONDS
+from app.services.mongodb import MongoService
+from app.services.sync_checkpoint import TimeBudget
+
+
+RETENTION_LEASE = "retention-compactor"
+
+# Compaction works a day at a time, so deletes line up with hourly and daily buckets
+COMPACT_CHUNK = timedelta(seconds=TIER_BUCKET_SECONDS)
+
+
+def _slot(ts: datetime, resolution: timedelta) -> int:
+    return int((ts - datetime(1970, 1, 1)).total_seconds() // resolution.total_seconds())
+
+
+def downsample(points: Iterable[Point], resolution: timedelta, occupied: Optional[Set[int]] = None) -> List[Point]:
+    """
+    Keep the first fix of each `resolution` slot. A real fix (rather than an
+    average) stays on the road the device actually travelled. Slots in
+    `occupied` already have a point in the target tier and are skipped.
+    """
+    seen = set(occupied or ())
+    kept = []
+    for point in points:
+        slot = _slot(point[0], resolution)
+        if slot not in seen:
+            seen.add(slot)
+            kept.append(point)
+    return kept
+
+
+@dataclass
+class CompactionStats:
+    devices: int = 0
+    chunks: int = 0
+    kept: Dict[str, int] = field(default_factory=dict)
+    removed: Dict[str, int] = field(default_factory=dict)
+    complete: bool = True
+
+
+class RetentionCompactor:
+    """
+    Roll points past each tier's age threshold into that tier, one day per
+    step: read the day from the next-finer store, write one point per slot
+    to the tier, then delete the day from the source.
+
+    Progress needs no cursor: whatever is still in a source store below the
+    cutoff is, by definition, left to do. A crash between the write and the
+    delete just repeats the day (tier writes are upserts, and occupied slots
+    are skipped), and late backfilled points are picked up on the next run.
+    """
+
+    def __init__(self, mongo: MongoService, store: TieredLocationStore):
+        self.mongo = mongo
+        self.store = store
+
+    def _stages(self) -> List[Tuple[RetentionTier, LocationStore, LocationStore]]:
+        stages = []
+        source = self.store.raw
+        for tier, target in self.store.tiers:
+            stages.append((tier, source, target))
+            source = target
+        return stages
+
+    async def compact_device(
+        self,
+        uid: str,
+        sn: str,
+        stats: CompactionStats,
+        now: Optional[datetime] = None,
+        budget: Optional[TimeBudget] = None,
+    ) -> bool:
+        """Compact one device; returns False if the budget ran out first."""
+        now = now or datetime.utcnow()
+        for tier, source, target in self._stages():
+            cutoff = bucket_start(now - tier.after, TIER_BUCKET_SECONDS)
+            previous: Optional[datetime] = None
+            while True:
+                first = await source.first_timestamp(uid, sn)
+                if first is None or first >= cutoff:
+                    break
+                day = bucket_start(first, TIER_BUCKET_SECONDS)
+                if previous is not None and day <= previous:
+                    # The source still has points in a day we just cleared; leave it for next run
+                    print(f"⚠ Retention: {uid}/{sn} {tier.name} did not advance past {day:%Y-%m-%d}")
+                    break
+                if budget is not None and budget.exhausted():
+                    return False
+                await self._compact_day(uid, sn, tier, source, target, day, stats)
+                previous = day
+        return True
+
+    async def _compact_day(
+        self,
+        uid: str,
+        sn: str,
+        tier: RetentionTier,
+        source: LocationStore,
+        target: LocationStore,
+        day: datetime,
+        stats: CompactionStats,
+    ) -> None:
+        end = day + COMPACT_CHUNK
+        last = end - timedelta(milliseconds=1)
+        points = await source.read(uid, sn, day, last)
+        existing = await target.read(uid, sn, day, last)
+        kept = downsample(points, tier.resolution, {_slot(p[0], tier.resolution) for p in existing})
+        if kept:
+            await target.write([
+                {"uid": uid, "sn": sn, "timestamp": ts, "lat": lat, "lng": lng}
+                for ts, lat, lng in kept
+            ])
+        removed = await source.delete(uid, sn, day, end)
+        if removed and source is self.store.raw and self.mongo.point_filter is not None:
+            # The filter vouches for raw points being stored; reseed rather than trust it
+            self.mongo.point_filter.forget(uid, sn)
+
+        stats.chunks += 1
+        stats.kept[tier.name] = stats.kept.get(tier.name, 0) + len(kept)
+        stats.removed[tier.name] = stats.removed.get(tier.name, 0) + removed
+        RETENTION_POINTS.inc(len(kept), tier=tier.name, result="kept")
+        RETENTION_POINTS.inc(removed, tier=tier.name, result="removed")
+
+    async def run(self, budget: Optional[TimeBudget] = None) -> CompactionStats:
+        """
+        One pass over every device with stored points. Devices are listed
+        from the stores themselves, so history that predates device_latest
+        or belongs to devices no longer synced is compacted too.
+        """
+        stats = CompactionStats()
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        for uid, sn in await self.store.devices():
+            stats.devices += 1
+            if not await self.compact_device(uid, sn, stats, now=now, budget=budget):
+                stats.complete = False
+                break
+        RETENTION_RUN_SECONDS.observe(time.perf_counter() - started)
+        return stats
+
+
+async def run_retention_pass(
+    mongo: MongoService,
+    leases: LeaseManager,
+    interval_seconds: float,
+    budget: Optional[TimeBudget] = None,
+) -> Optional[CompactionStats]:
+    """Run a compaction pass if it is due and no other process holds the lease."""
+    store = mongo.location_store
+    if not isinstance(store, TieredLocationStore):
+        return None
+    lease = await leases.try_acquire(RETENTION_LEASE)
+    if lease is None:
+        return None
+    try:
+        last_run = lease.get("last_run_at")
+        if last_run and (datetime.utcnow() - last_run).total_seconds() < interval_seconds * 0.9:
+            return None
+        stats = await RetentionCompactor(mongo, store).run(budget)
+        print(
+            f"🗜 Retention: {stats.devices} devices, {stats.chunks} day(s) compacted, "
+            f"kept {stats.kept or 0}, removed {stats.removed or 0}"
+            + ("" if stats.complete else " — budget reached, continuing next run")
+        )
+        if stats.complete:
+            await leases.mark_run(RETENTION_LEASE)
+        return stats
+    finally:
+        await leases.release(RETENTION_LEASE)
+
+
+async def retention_loop(mongo: MongoService, interval_seconds: float, budget_seconds: float) -> None:
+    leases = LeaseManager(mongo.sync_leases)
+    heartbeat = asyncio.create_task(leases.heartbeat())
+    # Re-check often enough that an incomplete pass continues well before the next interval
+    wait = min(interval_seconds, max(budget_seconds * 2, 60.0))
+    try:
+        while True:
+            try:
+                budget = TimeBudget(budget_seconds) if budget_seconds > 0 else None
+                await run_retention_pass(mongo, leases, interval_seconds, budget)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"❌ Retention pass failed: {exc!r}")
+            await asyncio.sleep(wait)
+    finally:
+        heartbeat.cancel()
+
+
+def start_retention_task(mongo: MongoService, interval_seconds: float, budget_seconds: float) -> Optional[asyncio.Task]:
+    if not isinstance(mongo.location_store, TieredLocationStore):
+        return None
+    tiers = ", ".join(f">{t.after.days}d @ {t.name}" for t, _ in mongo.location_store.tiers)
+    print(f"🗜 Starting retention compactor ({tiers})")
+    return asyncio.create_task(retention_loop(mongo, interval_seconds, budget_seconds))
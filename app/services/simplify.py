@@ -0,0 +1,109 @@
+# app/services/simplify.py
+import math
+from typing import List, Sequence
+
+import numpy as np
+
+
+# Web Mercator ground resolution at zoom 0 on the equator (256px tiles)
+METERS_PER_PIXEL_Z0 = 156543.03392
+EARTH_RADIUS_M = 6371008.8
+DEFAULT_PIXEL_TOLERANCE = 1.0
+MIN_ZOOM, MAX_ZOOM = 0, 22
+
+
+def zoom_tolerance_m(zoom: float, lat: float, pixels: float = DEFAULT_PIXEL_TOLERANCE) -> float:
+    """Ground distance covered by `pixels` screen pixels at `zoom` and latitude `lat`."""
+    return pixels * METERS_PER_PIXEL_Z0 * math.cos(math.radians(lat)) / (2 ** zoom)
+
+
+def _project(coords: np.ndarray) -> np.ndarray:
+    """[lng, lat] degrees → local x/y meters (equirectangular around the mean latitude)."""
+    lat0 = math.radians(float(coords[:, 1].mean()))
+    xy = np.radians(coords) * EARTH_RADIUS_M
+    xy[:, 0] *= math.cos(lat0)
+    return xy
+
+
+def radial_mask(xy: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Keep a point only once it is more than `tolerance` from the last kept
+    one. A cheap O(n) first pass that collapses the jitter of a parked device
+    before the (costlier) Douglas-Peucker pass.
+    """
+    n = len(xy)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    tol_sq = tolerance * tolerance
+    xs, ys = xy[:, 0].tolist(), xy[:, 1].tolist()
+    last_x, last_y = xs[0], ys[0]
+    keep[0] = keep[-1] = True
+    for i in range(1, n - 1):
+        dx, dy = xs[i] - last_x, ys[i] - last_y
+        if dx * dx + dy * dy > tol_sq:
+            keep[i] = True
+            last_x, last_y = xs[i], ys[i]
+    return keep
+
+
+def douglas_peucker_mask(xy: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Boolean mask of points kept by Douglas-Peucker with distance `tolerance`
+    (same units as `xy`).
+
+    Breadth-first: every open segment of a recursion level is handled in one
+    vectorized pass, so the Python-level loop runs once per level rather than
+    once per split. Distances are to the segment, not the infinite line, so
+    tracks that double back on themselves keep their turnaround points.
+    """
+    n = len(xy)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    starts = np.array([0])
+    ends = np.array([n - 1])
+    while starts.size:
+        counts = ends - starts - 1
+        has_inner = counts > 0
+        starts, ends, counts = starts[has_inner], ends[has_inner], counts[has_inner]
+        if not starts.size:
+            break
+
+        # Every inner point of every open segment, tagged with its segment
+        offsets = np.cumsum(counts) - counts
+        seg = np.repeat(np.arange(starts.size), counts)
+        idx = starts[seg] + 1 + (np.arange(counts.sum()) - offsets[seg])
+
+        a, b = xy[starts][seg], xy[ends][seg]
+        ab = b - a
+        ap = xy[idx] - a
+        length_sq = np.einsum("ij,ij->i", ab, ab)
+        t = np.divide(np.einsum("ij,ij->i", ap, ab), length_sq, out=np.zeros_like(length_sq), where=length_sq > 0)
+        np.clip(t, 0.0, 1.0, out=t)
+        dist = np.hypot(*(ap - t[:, None] * ab).T)
+
+        # Farthest point per segment: max via reduceat, then its first position
+        seg_max = np.maximum.reduceat(dist, offsets)
+        split = seg_max > tolerance
+        if not split.any():
+            break
+        at_max = (dist == seg_max[seg]) & split[seg]
+        first = np.unique(seg[at_max], return_index=True)[1]
+        cut = idx[np.flatnonzero(at_max)[first]]
+        keep[cut] = True
+
+        starts, ends = np.concatenate([starts[split], cut]), np.concatenate([cut, ends[split]])
+    return keep
+
+
+def simplify_coordinates(coords: Sequence[Sequence[float]], tolerance_m: float) -> List[List[float]]:
+    """Simplify a GeoJSON [lng, lat] line to within `tolerance_m` meters."""
+    if len(coords) < 3 or tolerance_m <= 0:
+        return [list(c) for c in coords]
+    points = np.asarray(coords, dtype=float)
+    xy = _project(points)
+    radial = radial_mask(xy, tolerance_m)
+    points, xy = points[radial], xy[radial]
+    return points[douglas_peucker_mask(xy, tolerance_m)].tolist()
@@ -0,0 +1,46 @@
+# app/services/singleflight.py
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical async calls into one in-flight call.
+
+    The first caller for a key starts the call as its own task; callers that
+    arrive while it is running await the same task and share its result (or
+    exception). Cancelling one caller does not cancel the shared call.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.issued = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.issued += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Retrieve the exception so a failed call nobody awaited isn't logged
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "issued": self.issued,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
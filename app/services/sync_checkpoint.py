@@ -0,0 +1,89 @@
+# app/services/sync_checkpoint.py
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, Optional, Set
+
+from app.services.leases import LeaseManager, shard_lease_name
+
+
+class TimeBudget:
+    """
+    Wall-clock allowance for one invocation. `exhausted()` turns true once
+    less than `reserve` seconds remain, leaving time for in-flight work to
+    finish and for checkpoints to be written before the platform kills us.
+    """
+
+    def __init__(self, seconds: float, reserve: float = 0.0):
+        self.seconds = seconds
+        self.reserve = reserve
+        self.started = time.monotonic()
+
+    def remaining(self) -> float:
+        return self.seconds - (time.monotonic() - self.started)
+
+    def exhausted(self) -> bool:
+        return self.remaining() <= self.reserve
+
+    def in_flight_timeout(self) -> float:
+        """How long work already started may still run; half the reserve is kept for checkpoints."""
+        return max(0.0, self.remaining() - self.reserve / 2)
+
+
+class SyncCheckpoint:
+    """
+    Resume point for a pass over users, one cursor per shard.
+
+    Users are visited in `_id` order. A shard's cursor is the last user of the
+    longest completed prefix, so users finishing out of order never move it
+    past one that is still running or was cut off by the budget. Devices need
+    no cursor of their own: each has its watermark in sync_state, so redoing
+    a partially synced user only refetches what is newer.
+
+    Cursors live on the shard lease documents (written only by the owner)
+    and are cleared by `LeaseManager.mark_run` when a pass completes.
+    """
+
+    def __init__(self, leases: LeaseManager, owned: Dict[int, dict], now: Optional[datetime] = None):
+        now = now or datetime.utcnow()
+        self.leases = leases
+        self.after: Dict[int, Any] = {}
+        self.pass_started_at: Dict[int, datetime] = {}
+        for shard, doc in owned.items():
+            cursor = doc.get("cursor") or {}
+            self.after[shard] = cursor.get("after")
+            self.pass_started_at[shard] = cursor.get("pass_started_at") or now
+        self._pending: Dict[int, Deque[Any]] = {shard: deque() for shard in owned}
+        self._done: Dict[int, Set[Any]] = {shard: set() for shard in owned}
+
+    @property
+    def resumed_shards(self) -> Set[int]:
+        return {shard for shard, after in self.after.items() if after is not None}
+
+    def user_query(self, shards: Iterable[int]) -> dict:
+        """Skip users every shard has already passed."""
+        afters = [self.after.get(shard) for shard in shards]
+        if afters and all(a is not None for a in afters):
+            return {"_id": {"$gt": min(afters)}}
+        return {}
+
+    def should_skip(self, shard: int, user_id: Any) -> bool:
+        after = self.after.get(shard)
+        return after is not None and user_id <= after
+
+    def dispatched(self, shard: int, user_id: Any) -> None:
+        self._pending[shard].append(user_id)
+
+    async def completed(self, shard: int, user_id: Any) -> None:
+        done, pending = self._done[shard], self._pending[shard]
+        done.add(user_id)
+        advanced = False
+        while pending and pending[0] in done:
+            self.after[shard] = pending.popleft()
+            done.discard(self.after[shard])
+            advanced = True
+        if advanced:
+            await self.leases.save_cursor(
+                shard_lease_name(shard),
+                {"after": self.after[shard], "pass_started_at": self.pass_started_at[shard]},
+            )
@@ -0,0 +1,51 @@
+# app/services/sync_state.py
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class SyncWindowPolicy:
+    """
+    How far back to fetch for a device, given its stored sync state.
+
+    The high-water mark is the later of the last ingested point and the end
+    of the last successful window. The next window starts `overlap` before
+    it (to catch late-arriving fixes), but never earlier than `catch_up`
+    before now. Devices with no state start `initial` before now. Long
+    windows are fetched in `chunk`-sized pieces when set.
+    """
+    overlap: timedelta = timedelta(minutes=2)
+    catch_up: timedelta = timedelta(hours=24)
+    initial: timedelta = timedelta(minutes=15)
+    chunk: Optional[timedelta] = None
+
+    def window_start(self, state: Optional[Dict[str, Any]], now: datetime) -> datetime:
+        mark = high_water_mark(state)
+        if mark is None:
+            return now - self.initial
+        # A device clock running ahead leaves a future watermark; never start the window after now
+        mark = min(mark, now)
+        return max(mark - self.overlap, now - self.catch_up)
+
+
+def high_water_mark(state: Optional[Dict[str, Any]]) -> Optional[datetime]:
+    if not state:
+        return None
+    marks = [m for m in (state.get("watermark"), state.get("synced_until")) if m]
+    return max(marks) if marks else None
+
+
+def device_lag(state: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    """Freshness of one device: age of the newest point and of the last sync."""
+    watermark = state.get("watermark")
+    synced_until = state.get("synced_until")
+    return {
+        "sn": state["sn"],
+        "watermark": watermark,
+        "synced_until": synced_until,
+        "lag_seconds": (now - watermark).total_seconds() if watermark else None,
+        "sync_lag_seconds": (now - synced_until).total_seconds() if synced_until else None,
+        "poll_interval": state.get("poll_interval"),
+        "next_poll_at": state.get("next_poll_at"),
+    }
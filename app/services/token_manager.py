@@ -0,0 +1,269 @@
+# app/services/token_manager.py
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from bson import ObjectId
+
+from app.services.citytag import CityTagAuthError, CityTagClient, CityTagError
+from app.services.metrics import TOKEN_LOGINS
+from app.services.mongodb import MongoService
+
+
+T = TypeVar("T")
+
+LIFETIME_KEYS = ("expires_in", "expiresIn", "expire", "expireTime", "tokenExpire")
+
+
+@dataclass
+class _TokenEntry:
+    token: str
+    obtained_at: float
+    lifetime: Optional[float] = None  # seconds, when CityTag told us
+    invalid: bool = False
+
+
+@dataclass
+class _Subject:
+    user_id: str
+    email: str
+    password: str
+    uid: str
+    token: Optional[str]
+    token_at: Optional[datetime]
+
+
+def _subject(user: Any) -> _Subject:
+    """Accept either a users document or a UserInDB."""
+    if isinstance(user, dict):
+        get = user.get
+        user_id = get("_id")
+    else:
+        get = lambda key: getattr(user, key, None)  # noqa: E731
+        user_id = user.id
+    return _Subject(
+        user_id=str(user_id),
+        email=get("email"),
+        password=get("password"),
+        uid=get("uid"),
+        token=get("citytag_token"),
+        token_at=get("citytag_token_at"),
+    )
+
+
+def _lifetime_from(login_data: Dict[str, Any]) -> Optional[float]:
+    for key in LIFETIME_KEYS:
+        value = login_data.get(key)
+        if isinstance(value, (int, float)) and value > 0:
+            # Absolute epoch (ms or s) vs relative seconds
+            if value > 1e12:
+                return value / 1000 - time.time()
+            if value > 1e9:
+                return value - time.time()
+            return float(value)
+    return None
+
+
+class TokenManager:
+    """
+    Process-wide CityTag token cache shared by the API routers and sync.
+
+    Tokens are refreshed ahead of expiry when their lifetime is known (from
+    the login response) or learned (from how long previous tokens lasted
+    before CityTag rejected them). Refreshes are serialized per user, and
+    before logging in we re-read the user so a token another worker just
+    obtained is adopted instead of triggering a second login.
+    """
+
+    def __init__(
+        self,
+        mongo: MongoService,
+        citytag: CityTagClient,
+        refresh_margin: float = 300,
+        min_lifetime: float = 300,
+    ):
+        self.mongo = mongo
+        self.citytag = citytag
+        self.refresh_margin = refresh_margin
+        self.min_lifetime = min_lifetime
+        self.learned_lifetime: Optional[float] = None
+        self._entries: Dict[str, _TokenEntry] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._background: Dict[str, asyncio.Task] = {}
+        self.logins = 0
+        self.adopted = 0
+        self.proactive_refreshes = 0
+        self.auth_failures = 0
+
+    # ── lifetime bookkeeping ──────────────────────────────
+
+    def _lifetime(self, entry: _TokenEntry) -> Optional[float]:
+        return entry.lifetime or self.learned_lifetime
+
+    def _remaining(self, entry: _TokenEntry) -> Optional[float]:
+        lifetime = self._lifetime(entry)
+        if lifetime is None:
+            return None
+        return entry.obtained_at + lifetime - time.time()
+
+    def _needs_refresh(self, entry: _TokenEntry) -> bool:
+        if entry.invalid:
+            return True
+        remaining = self._remaining(entry)
+        if remaining is None:
+            return False
+        margin = min(self.refresh_margin, (self._lifetime(entry) or 0) * 0.2)
+        return remaining <= margin
+
+    def _usable(self, entry: _TokenEntry) -> bool:
+        if entry.invalid:
+            return False
+        remaining = self._remaining(entry)
+        return remaining is None or remaining > 0
+
+    def store(self, user: Any, token: str, lifetime: Optional[float] = None, obtained_at: Optional[float] = None) -> None:
+        subject = _subject(user)
+        self._entries[subject.user_id] = _TokenEntry(token, obtained_at or time.time(), lifetime)
+
+    def store_login(self, user: Any, login_data: Dict[str, Any]) -> str:
+        """Store the token from a CityTag login response, with its lifetime when given."""
+        token = login_data["token"]
+        self.store(user, token, lifetime=_lifetime_from(login_data))
+        return token
+
+    # ── public API ────────────────────────────────────────
+
+    async def get_token(self, user: Any) -> str:
+        subject = _subject(user)
+        entry = self._entries.get(subject.user_id)
+        if entry is None and subject.token:
+            obtained = subject.token_at.timestamp() if subject.token_at else time.time()
+            entry = _TokenEntry(subject.token, obtained)
+            self._entries[subject.user_id] = entry
+
+        if entry is not None and not self._needs_refresh(entry):
+            return entry.token
+        if entry is not None and self._usable(entry):
+            # Close to expiry but still valid: refresh without making the caller wait
+            self._refresh_in_background(user, entry.token)
+            return entry.token
+        return await self.refresh(user, stale_token=entry.token if entry else None)
+
+    async def refresh(self, user: Any, stale_token: Optional[str] = None) -> str:
+        """Return a fresh token, logging in at most once per user at a time."""
+        subject = _subject(user)
+        lock = self._locks.setdefault(subject.user_id, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(subject.user_id)
+            if entry is not None and entry.token != stale_token and not self._needs_refresh(entry):
+                return entry.token
+
+            doc = await self.mongo.users.find_one(
+                {"_id": ObjectId(subject.user_id)},
+                {"citytag_token": 1, "citytag_token_at": 1},
+            )
+            if doc and doc.get("citytag_token") and doc["citytag_token"] != stale_token:
+                token_at = doc.get("citytag_token_at")
+                adopted = _TokenEntry(doc["citytag_token"], token_at.timestamp() if token_at else time.time())
+                if not self._needs_refresh(adopted):
+                    self._entries[subject.user_id] = adopted
+                    self.adopted += 1
+                    return adopted.token
+
+            if entry is None:
+                reason = "missing"
+            elif entry.invalid:
+                reason = "rejected"
+            else:
+                reason = "expiring"
+            data = await self.citytag.login(username=subject.email, password=subject.password)
+            token = data.get("token")
+            if not token:
+                raise CityTagError("CityTag did not return a token")
+            self.logins += 1
+            TOKEN_LOGINS.inc(reason=reason)
+            self._entries[subject.user_id] = _TokenEntry(token, time.time(), _lifetime_from(data))
+            await self.mongo.update_user_token(subject.user_id, token)
+            return token
+
+    def report_auth_failure(self, user: Any, token: str) -> None:
+        """CityTag rejected `token`: learn how long it lasted and mark it invalid."""
+        subject = _subject(user)
+        entry = self._entries.get(subject.user_id)
+        if entry is None or entry.token != token or entry.invalid:
+            return
+        self.auth_failures += 1
+        entry.invalid = True
+        observed = max(self.min_lifetime, time.time() - entry.obtained_at)
+        if self.learned_lifetime is None:
+            self.learned_lifetime = observed
+        else:
+            self.learned_lifetime = 0.7 * self.learned_lifetime + 0.3 * observed
+
+    async def call(self, user: Any, fn: Callable[[str], Awaitable[T]]) -> T:
+        """Run `fn(token)`, refreshing the token and retrying once if CityTag rejects it."""
+        token = await self.get_token(user)
+        try:
+            return await fn(token)
+        except CityTagAuthError:
+            self.report_auth_failure(user, token)
+            token = await self.refresh(user, stale_token=token)
+            return await fn(token)
+
+    def _refresh_in_background(self, user: Any, stale_token: str) -> None:
+        key = _subject(user).user_id
+        task = self._background.get(key)
+        if task is not None and not task.done():
+            return
+        self.proactive_refreshes += 1
+
+        async def run() -> None:
+            try:
+                await self.refresh(user, stale_token=stale_token)
+            except Exception as exc:
+                print(f"⚠ Proactive token refresh failed for user {key}: {exc}")
+
+        task = asyncio.create_task(run())
+        self._background[key] = task
+        task.add_done_callback(lambda _: self._background.pop(key, None))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cached_tokens": len(self._entries),
+            "logins": self.logins,
+            "adopted": self.adopted,
+            "proactive_refreshes": self.proactive_refreshes,
+            "auth_failures": self.auth_failures,
+            "learned_lifetime_seconds": round(self.learned_lifetime, 1) if self.learned_lifetime else None,
+        }
+
+    async def close(self) -> None:
+        tasks = list(self._background.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# ────────────────────────────────────────────────
+#          Process-wide shared TokenManager
+# ────────────────────────────────────────────────
+
+_shared_manager: Optional[TokenManager] = None
+
+
+def get_shared_token_manager() -> Optional[TokenManager]:
+    return _shared_manager
+
+
+def set_shared_token_manager(manager: Optional[TokenManager]) -> None:
+    global _shared_manager
+    _shared_manager = manager
+
+
+async def close_shared_token_manager() -> None:
+    global _shared_manager
+    if _shared_manager is not None:
+        await _shared_manager.close()
+        _shared_manager = None
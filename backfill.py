@@ -0,0 +1,89 @@
+# backfill.py
+"""
+Backfill months of CityTag history for one device (or all of a user's devices).
+
+    python backfill.py --email user@example.com --sn 12345 --start 2025-01-01
+    python backfill.py --uid 251527 --all-devices --start 2025-01-01 --end 2025-04-01 --concurrency 8
+
+Finished chunks are recorded in Mongo, so an interrupted run can simply be
+started again with the same arguments and picks up the remaining chunks.
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+
+from app.dependencies import (
+    close_citytag_client,
+    close_device_catalog,
+    close_mongo_service,
+    close_token_manager,
+    get_device_catalog,
+    get_token_manager,
+    init_citytag_client,
+    init_mongo_service,
+)
+from app.services.backfill import DEFAULT_CONCURRENCY, BackfillJob
+from app.services.location_store import naive_utc
+
+
+def _parse_time(value: str) -> datetime:
+    # "Z" is only accepted by fromisoformat from 3.11; offsets give an aware datetime, the job needs naive UTC
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return naive_utc(datetime.fromisoformat(value))
+
+
+async def main(args: argparse.Namespace) -> int:
+    mongo = init_mongo_service()
+    citytag = init_citytag_client()
+    tokens = get_token_manager()
+    try:
+        query = {"email": args.email} if args.email else {"uid": args.uid}
+        user = await mongo.users.find_one(query)
+        if not user:
+            print(f"No user matching {query}")
+            return 1
+
+        if args.all_devices:
+            devices = await tokens.call(user, lambda token: get_device_catalog().refresh(uid=user["uid"], token=token))
+            serials = [d["sn"] for d in devices if d.get("sn")]
+        else:
+            serials = [args.sn]
+
+        end = args.end or datetime.utcnow()
+        failed = 0
+        for sn in serials:
+            job = BackfillJob(
+                mongo,
+                citytag,
+                tokens,
+                user,
+                sn=sn,
+                start=args.start,
+                end=end,
+                chunk=timedelta(hours=args.chunk_hours),
+                concurrency=args.concurrency,
+            )
+            progress = await job.run()
+            failed += progress.chunks_failed
+        return 1 if failed else 0
+    finally:
+        await close_device_catalog()
+        await close_token_manager()
+        await close_citytag_client()
+        close_mongo_service()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunked, resumable CityTag history backfill")
+    who = parser.add_mutually_exclusive_group(required=True)
+    who.add_argument("--email")
+    who.add_argument("--uid")
+    which = parser.add_mutually_exclusive_group(required=True)
+    which.add_argument("--sn")
+    which.add_argument("--all-devices", action="store_true")
+    parser.add_argument("--start", type=_parse_time, required=True, help="UTC, ISO format")
+    parser.add_argument("--end", type=_parse_time, default=None, help="UTC, ISO format (default: now)")
+    parser.add_argument("--chunk-hours", type=float, default=24)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
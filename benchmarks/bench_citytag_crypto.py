@@ -0,0 +1,95 @@
+# benchmarks/bench_citytag_crypto.py
+"""
+Micro-benchmark for CityTag payload crypto.
+
+Compares building a fresh 3DES key/cipher on every call (the old behaviour)
+with the token-keyed cipher cache, for a small request payload and for a
+500-point history response.
+
+    python -m benchmarks.bench_citytag_crypto
+"""
+import base64
+import json
+import random
+import timeit
+
+from Crypto.Cipher import DES3
+from Crypto.Util.Padding import pad, unpad
+
+from app.services.citytag import (
+    BLOCK_SIZE,
+    _build_3des_key,
+    decrypt_payload,
+    encrypt_payload,
+)
+
+
+TOKEN = "f3a9c1d27b4e8f6a0c5d9e2b71a4c8d3"
+
+
+def _uncached_encrypt(payload, token):
+    cipher = DES3.new(_build_3des_key(token), DES3.MODE_ECB)
+    plaintext = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.b64encode(cipher.encrypt(pad(plaintext, BLOCK_SIZE))).decode("utf-8")
+
+
+def _uncached_decrypt(ciphertext, token):
+    cipher = DES3.new(_build_3des_key(token), DES3.MODE_ECB)
+    padded = cipher.decrypt(base64.b64decode(ciphertext))
+    return json.loads(unpad(padded, BLOCK_SIZE).decode("utf-8"))
+
+
+def _history(points: int) -> dict:
+    rng = random.Random(42)
+    return {
+        "history": [
+            {
+                "sn": "BENCH0001",
+                "gpstime": 1_700_000_000_000 + i * 10_000,
+                "lat": 24.86 + rng.uniform(-0.01, 0.01),
+                "lng": 67.00 + rng.uniform(-0.01, 0.01),
+            }
+            for i in range(points)
+        ]
+    }
+
+
+def _report(label: str, uncached: float, cached: float, number: int) -> None:
+    per_old = uncached / number * 1e6
+    per_new = cached / number * 1e6
+    print(
+        f"{label:<28} uncached {per_old:9.1f} µs   cached {per_new:9.1f} µs   "
+        f"saved {per_old - per_new:8.1f} µs/call ({(1 - per_new / per_old) * 100:5.1f}%)"
+    )
+
+
+def main() -> None:
+    request = {"uid": 251527, "sn": "BENCH0001", "pageNo": 1, "pageSize": 500}
+    small_ct = encrypt_payload(request, TOKEN)
+    large_ct = encrypt_payload(_history(500), TOKEN)
+    print(f"history payload: {len(large_ct)} base64 chars\n")
+
+    n = 5000
+    _report(
+        "encrypt request",
+        timeit.timeit(lambda: _uncached_encrypt(request, TOKEN), number=n),
+        timeit.timeit(lambda: encrypt_payload(request, TOKEN), number=n),
+        n,
+    )
+    _report(
+        "decrypt small response",
+        timeit.timeit(lambda: _uncached_decrypt(small_ct, TOKEN), number=n),
+        timeit.timeit(lambda: decrypt_payload(small_ct, TOKEN), number=n),
+        n,
+    )
+    n = 200
+    _report(
+        "decrypt 500-point history",
+        timeit.timeit(lambda: _uncached_decrypt(large_ct, TOKEN), number=n),
+        timeit.timeit(lambda: decrypt_payload(large_ct, TOKEN), number=n),
+        n,
+    )
+
+
+if __name__ == "__main__":
+    main()
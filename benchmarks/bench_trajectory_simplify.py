@@ -0,0 +1,53 @@
+# benchmarks/bench_trajectory_simplify.py
+"""
+Trajectory simplification: points kept, GeoJSON payload size and time spent
+for a week of 10-second fixes (~60k points) at typical map zoom levels.
+
+    python -m benchmarks.bench_trajectory_simplify
+"""
+import json
+import math
+import random
+import time
+
+from app.services.simplify import simplify_coordinates, zoom_tolerance_m
+
+
+def _week_of_fixes(points: int = 7 * 24 * 360) -> list:
+    """A vehicle-like track: mostly straight legs, occasional turns and stops, plus GPS jitter."""
+    rng = random.Random(42)
+    lat, lng = 24.86, 67.00
+    heading = rng.uniform(0, 2 * math.pi)
+    coords = []
+    for _ in range(points):
+        if rng.random() < 0.02:
+            heading += rng.uniform(-math.pi / 2, math.pi / 2)
+        speed = 0.0 if rng.random() < 0.3 else rng.uniform(5, 15)  # m/s
+        lat += speed * 10 * math.cos(heading) / 111_320
+        lng += speed * 10 * math.sin(heading) / (111_320 * math.cos(math.radians(lat)))
+        coords.append([lng + rng.gauss(0, 3e-5), lat + rng.gauss(0, 3e-5)])
+    return coords
+
+
+def _payload_bytes(coords: list) -> int:
+    return len(json.dumps({"type": "LineString", "coordinates": coords}, separators=(",", ":")))
+
+
+def main() -> None:
+    coords = _week_of_fixes()
+    full = _payload_bytes(coords)
+    print(f"original: {len(coords)} points, {full / 1024:.0f} KiB\n")
+    for zoom in (10, 13, 15, 17):
+        tolerance = zoom_tolerance_m(zoom, coords[0][1])
+        started = time.perf_counter()
+        simplified = simplify_coordinates(coords, tolerance)
+        elapsed = (time.perf_counter() - started) * 1000
+        size = _payload_bytes(simplified)
+        print(
+            f"zoom {zoom:>2} (tol {tolerance:7.1f} m): {len(simplified):6d} points "
+            f"({len(coords) / len(simplified):6.1f}x fewer), {size / 1024:7.1f} KiB, {elapsed:6.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
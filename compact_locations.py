@@ -0,0 +1,45 @@
+# compact_locations.py
+"""
+Run one retention compaction pass now, outside the API's background loop.
+
+    RETENTION_TIERS=30d:1m,365d:10m python compact_locations.py
+    RETENTION_TIERS=30d:1m,365d:10m python compact_locations.py --budget 600
+
+Points older than each tier's age are downsampled into that tier and the
+originals deleted. Safe to interrupt: the next pass continues where the
+data says this one stopped.
+"""
+import argparse
+import asyncio
+
+from app.dependencies import close_mongo_service, get_settings, init_mongo_service
+from app.services.indexes import ensure_indexes
+from app.services.location_store import TieredLocationStore
+from app.services.retention import RetentionCompactor
+from app.services.sync_checkpoint import TimeBudget
+
+
+async def main(args: argparse.Namespace) -> int:
+    if not get_settings()["retention_tiers"]:
+        print("RETENTION_TIERS is empty — nothing to compact")
+        return 1
+    mongo = init_mongo_service()
+    try:
+        store = mongo.location_store
+        if not isinstance(store, TieredLocationStore):
+            raise RuntimeError(f"Expected a tiered location store, got {type(store).__name__}")
+        await ensure_indexes(mongo.db, store)
+        budget = TimeBudget(args.budget) if args.budget > 0 else None
+        stats = await RetentionCompactor(mongo, store).run(budget)
+        print(f"✅ {stats.devices} devices, {stats.chunks} day(s) compacted, kept {stats.kept}, removed {stats.removed}")
+        if not stats.complete:
+            print("Budget reached — run again to continue")
+        return 0
+    finally:
+        close_mongo_service()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Downsample old location points into retention tiers")
+    parser.add_argument("--budget", type=float, default=0, help="Stop after this many seconds (0 = run to completion)")
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,39 @@
+# dedupe_locations.py
+"""
+Remove duplicate (uid, sn, timestamp) documents from `locations`, keeping
+the newest of each, then build the unique index they were blocking.
+
+    python dedupe_locations.py --dry-run     # count only
+    python dedupe_locations.py
+
+Startup never deletes points; it only reports that the unique index is
+missing. This scans the whole collection, so run it off-peak.
+"""
+import argparse
+import asyncio
+import time
+
+from app.dependencies import close_mongo_service, init_mongo_service
+from app.services.indexes import ensure_indexes, remove_duplicate_locations
+
+
+async def main(args: argparse.Namespace) -> int:
+    mongo = init_mongo_service()
+    try:
+        started = time.perf_counter()
+        removed = await remove_duplicate_locations(mongo.db, dry_run=args.dry_run)
+        elapsed = time.perf_counter() - started
+        if args.dry_run:
+            print(f"🔍 {removed} duplicate location documents would be removed ({elapsed:.1f}s)")
+            return 0
+        print(f"🧹 Removed {removed} duplicate location documents ({elapsed:.1f}s)")
+        await ensure_indexes(mongo.db)
+        return 0
+    finally:
+        close_mongo_service()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete duplicate location documents and build the unique index")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the duplicates")
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,87 @@
+# migrate_locations.py
+"""
+Copy location points from the per-point `locations` collection into hourly
+`location_buckets` documents.
+
+    python migrate_locations.py                      # every device
+    python migrate_locations.py --uid 251527 --sn 12345 --verify
+
+The copy is idempotent (bucket writes are upserts), so it can be interrupted
+and re-run. To switch over without losing points:
+
+    1. run the migration
+    2. deploy with LOCATION_STORAGE=buckets
+    3. run the migration once more to pick up points written in between
+
+`locations` is left untouched; drop it once the bucket store is trusted.
+"""
+import argparse
+import asyncio
+import time
+
+from app.dependencies import close_mongo_service, init_mongo_service
+from app.services.indexes import ensure_indexes
+from app.services.location_store import BucketLocationStore, DocumentLocationStore
+
+
+async def migrate_device(source: DocumentLocationStore, target: BucketLocationStore, uid: str, sn: str, batch_size: int) -> tuple:
+    copied = inserted = 0
+    batch = []
+    cursor = source.collection.find(
+        {"uid": uid, "sn": sn},
+        {"_id": 0, "uid": 1, "sn": 1, "timestamp": 1, "lat": 1, "lng": 1},
+        sort=[("timestamp", 1)],
+        batch_size=batch_size,
+    )
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            inserted += (await target.write(batch)).inserted
+            copied += len(batch)
+            batch = []
+    if batch:
+        inserted += (await target.write(batch)).inserted
+        copied += len(batch)
+    return copied, inserted
+
+
+async def main(args: argparse.Namespace) -> int:
+    mongo = init_mongo_service()
+    try:
+        await ensure_indexes(mongo.db)
+        source = DocumentLocationStore(mongo.db)
+        target = BucketLocationStore(mongo.db)
+
+        match = {key: value for key, value in (("uid", args.uid), ("sn", args.sn)) if value}
+        pipeline = [{"$match": match}, {"$group": {"_id": {"uid": "$uid", "sn": "$sn"}}}, {"$sort": {"_id": 1}}]
+        devices = [row["_id"] async for row in source.collection.aggregate(pipeline, allowDiskUse=True)]
+        print(f"📦 Migrating {len(devices)} device(s) to {target.collection.name}")
+
+        started = time.perf_counter()
+        total = mismatched = 0
+        for device in devices:
+            uid, sn = device["uid"], device["sn"]
+            copied, inserted = await migrate_device(source, target, uid, sn, args.batch_size)
+            total += copied
+            line = f"   uid={uid} sn={sn}: {copied} points read, {inserted} new in buckets"
+            if args.verify:
+                expected, actual = await source.count(uid, sn), await target.count(uid, sn)
+                if actual < expected:
+                    mismatched += 1
+                    line += f" ⚠ bucket count {actual} < source count {expected}"
+            print(line)
+
+        elapsed = time.perf_counter() - started
+        print(f"✅ Migrated {total} points in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} pts/s)")
+        return 1 if mismatched else 0
+    finally:
+        close_mongo_service()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate locations into hourly bucket documents")
+    parser.add_argument("--uid")
+    parser.add_argument("--sn")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--verify", action="store_true", help="Compare per-device point counts afterwards")
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
@@ -6,6 +6,8 @@ from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from app.services.indexes import ensure_indexes
+
 
 DB_NAME = "citytag_dashboard"
 
@@ -65,19 +67,8 @@ async def main() -> None:
     locations = db["locations"]
     print("\nEnsuring indexes on locations collection...")
 
-    # Primary index: fast queries by user + device + time range
-    await locations.create_index(
-        [("uid", 1), ("sn", 1), ("timestamp", 1)],
-        name="uid_sn_timestamp_asc",
-        background=True
-    )
-
-    # Optional: fast sort by most recent first
-    await locations.create_index(
-        [("timestamp", -1)],
-        name="timestamp_desc",
-        background=True
-    )
+    # Same index set the app ensures at startup (unique uid+sn+timestamp, covering lat/lng, ...)
+    await ensure_indexes(db)
 
     print("Indexes created (or already exist):")
     indexes = await locations.index_information()
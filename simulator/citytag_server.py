@@ -0,0 +1,280 @@
+# simulator/citytag_server.py
+"""
+Local stand-in for the CityTag API, for load and latency testing.
+
+Speaks the same protocol as app.services.citytag.CityTagClient: plain form
+login, and 3DES-ECB `encryption` envelopes for the device list and
+trajectory endpoints. Fleets and tracks are synthetic but deterministic, so
+the same window always yields the same points across pages and restarts.
+
+    python -m simulator.citytag_server --port 9100 --latency-ms 80 --error-rate 0.02
+    CITYTAG_BASE_URL=http://127.0.0.1:9100 uvicorn app.main:app
+
+Every option can also be set through a SIM_* environment variable.
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import random
+import secrets
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from app.services.citytag import decrypt_payload, encrypt_payload
+
+
+@dataclass
+class SimulatorConfig:
+    devices_per_user: int = int(os.getenv("SIM_DEVICES_PER_USER", "5"))
+    fix_interval_seconds: int = int(os.getenv("SIM_FIX_INTERVAL_SECONDS", "30"))
+    latency_ms: float = float(os.getenv("SIM_LATENCY_MS", "0"))
+    latency_jitter_ms: float = float(os.getenv("SIM_LATENCY_JITTER_MS", "0"))
+    error_rate: float = float(os.getenv("SIM_ERROR_RATE", "0"))
+    timeout_rate: float = float(os.getenv("SIM_TIMEOUT_RATE", "0"))
+    timeout_seconds: float = float(os.getenv("SIM_TIMEOUT_SECONDS", "60"))
+    token_ttl_seconds: float = float(os.getenv("SIM_TOKEN_TTL_SECONDS", "3600"))
+    max_page_size: int = int(os.getenv("SIM_MAX_PAGE_SIZE", "500"))
+    report_total: bool = os.getenv("SIM_REPORT_TOTAL", "true").lower() in ("1", "true", "yes")
+    seed: int = int(os.getenv("SIM_SEED", "1"))
+
+
+@dataclass
+class _Token:
+    value: str
+    username: str
+    expires_at: float
+
+
+@dataclass
+class _Device:
+    sn: str
+    name: str
+    profile: str  # "moving", "parked" or "offline"
+    base_lat: float
+    base_lng: float
+    phase: float
+
+
+@dataclass
+class SimulatorState:
+    config: SimulatorConfig
+    tokens: Dict[str, _Token] = field(default_factory=dict)
+    uid_tokens: Dict[str, str] = field(default_factory=dict)
+    requests: Dict[str, int] = field(default_factory=dict)
+
+
+def _rng(*parts: Any) -> random.Random:
+    digest = hashlib.sha256("|".join(str(p) for p in parts).encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def fleet_for(uid: str, config: SimulatorConfig) -> List[_Device]:
+    rng = _rng(config.seed, "fleet", uid)
+    devices = []
+    for i in range(config.devices_per_user):
+        roll = rng.random()
+        profile = "moving" if roll < 0.6 else "parked" if roll < 0.9 else "offline"
+        devices.append(_Device(
+            sn=f"SIM{uid}{i:04d}",
+            name=f"Sim tag {i + 1}",
+            profile=profile,
+            base_lat=24.80 + rng.uniform(0, 0.15),
+            base_lng=66.95 + rng.uniform(0, 0.15),
+            phase=rng.uniform(0, 2 * math.pi),
+        ))
+    return devices
+
+
+def _position(device: _Device, ts: int) -> Tuple[float, float]:
+    if device.profile != "moving":
+        return round(device.base_lat, 6), round(device.base_lng, 6)
+    # Smooth closed loops: continuous in time and cheap to evaluate per slot
+    t = ts / 3600.0
+    lat = device.base_lat + 0.02 * math.sin(t * 1.3 + device.phase) + 0.005 * math.sin(t * 7.1)
+    lng = device.base_lng + 0.02 * math.cos(t * 0.9 + device.phase) + 0.005 * math.cos(t * 5.3)
+    return round(lat, 6), round(lng, 6)
+
+
+def _interval(device: _Device, config: SimulatorConfig) -> int:
+    # Parked tags report rarely
+    return config.fix_interval_seconds * (20 if device.profile == "parked" else 1)
+
+
+def track_page(device: _Device, begin: int, end: int, page_no: int, page_size: int, config: SimulatorConfig) -> Tuple[List[Dict[str, Any]], int]:
+    """One page of fixes in [begin, end] (epoch seconds), plus the total count."""
+    interval = _interval(device, config)
+    if device.profile == "offline":
+        end = min(end, int(time.time()) - 3 * 86400)
+    first = -(-begin // interval)
+    last = end // interval
+    total = max(0, last - first + 1)
+    start = first + (page_no - 1) * page_size
+    stop = min(last, start + page_size - 1)
+
+    points = []
+    for slot in range(start, stop + 1):
+        ts = slot * interval
+        lat, lng = _position(device, ts)
+        points.append({"sn": device.sn, "gpstime": ts * 1000, "lat": lat, "lng": lng})
+    return points, total
+
+
+def create_simulator(config: Optional[SimulatorConfig] = None) -> FastAPI:
+    state = SimulatorState(config or SimulatorConfig())
+    sim = FastAPI(title="CityTag Simulator")
+    sim.state.simulator = state
+
+    async def misbehave(endpoint: str) -> Optional[JSONResponse]:
+        cfg = state.config
+        state.requests[endpoint] = state.requests.get(endpoint, 0) + 1
+        delay = cfg.latency_ms + random.uniform(-cfg.latency_jitter_ms, cfg.latency_jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        roll = random.random()
+        if roll < cfg.timeout_rate:
+            await asyncio.sleep(cfg.timeout_seconds)
+        elif roll < cfg.timeout_rate + cfg.error_rate:
+            return JSONResponse({"code": "50000", "msg": "Simulated upstream failure"}, status_code=503)
+        return None
+
+    def open_envelope(uid: str, encryption: str) -> Tuple[Optional[str], Optional[dict], Optional[str]]:
+        """Find the token that decrypts this request. Returns (token, payload, error_msg)."""
+        candidates = []
+        if uid in state.uid_tokens:
+            candidates.append(state.uid_tokens[uid])
+        candidates.extend(t for t in reversed(list(state.tokens)) if t not in candidates)
+
+        for value in candidates:
+            try:
+                payload = decrypt_payload(encryption, value)
+            except Exception:
+                continue
+            if not isinstance(payload, dict):
+                continue
+            if state.tokens[value].expires_at < time.time():
+                return None, None, "Token expired, please login again"
+            state.uid_tokens[uid] = value
+            return value, payload, None
+        return None, None, "Invalid token"
+
+    def envelope(data: Any, token: str) -> JSONResponse:
+        return JSONResponse({"code": "00000", "msg": "success", "data": encrypt_payload(data, token)})
+
+    @sim.post("/api/interface/login")
+    async def login(request: Request):
+        if (failure := await misbehave("login")) is not None:
+            return failure
+        form = parse_qs((await request.body()).decode("utf-8"))
+        username = (form.get("username") or [""])[0]
+        password = (form.get("password") or [""])[0]
+        if not username or not password:
+            return JSONResponse({"code": "10002", "msg": "Wrong username or password"})
+        value = secrets.token_hex(12)
+        state.tokens[value] = _Token(value, username, time.time() + state.config.token_ttl_seconds)
+        return {"code": "00000", "msg": "success", "data": {"token": value, "username": username}}
+
+    @sim.post("/api2/v4/device/{uid}")
+    async def devices(uid: str, request: Request):
+        if (failure := await misbehave("devices")) is not None:
+            return failure
+        body = await request.json()
+        token, payload, error = open_envelope(uid, body.get("encryption", ""))
+        if error:
+            return JSONResponse({"code": "10001", "msg": error})
+
+        fleet = fleet_for(uid, state.config)
+        if payload.get("sn"):
+            fleet = [d for d in fleet if d.sn == payload["sn"]]
+        page_no = max(1, int(payload.get("pageNo", 1)))
+        page_size = min(state.config.max_page_size, max(1, int(payload.get("pageSize", 20))))
+        page = fleet[(page_no - 1) * page_size: page_no * page_size]
+        data = {"list": [{"sn": d.sn, "name": d.name, "online": d.profile != "offline"} for d in page]}
+        if state.config.report_total:
+            data["total"] = len(fleet)
+        return envelope(data, token)
+
+    @sim.post("/api/interface/v2/device/{uid}")
+    async def trajectory(uid: str, request: Request):
+        if (failure := await misbehave("history")) is not None:
+            return failure
+        body = await request.json()
+        token, payload, error = open_envelope(uid, body.get("encryption", ""))
+        if error:
+            return JSONResponse({"code": "10001", "msg": error})
+
+        device = next((d for d in fleet_for(uid, state.config) if d.sn == payload.get("sn")), None)
+        if device is None:
+            return JSONResponse({"code": "20001", "msg": "Device not found"})
+
+        now = int(time.time())
+        page_no = max(1, int(payload.get("pageNo", 1)))
+        page_size = min(state.config.max_page_size, max(1, int(payload.get("pageSize", 20))))
+        end = min(now, int(payload.get("endTime", now * 1000)) // 1000)
+        if "beginTime" in payload:
+            begin = int(payload["beginTime"]) // 1000
+        else:
+            # "Latest location" query: exactly the most recent page, oldest first
+            interval = _interval(device, state.config)
+            begin = (end // interval - page_size + 1) * interval
+            page_no = 1
+        points, total = track_page(device, begin, end, page_no, page_size, state.config)
+
+        data: Dict[str, Any] = {"history": points}
+        if state.config.report_total:
+            data["total"] = total
+        return envelope(data, token)
+
+    @sim.post("/_sim/expire-tokens")
+    async def expire_tokens():
+        for token in state.tokens.values():
+            token.expires_at = 0
+        return {"expired": len(state.tokens)}
+
+    @sim.get("/_sim/stats")
+    async def stats():
+        return {"requests": state.requests, "tokens": len(state.tokens)}
+
+    return sim
+
+
+def main() -> None:
+    import uvicorn
+
+    defaults = SimulatorConfig()
+    parser = argparse.ArgumentParser(description="Run a local CityTag protocol simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--devices-per-user", type=int, default=defaults.devices_per_user)
+    parser.add_argument("--fix-interval", type=int, default=defaults.fix_interval_seconds)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--latency-jitter-ms", type=float, default=defaults.latency_jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--timeout-rate", type=float, default=defaults.timeout_rate)
+    parser.add_argument("--token-ttl", type=float, default=defaults.token_ttl_seconds)
+    parser.add_argument("--max-page-size", type=int, default=defaults.max_page_size)
+    parser.add_argument("--no-total", action="store_true", help="Omit page totals to force sequential paging")
+    args = parser.parse_args()
+
+    config = SimulatorConfig(
+        devices_per_user=args.devices_per_user,
+        fix_interval_seconds=args.fix_interval,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        token_ttl_seconds=args.token_ttl,
+        max_page_size=args.max_page_size,
+        report_total=defaults.report_total and not args.no_total,
+    )
+    uvicorn.run(create_simulator(config), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()